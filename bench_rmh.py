@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+"""
+    Reynir: Natural language processing for Icelandic
+
+     RMH benchmarks
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Benchmarks of parsing, sentence splitting, serialization, lemma extraction and segment merging
+     on synthetic archives (see synthetic_rmh.py), reporting docs/s, MB/s and peak RSS as JSON.
+"""
+
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import synthetic_rmh
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORK_DIR = Path("./bench_rmh")
+
+# A benchmark gets the paths of the plain and annotated archives and the options, prepares its input (which is
+# not timed) and returns a function which runs the benchmark and returns the number of documents and bytes processed
+Benchmark = Callable[[Path, Path, Dict[str, Any]], Callable[[], Tuple[int, int]]]
+
+
+def _read_members(zip_file_path: Path) -> List[Tuple[Path, bytes]]:
+    with zipfile.ZipFile(str(zip_file_path)) as archive:
+        return [(Path(x), archive.read(x)) for x in archive.namelist()]
+
+
+def bench_parse(plain: Path, annotated: Path, options: Dict[str, Any]) -> Callable[[], Tuple[int, int]]:
+    """Read each file from the zip file and stream its header and paragraphs with RMHFile.from_stream,
+    using the parser engine of the options."""
+    import rmhfile
+
+    rmhfile.configure(options["parser"])
+
+    def run():
+        documents, size = 0, 0
+        with zipfile.ZipFile(str(plain)) as archive:
+            for info in archive.infolist():
+                with archive.open(info) as item:
+                    rmhf = rmhfile.RMHFile.from_stream(item, Path(info.filename))
+                    _ = rmhf.title, rmhf.date
+                    for _ in rmhf.paragraphs():
+                        pass
+                documents += 1
+                size += info.file_size
+        return documents, size
+
+    return run
+
+
+def bench_parse_annotated(plain: Path, annotated: Path, options: Dict[str, Any]) -> Callable[[], Tuple[int, int]]:
+    """Read each file from the annotated zip file and stream its sentences and tokens with RMHFile.from_stream,
+    using the parser engine of the options."""
+    import rmhfile
+
+    rmhfile.configure(options["parser"])
+
+    def run():
+        documents, size = 0, 0
+        with zipfile.ZipFile(str(annotated)) as archive:
+            for info in archive.infolist():
+                with archive.open(info) as item:
+                    for _ in rmhfile.RMHFile.from_stream(item, Path(info.filename)).sentences():
+                        pass
+                documents += 1
+                size += info.file_size
+        return documents, size
+
+    return run
+
+
+def _document_contents(rmhf) -> Tuple:
+    """The header fields, paragraphs and sentences of a file, which must not depend on the parser engine."""
+    fields = []
+    for name in ("id", "idno", "title", "author", "date", "source", "ref"):
+        try:
+            value = getattr(rmhf, name)
+            fields.append(value() if callable(value) else value)
+        except ValueError as e:
+            fields.append(str(e))
+    return tuple(fields), [(pg.index, pg.text, pg.sentences) for pg in rmhf.paragraph_records()]
+
+
+def check_parsers(work_dir: Path, documents: int, seed: int) -> bool:
+    """Check that every parser engine, and parsing the whole file with RMHFile, gives the same header fields,
+    paragraphs, sentences and tokens for every file of plain and annotated archives of every sub-corpus layout.
+    Returns False and logs the first difference of each engine if they do not."""
+    import rmhfile
+
+    same = True
+    for subcorpus in synthetic_rmh.SUBCORPORA:
+        for archive in prepare_archives(work_dir, subcorpus, documents, seed):
+            for path, data in _read_members(archive):
+                expected = _document_contents(rmhfile.RMHFile(data.decode("utf-8"), path))
+                for engine in rmhfile.ENGINES:
+                    if _document_contents(rmhfile.RMHFile.from_stream(io.BytesIO(data), path, engine)) != expected:
+                        log.error(f"The {engine} parser engine gives a different result for {path} in {archive}")
+                        same = False
+    return same
+
+
+def _paragraphs_of(plain: Path) -> List[List[str]]:
+    import rmhfile
+
+    return [list(rmhfile.RMHFile(data.decode("utf-8"), path).paragraphs()) for path, data in _read_members(plain)]
+
+
+def bench_split(plain: Path, annotated: Path, options: Dict[str, Any]) -> Callable[[], Tuple[int, int]]:
+    """Split the paragraphs of each document into sentences with rmhsplit. Bytes are those of the paragraphs."""
+    import rmhsplit
+
+    documents = _paragraphs_of(plain)
+    rmhsplit.configure(cache_size=options["split_cache_size"], batch_chars=options["split_batch_chars"])
+
+    def run():
+        size = 0
+        for paragraphs in documents:
+            for _ in rmhsplit.split_paragraphs(paragraphs):
+                pass
+            size += sum(len(x.encode("utf-8")) for x in paragraphs)
+        return len(documents), size
+
+    return run
+
+
+def _bench_serialize(plain: Path, options: Dict[str, Any], serialize: Callable) -> Callable[[], Tuple[int, int]]:
+    import rmhfile
+    import rmhsplit
+
+    members = _read_members(plain)
+    # Parsed up front, so only the serialization (including the sentence splitting) is timed
+    documents = [rmhfile.RMHFile(data.decode("utf-8"), path) for path, data in members]
+    size = sum(len(data) for _, data in members)
+    rmhsplit.configure(cache_size=options["split_cache_size"], batch_chars=options["split_batch_chars"])
+
+    def run():
+        for rmhf in documents:
+            serialize(rmhf)
+        return len(documents), size
+
+    return run
+
+
+def bench_serialize_txt(plain: Path, annotated: Path, options: Dict[str, Any]) -> Callable[[], Tuple[int, int]]:
+    """Serialize parsed documents to text with extract_rmh.extract_rmh_to_txt, including the sentence splitting.
+    Bytes are those of the xml files."""
+    import extract_rmh
+
+    return _bench_serialize(plain, options, extract_rmh.extract_rmh_to_txt)
+
+
+def bench_serialize_jsonl(plain: Path, annotated: Path, options: Dict[str, Any]) -> Callable[[], Tuple[int, int]]:
+    """Serialize parsed documents to jsonl with extract_rmh.extract_rmh_to_json_string, including the sentence
+    splitting. Bytes are those of the xml files."""
+    import extract_rmh
+
+    return _bench_serialize(plain, options, partial(extract_rmh.extract_rmh_to_json_string, domains=None))
+
+
+def bench_lemmas(plain: Path, annotated: Path, options: Dict[str, Any]) -> Callable[[], Tuple[int, int]]:
+    """Read each annotated file from the zip file and extract its text and lemmas, as extract_lemmas.py does."""
+    import extract_lemmas
+    import rmhfile
+
+    def run():
+        documents, size = 0, 0
+        with zipfile.ZipFile(str(annotated)) as archive:
+            for info in archive.infolist():
+                with archive.open(info) as item:
+                    extract_lemmas.extract_rmh_to_lemma_pair(rmhfile.RMHFile.from_stream(item, Path(info.filename)))
+                documents += 1
+                size += info.file_size
+        return documents, size
+
+    return run
+
+
+def bench_merge(plain: Path, annotated: Path, options: Dict[str, Any]) -> Callable[[], Tuple[int, int]]:
+    """Merge the sentences of the annotated documents, as id<TAB>text lines, with merge_text_segments."""
+    import merge_text_segments
+    import rmhfile
+
+    documents = 0
+    lines: List[str] = []
+    for path, data in _read_members(annotated):
+        for sentence in rmhfile.RMHFile(data.decode("utf-8"), path).sentences():
+            lines.append(f"{sentence.index}\t{' '.join(token.text for token in sentence.tokens)}\n")
+        documents += 1
+    size = sum(len(x.encode("utf-8")) for x in lines)
+
+    def run():
+        for _ in merge_text_segments.line_merger(lines):
+            pass
+        return documents, size
+
+    return run
+
+
+def bench_extract(plain: Path, annotated: Path, options: Dict[str, Any]) -> Callable[[], Tuple[int, int]]:
+    """Extract the plain archive to text files with extract_rmh.extract_all, end to end with worker processes.
+    The peak RSS is the largest of the main process and any single worker."""
+    import extract_rmh
+
+    def run():
+        with zipfile.ZipFile(str(plain)) as archive:
+            infos = archive.infolist()
+        with tempfile.TemporaryDirectory() as out_dir:
+            extract_rmh.extract_all(
+                plain,
+                Path(out_dir),
+                flatten_depth=0,
+                accepted_suffixes=[".xml"],
+                processes=options["processes"],
+                chunksize=options["chunksize"],
+                to_jsonl=False,
+                domains=None,
+            )
+        return len(infos), sum(x.file_size for x in infos)
+
+    return run
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    "parse": bench_parse,
+    "parse_annotated": bench_parse_annotated,
+    "split": bench_split,
+    "serialize_txt": bench_serialize_txt,
+    "serialize_jsonl": bench_serialize_jsonl,
+    "lemmas": bench_lemmas,
+    "merge": bench_merge,
+    "extract": bench_extract,
+}
+
+
+def _peak_rss_mb(include_children: bool) -> float:
+    """The peak resident set size of this process (or of any of its children) in MB."""
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS and in kB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children:
+        peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * scale / 1e6
+
+
+def _run_benchmark(name: str, plain: Path, annotated: Path, options: Dict[str, Any], results) -> None:
+    """Runs in a fresh process, so the peak RSS is that of the benchmark alone (including its input)."""
+    try:
+        run = BENCHMARKS[name](plain, annotated, options)
+        start = time.perf_counter()
+        documents, size = run()
+        seconds = time.perf_counter() - start
+        results.put({
+            "documents": documents,
+            "bytes": size,
+            "seconds": seconds,
+            "peak_rss_mb": _peak_rss_mb(include_children=name == "extract"),
+        })
+    except BaseException as e:
+        results.put({"error": f"{type(e).__name__}: {e}"})
+        raise
+
+
+def run_benchmark(name: str, plain: Path, annotated: Path, options: Dict[str, Any], repeat: int = 1) -> Dict[str, Any]:
+    """Run the benchmark repeat times, each in a new process, and report the fastest run."""
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(repeat):
+        results = context.Queue()
+        process = context.Process(target=_run_benchmark, args=(name, plain, annotated, options, results))
+        process.start()
+        result = results.get()
+        process.join()
+        if "error" in result:
+            return {"benchmark": name, **result}
+        runs.append(result)
+    best = min(runs, key=lambda x: x["seconds"])
+    return {
+        "benchmark": name,
+        "documents": best["documents"],
+        "bytes": best["bytes"],
+        "seconds": best["seconds"],
+        "docs_per_s": best["documents"] / best["seconds"],
+        "mb_per_s": best["bytes"] / 1e6 / best["seconds"],
+        "peak_rss_mb": max(x["peak_rss_mb"] for x in runs),
+        "all_seconds": [x["seconds"] for x in runs],
+    }
+
+
+def prepare_archives(work_dir: Path, subcorpus: str, documents: int, seed: int) -> Tuple[Path, Path]:
+    """Generate the plain and annotated archives, unless they were generated with the same parameters before."""
+    paths = []
+    for annotated in (False, True):
+        suffix = ".ana.zip" if annotated else ".zip"
+        path = work_dir / f"synthetic-{subcorpus}-{documents}-{seed}{suffix}"
+        if not path.is_file():
+            partial_path = path.with_name(path.name + ".partial")
+            synthetic_rmh.write_archive(partial_path, subcorpus, documents, annotated=annotated, seed=seed)
+            os.replace(partial_path, path)
+        paths.append(path)
+    return paths[0], paths[1]
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any]) -> None:
+    """Print the throughput of each benchmark relative to an earlier run."""
+    earlier = {x["benchmark"]: x for x in baseline["results"] if "error" not in x}
+    print(f"{'benchmark':<16}{'docs/s':>12}{'baseline':>12}{'ratio':>8}{'RSS MB':>10}{'baseline':>10}")
+    for result in results:
+        old = earlier.get(result["benchmark"])
+        if "error" in result or old is None:
+            continue
+        print(
+            f"{result['benchmark']:<16}{result['docs_per_s']:>12.1f}{old['docs_per_s']:>12.1f}"
+            f"{result['docs_per_s'] / old['docs_per_s']:>8.2f}{result['peak_rss_mb']:>10.1f}{old['peak_rss_mb']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("Benchmark the RMH utilities on synthetic archives")
+    parser.add_argument(
+        "-o",
+        "--out_path",
+        dest="out_path",
+        type=Path,
+        default=None,
+        help="Path to the JSON file with the results. Defaults to bench-<time>.json in the work directory.",
+    )
+    parser.add_argument(
+        "--work_dir",
+        type=Path,
+        default=DEFAULT_WORK_DIR,
+        help="The directory of the generated archives, which are reused by later runs with the same parameters.",
+    )
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        choices=list(BENCHMARKS),
+        default=list(BENCHMARKS),
+        help="The benchmarks to run. Defaults to all of them.",
+    )
+    parser.add_argument("--subcorpus", choices=synthetic_rmh.SUBCORPORA, default="news", help="The layout of the archives.")
+    parser.add_argument("--documents", type=int, default=2000, help="The number of documents in each archive.")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the generated archives.")
+    parser.add_argument("--repeat", type=int, default=3, help="Run each benchmark this many times and report the fastest.")
+    parser.add_argument("--processes", type=int, default=4, help="The number of worker processes of the extract benchmark.")
+    parser.add_argument("--chunksize", type=int, default=10, help="The chunksize of the extract benchmark.")
+    parser.add_argument(
+        "--parser",
+        default="expat",
+        help="The parser engine of the parse benchmarks: expat, etree or lxml (if it is installed).",
+    )
+    parser.add_argument(
+        "--check_parsers",
+        action="store_true",
+        default=False,
+        help="Instead of benchmarking, check that all the parser engines give the same header fields, paragraphs "
+             "and sentences on plain and annotated archives of every sub-corpus layout.",
+    )
+    parser.add_argument("--split_cache_size", type=int, default=50_000, help="See extract_rmh.py --help.")
+    parser.add_argument("--split_batch_chars", type=int, default=0, help="See extract_rmh.py --help.")
+    parser.add_argument(
+        "--compare",
+        type=Path,
+        default=None,
+        help="Path to the JSON results of an earlier run, to print the change in throughput.",
+    )
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    args.work_dir.mkdir(parents=True, exist_ok=True)
+    if args.check_parsers:
+        if not check_parsers(args.work_dir, args.documents, args.seed):
+            sys.exit(1)
+        log.info("All the parser engines give the same results")
+        sys.exit(0)
+    plain, annotated = prepare_archives(args.work_dir, args.subcorpus, args.documents, args.seed)
+    options = {
+        "processes": args.processes,
+        "chunksize": args.chunksize,
+        "parser": args.parser,
+        "split_cache_size": args.split_cache_size,
+        "split_batch_chars": args.split_batch_chars,
+    }
+    results = []
+    for name in args.benchmarks:
+        result = run_benchmark(name, plain, annotated, options, repeat=args.repeat)
+        if "error" in result:
+            log.error(f"{name} failed: {result['error']}")
+        else:
+            log.info(
+                f"{name}: {result['docs_per_s']:.1f} docs/s, {result['mb_per_s']:.2f} MB/s, "
+                f"{result['peak_rss_mb']:.1f} MB peak RSS"
+            )
+        results.append(result)
+
+    out_path = args.out_path or args.work_dir / f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "archives": {"subcorpus": args.subcorpus, "documents": args.documents, "seed": args.seed},
+        "options": options,
+        "results": results,
+    }
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    log.info(f"Wrote the results to {out_path}")
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+    Reynir: Natural language processing for Icelandic
+
+     RMH catalog
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Build a SQLite catalog of the metadata in the headers of an RMH zip file,
+     and select documents from it without scanning the corpus.
+"""
+
+import logging
+import re
+import sqlite3
+import sys
+import zipfile
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from tqdm import tqdm
+
+import extract_rmh
+import rmhfile
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = Path("./rmh_catalog.sqlite")
+CATALOG_COLUMNS = [
+    "archive",
+    "member",
+    "id",
+    "idno",
+    "title",
+    "author",
+    "date",
+    "source",
+    "file_size",
+    "compress_size",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    archive TEXT NOT NULL,
+    member TEXT NOT NULL,
+    id TEXT,
+    idno TEXT,
+    title TEXT,
+    author TEXT,
+    date TEXT,
+    source TEXT,
+    file_size INTEGER,
+    compress_size INTEGER,
+    PRIMARY KEY (archive, member)
+);
+CREATE INDEX IF NOT EXISTS documents_id ON documents (id);
+CREATE INDEX IF NOT EXISTS documents_idno ON documents (idno);
+CREATE INDEX IF NOT EXISTS documents_date ON documents (date);
+CREATE INDEX IF NOT EXISTS documents_source ON documents (source);
+CREATE INDEX IF NOT EXISTS documents_author ON documents (author);
+"""
+
+HeaderRecord = Tuple[str, Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+def header_record(rmhf: rmhfile.RMHFile) -> Optional[HeaderRecord]:
+    """Return the id, idno, title, author, date and source of a file, or None if its header cannot be read.
+    Runs in a worker process on a streaming RMHFile, so only the header of the file is parsed."""
+    try:
+        try:
+            title: Optional[str] = rmhf.title
+        except ValueError:
+            title = None
+        return rmhf.id, rmhf.idno, title, rmhf.author, rmhf.date, rmhf.source
+    except (ValueError, rmhfile.ET.ParseError) as e:
+        log.debug(f"Unable to read the header of {rmhf.path}: {e}")
+        return None
+
+
+def open_catalog(catalog_path: Path) -> sqlite3.Connection:
+    """Open the catalog, creating it if it does not exist."""
+    conn = sqlite3.connect(str(catalog_path))
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def build_catalog(
+    zip_file_path: Path, catalog_path: Path, processes: int, chunksize: int, parser_engine: Optional[str] = None
+) -> None:
+    """Read the headers of all the xml files in a zip file, in parallel, with the parser_engine (by default
+    rmhfile.DEFAULT_ENGINE), and store them in the catalog. Any previous entries for the same zip file are
+    replaced. Files whose header can not be read are skipped."""
+    with zipfile.ZipFile(str(zip_file_path)) as archive:
+        file_infos = [x for x in archive.infolist() if x.filename.endswith(".xml")]
+    chunks = [file_infos[i : i + chunksize] for i in range(0, len(file_infos), chunksize)]
+    conn = open_catalog(catalog_path)
+    skipped = 0
+    with conn:
+        conn.execute("DELETE FROM documents WHERE archive = ?", (str(zip_file_path),))
+        p_bar = tqdm(desc=f"Cataloguing {zip_file_path}", total=len(file_infos), unit="files")
+        with Pool(
+            processes=processes,
+            initializer=extract_rmh._init_worker,
+            initargs=(extract_rmh.WorkerOptions(zip_file_path, header_record, parser_engine=parser_engine),),
+        ) as pool:
+            results = pool.imap(extract_rmh.extract_members, ([Path(x.filename) for x in chunk] for chunk in chunks))
+            for chunk, records in zip(chunks, results):
+                rows = []
+                for info, record in zip(chunk, records):
+                    if record is None:
+                        log.warning(f"Skipping {info.filename}, unable to read its header")
+                        skipped += 1
+                        continue
+                    rows.append((str(zip_file_path), info.filename, *record, info.file_size, info.compress_size))
+                conn.executemany(f"INSERT INTO documents VALUES ({', '.join('?' * len(CATALOG_COLUMNS))})", rows)
+                p_bar.update(len(chunk))
+        p_bar.close()
+    conn.close()
+    log.info(f"Catalogued {len(file_infos) - skipped} files from {zip_file_path}, skipped {skipped}")
+
+
+def query_catalog(
+    catalog_path: Path,
+    columns: List[str],
+    archive: Optional[Path] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    source: Optional[str] = None,
+    author: Optional[str] = None,
+    title_contains: Optional[str] = None,
+    id_regex: Optional[str] = None,
+) -> Iterator[Tuple]:
+    """Select the given columns of the documents matching all the given conditions, in archive order.
+    Dates are compared on the precision of the bound, so date_to="2001" includes all of 2001."""
+    conditions = []
+    params: List[str] = []
+    if archive is not None:
+        conditions.append("archive = ?")
+        params.append(str(archive))
+    if date_from is not None:
+        conditions.append("substr(date, 1, length(?)) >= ?")
+        params.extend([date_from, date_from])
+    if date_to is not None:
+        conditions.append("substr(date, 1, length(?)) <= ?")
+        params.extend([date_to, date_to])
+    if source is not None:
+        conditions.append("source = ?")
+        params.append(source)
+    if author is not None:
+        conditions.append("author = ?")
+        params.append(author)
+    if title_contains is not None:
+        conditions.append("instr(title, ?) > 0")
+        params.append(title_contains)
+    if id_regex is not None:
+        conditions.append("(id REGEXP ? OR idno REGEXP ?)")
+        params.extend([id_regex, id_regex])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    conn = sqlite3.connect(str(catalog_path))
+    pattern_cache = {}
+
+    def regexp(pattern: str, value: Optional[str]) -> bool:
+        if value is None:
+            return False
+        if pattern not in pattern_cache:
+            pattern_cache[pattern] = re.compile(pattern)
+        return pattern_cache[pattern].search(value) is not None
+
+    conn.create_function("REGEXP", 2, regexp, deterministic=True)
+    try:
+        yield from conn.execute(f"SELECT {', '.join(columns)} FROM documents {where} ORDER BY rowid", params)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("Build and query a catalog of the document metadata in RMH zip files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Add the headers of all the files in a zip file to the catalog")
+    build_parser.add_argument("-i", "--in_path", dest="in_path", type=Path, required=True, help="Path to RMH zip file")
+    build_parser.add_argument(
+        "-c", "--catalog", type=Path, default=DEFAULT_CATALOG_PATH, help="Path to the SQLite catalog"
+    )
+    build_parser.add_argument("--processes", type=int, default=20, help="The number of worker processes.")
+    build_parser.add_argument(
+        "--chunksize", type=int, default=100, help="The number of XML files to send to each process."
+    )
+    build_parser.add_argument(
+        "--parser",
+        choices=list(rmhfile.ENGINES),
+        default=rmhfile.DEFAULT_ENGINE,
+        help="The engine which parses the XML files, see extract_rmh.py --parser.",
+    )
+
+    query_parser = subparsers.add_parser(
+        "query", help="Print the documents matching all the given conditions, e.g. as input for extract_rmh.py --members"
+    )
+    query_parser.add_argument(
+        "-c", "--catalog", type=Path, default=DEFAULT_CATALOG_PATH, help="Path to the SQLite catalog"
+    )
+    query_parser.add_argument(
+        "--columns",
+        nargs="+",
+        choices=CATALOG_COLUMNS,
+        default=["member"],
+        help="The columns to print, tab separated. Defaults to the member name within the zip file.",
+    )
+    query_parser.add_argument("--archive", type=Path, default=None, help="Only documents from this zip file")
+    query_parser.add_argument("--date_from", default=None, help="Earliest date, e.g. 2001 or 2001-06-01")
+    query_parser.add_argument("--date_to", default=None, help="Latest date (inclusive), e.g. 2001 or 2001-06-30")
+    query_parser.add_argument("--source", default=None, help="Only documents from this source (publication)")
+    query_parser.add_argument("--author", default=None, help="Only documents by this author")
+    query_parser.add_argument("--title_contains", default=None, help="Only documents with this text in the title")
+    query_parser.add_argument("--id_regex", default=None, help="Only documents whose id or idno matches this regex")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "build":
+        build_catalog(args.in_path, args.catalog, args.processes, args.chunksize, parser_engine=args.parser)
+    else:
+        for row in query_catalog(
+            args.catalog,
+            args.columns,
+            archive=args.archive,
+            date_from=args.date_from,
+            date_to=args.date_to,
+            source=args.source,
+            author=args.author,
+            title_contains=args.title_contains,
+            id_regex=args.id_regex,
+        ):
+            print("\t".join("" if x is None else str(x) for x in row), file=sys.stdout)
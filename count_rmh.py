@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+    Reynir: Natural language processing for Icelandic
+
+     RMH frequency counter
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Count the frequencies of forms, lemmas, tags and (lemma, tag) pairs
+     in an annotated RMH zip file, in a single parallel pass with bounded memory.
+"""
+
+import heapq
+import json
+import logging
+import tempfile
+import zipfile
+from collections import Counter
+from itertools import groupby
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from tqdm import tqdm
+
+import extract_rmh
+import rmhfile
+
+log = logging.getLogger(__name__)
+
+KINDS = ["forms", "lemmas", "tags", "lemma_tags"]
+DEFAULT_MAX_ENTRIES = 10_000_000
+
+Counts = Dict[str, Counter]
+
+
+def count_tokens(rmhf: rmhfile.RMHFile) -> Counts:
+    """Count the forms, lemmas, tags and (lemma, tag) pairs of a single annotated RMHFile"""
+    counts = {kind: Counter() for kind in KINDS}
+    forms, lemmas, tags, lemma_tags = (counts[kind] for kind in KINDS)
+    for sentence in rmhf.compact_sentences():
+        forms.update(sentence.forms)
+        lemmas.update(sentence.lemmas)
+        tags.update(sentence.tags)
+        lemma_tags.update(zip(sentence.lemmas, sentence.tags))
+    return counts
+
+
+def count_members(archive_files: List[Path]) -> Tuple[Counts, int, int]:
+    """Count the tokens of a chunk of files from the archive. Runs in a worker process.
+    Returns the partial counts, the number of files and the number of files which had to be skipped."""
+    counts = {kind: Counter() for kind in KINDS}
+    skipped = 0
+    for archive_file, result in zip(archive_files, extract_rmh.extract_members(archive_files)):
+        if isinstance(result, extract_rmh.SkippedFile):
+            log.warning(f"Skipping problematic file: {archive_file} ({result.reason})")
+            skipped += 1
+            continue
+        for kind in KINDS:
+            counts[kind].update(result[kind])
+    return counts, len(archive_files), skipped
+
+
+def _encode(key) -> str:
+    """Spill files are sorted on the json encoding of the keys, which escapes tabs and newlines."""
+    return json.dumps(key, ensure_ascii=False)
+
+
+class SpillingCounter:
+    """Counts which are written to sorted spill files on disk when they grow beyond max_entries,
+    and merged when they are read back, so the memory used is bounded."""
+
+    def __init__(self, spill_dir: Path, kind: str, max_entries: int):
+        self.spill_dir = spill_dir
+        self.kind = kind
+        self.max_entries = max_entries
+        self.counts: Counter = Counter()
+        self.spill_files: List[Path] = []
+
+    def update(self, counts: Counter) -> None:
+        self.counts.update(counts)
+        if len(self.counts) > self.max_entries:
+            self.spill()
+
+    def spill(self) -> None:
+        """Write the counts in memory to a new spill file, sorted on the key."""
+        path = self.spill_dir / f"{self.kind}.{len(self.spill_files)}.tsv"
+        with open(path, "w", encoding="utf-8") as f:
+            for encoded, count in sorted((_encode(key), count) for key, count in self.counts.items()):
+                f.write(f"{encoded}\t{count}\n")
+        self.spill_files.append(path)
+        self.counts.clear()
+
+    def items(self) -> Iterator[Tuple[object, int]]:
+        """Yield the merged counts, sorted on the (encoded) key."""
+        if not self.spill_files:
+            for encoded, count in sorted((_encode(key), count) for key, count in self.counts.items()):
+                yield json.loads(encoded), count
+            return
+        if self.counts:
+            self.spill()
+        files = [open(path, "r", encoding="utf-8") for path in self.spill_files]
+        try:
+            lines = heapq.merge(*(map(lambda line: line.rstrip("\n").rsplit("\t", 1), f) for f in files))
+            for encoded, group in groupby(lines, key=lambda x: x[0]):
+                yield json.loads(encoded), sum(int(count) for _, count in group)
+        finally:
+            for f in files:
+                f.close()
+
+
+def write_counts(counter: SpillingCounter, out_path: Path, min_count: int = 1, top_k: Optional[int] = None) -> int:
+    """Write the counts of at least min_count as tsv. With top_k, only the top_k most frequent entries are written,
+    in descending order of frequency, otherwise all entries are written in lexical order. Returns the number of
+    entries written."""
+    entries: Iterator[Tuple[object, int]] = ((key, count) for key, count in counter.items() if count >= min_count)
+    if top_k is not None:
+        entries = iter(heapq.nsmallest(top_k, entries, key=lambda x: (-x[1], _encode(x[0]))))
+    written = 0
+    with open(out_path, "w", encoding="utf-8") as f:
+        for key, count in entries:
+            columns = key if isinstance(key, list) else [key]
+            f.write("\t".join(str(x).replace("\t", " ").replace("\n", " ") for x in columns) + f"\t{count}\n")
+            written += 1
+    return written
+
+
+def count_all(
+    zip_file_path: Path,
+    out_dir: Path,
+    accepted_suffixes: List[str],
+    processes: int,
+    chunksize: int,
+    min_count: int = 1,
+    top_k: Optional[int] = None,
+    max_entries: int = DEFAULT_MAX_ENTRIES,
+) -> None:
+    """Count the tokens of all the annotated files in a zip file and write a tsv file per kind of count."""
+    with zipfile.ZipFile(str(zip_file_path)) as archive:
+        archive_files = [Path(x) for x in archive.namelist() if Path(x).suffixes == accepted_suffixes]
+    chunks = [archive_files[i : i + chunksize] for i in range(0, len(archive_files), chunksize)]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    skipped = 0
+    with tempfile.TemporaryDirectory(dir=str(out_dir)) as spill_dir:
+        counters = {kind: SpillingCounter(Path(spill_dir), kind, max_entries) for kind in KINDS}
+        p_bar = tqdm(desc=f"Counting {zip_file_path}", total=len(archive_files), unit="files")
+        with Pool(
+            processes=processes,
+            initializer=extract_rmh._init_worker,
+            initargs=(extract_rmh.WorkerOptions(zip_file_path, count_tokens, skip_errors=True),),
+        ) as pool:
+            for counts, chunk_files, chunk_skipped in pool.imap_unordered(count_members, chunks):
+                for kind in KINDS:
+                    counters[kind].update(counts[kind])
+                skipped += chunk_skipped
+                p_bar.update(chunk_files)
+        p_bar.close()
+        for kind in KINDS:
+            written = write_counts(counters[kind], out_dir / f"{kind}.tsv", min_count=min_count, top_k=top_k)
+            log.info(f"Wrote {written} {kind} to {out_dir / f'{kind}.tsv'}")
+    if skipped:
+        log.warning(f"Skipped {skipped} of {len(archive_files)} files which could not be parsed")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("Count forms, lemmas, tags and (lemma, tag) pairs in an annotated RMH zip file")
+    parser.add_argument("-i", "--in_path", dest="in_path", type=Path, required=True, help="Path to RMH zip file")
+    parser.add_argument(
+        "-o",
+        "--out_dir",
+        dest="out_dir",
+        type=Path,
+        default=Path("./rmh_counts"),
+        help="Path to the output directory, where forms.tsv, lemmas.tsv, tags.tsv and lemma_tags.tsv are written",
+    )
+    parser.add_argument(
+        "--suffixes",
+        nargs="+",
+        default=[".ana", ".xml"],
+        help="The suffixes of the files to count. Defaults to .ana .xml, i.e. files ending with .ana.xml",
+    )
+    parser.add_argument("--processes", type=int, default=20, help="The number of worker processes.")
+    parser.add_argument("--chunksize", type=int, default=50, help="The number of XML files to send to each process.")
+    parser.add_argument("--min_count", type=int, default=1, help="Only write entries with at least this count")
+    parser.add_argument(
+        "--top_k",
+        type=int,
+        default=None,
+        help="Only write the k most frequent entries of each kind, in descending order of frequency. "
+             "Otherwise all entries are written in lexical order.",
+    )
+    parser.add_argument(
+        "--max_entries",
+        type=int,
+        default=DEFAULT_MAX_ENTRIES,
+        help="The number of distinct entries of each kind kept in memory before they are spilled to disk.",
+    )
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    count_all(
+        args.in_path,
+        args.out_dir,
+        args.suffixes,
+        args.processes,
+        args.chunksize,
+        min_count=args.min_count,
+        top_k=args.top_k,
+        max_entries=args.max_entries,
+    )
@@ -22,74 +22,84 @@
 """
 
 
-import rmhfile
+import logging
 import os
 import sys
-import multiprocessing as mp
 from pathlib import Path
+from typing import Iterable, Tuple
 
+import extract_rmh
+import rmhfile
 
-def extract_single_file(input_path, output_dir, out_stem):
-    rmhf = rmhfile.RMHFile(input_path)
-
-    with open(output_dir/(out_stem+".is_IS"), "w") as f_is, \
-         open(output_dir/(out_stem+".is_LEM"), "w") as f_lem:
-        for s in rmhf.sentences:
-            is_buf = []
-            lem_buf = []
-            for t in s.tokens:
-                is_buf.append(t.text)
-                lem_buf.append(t.lemma)
-
-            f_is.write(" ".join(is_buf) + "\n")
-            f_lem.write(" ".join(lem_buf) + "\n")
-
-
-def process_queue(q, iolock):
-    while True:
-        args = q.get()
-        if args is None:
-            break
-        try:
-            extract_single_file(*args)
-        except Exception as e:
-            with iolock:
-                print(f"Skipping problematic file: {Path(root)/relpath/fn}")
-
-
-def find_files(input_path):
-    for d, _, files in os.walk(input_path):
-        for f in files:
-            if f.endswith(".xml"):
-                yield (input_path, os.path.relpath(d, input_path), f)
-
-
-def extract_lemmas(input_path, output_path):
-    q = mp.Queue(maxsize=16)
-    iolock = mp.Lock()
-    p = mp.Pool(16, initializer=process_queue, initargs=(q, iolock))
-    for root, relpath, fn in find_files(input_path):
-        out_dir = Path(output_path)/relpath
-        out_dir.mkdir(exist_ok=True, parents=True)
-
-        q.put((Path(root)/relpath/fn, out_dir, Path(fn).stem))
-
-    """ non-mp version
-    for root, relpath, fn in find_files(input_path):
-        out_dir = Path(output_path)/relpath
-        out_dir.mkdir(exist_ok=True, parents=True)
-        try:
-            extract_single_file(Path(root)/relpath/fn, out_dir, Path(fn).stem)
-        except Exception as e:
-            print(f"Skipping problematic file: {Path(root)/relpath/fn}")
-    """
+TEXT_SUFFIX = ".is_IS"
+LEMMA_SUFFIX = ".is_LEM"
+
+
+def extract_rmh_to_lemma_pair(rmhf: rmhfile.RMHFile) -> Tuple[str, str]:
+    """Extract the sentences of a single annotated RMHFile as text and as lemmas, one sentence per line.
+    Both strings always have the same number of lines. A token without a form or lemma (an empty element)
+    is written as an empty string."""
+    is_lines = []
+    lem_lines = []
+    for s in rmhf.compact_sentences():
+        # Newlines within tokens would break the line alignment of the two files
+        is_lines.append(" ".join(form or "" for form in s.forms).replace("\n", " ") + "\n")
+        lem_lines.append(" ".join(lemma or "" for lemma in s.lemmas).replace("\n", " ") + "\n")
+    return "".join(is_lines), "".join(lem_lines)
+
+
+class LemmaPairOutputFile:
+    """A pair of line aligned output files, path (.is_IS) with the text and a .is_LEM file with the lemmas.
+    Both are written under a temporary name until they are complete."""
+
+    def __init__(self, path: Path):
+        self.is_file = extract_rmh.TextOutputFile(path)
+        self.lem_file = extract_rmh.TextOutputFile(path.with_suffix(LEMMA_SUFFIX))
+
+    def writelines(self, pairs: Iterable[Tuple[str, str]]) -> None:
+        pairs = list(pairs)
+        self.is_file.writelines(is_text for is_text, _ in pairs)
+        self.lem_file.writelines(lem_text for _, lem_text in pairs)
+
+    def close(self) -> None:
+        self.lem_file.close()
+        self.is_file.close()
+
+    def abort(self) -> None:
+        self.lem_file.abort()
+        self.is_file.abort()
+
+
+def extract_lemmas(
+    input_path: Path,
+    output_path: Path,
+    flatten_depth: int,
+    accepted_suffixes: Iterable[str],
+    processes: int,
+    chunksize: int,
+) -> None:
+    """Extract the text and lemmas of all the annotated files in a zip file, grouped into output files like
+    extract_rmh.py. Files which can not be extracted are reported and skipped."""
+    extract_rmh.extract_archive(
+        input_path,
+        output_path,
+        flatten_depth,
+        list(accepted_suffixes),
+        parsing_function=extract_rmh_to_lemma_pair,
+        open_output=LemmaPairOutputFile,
+        output_file_suffix=TEXT_SUFFIX,
+        options={"lemmas": True},
+        processes=processes,
+        chunksize=chunksize,
+        skip_errors=True,
+    )
 
 
 def check_and_make_paths(input_path, output_path):
     """ Check that inputs and outputs are reasonable and create output directory if needed """
 
-    if not input_path.is_dir():
-        raise Exception(f"Input path is not a directory: {input_path}")
+    if not input_path.is_file():
+        raise Exception(f"Input path is not a file: {input_path}")
 
     if output_path.exists() and not output_path.is_dir():
         raise Exception(f"Output path already exists and is not a directory: {output_path}")
@@ -97,20 +107,20 @@ def check_and_make_paths(input_path, output_path):
     if output_path.is_dir():
         if any(os.scandir(output_path)):
             raise Exception(f"Output directory is not empty: {output_path}")
-    
+
     output_path.mkdir(exist_ok=True, parents=True)
 
 
 if __name__ == "__main__":
     import argparse
-    parser = argparse.ArgumentParser(description="Extract parallel normal and lemmatized text from RMH xml files")
+    parser = argparse.ArgumentParser(description="Extract parallel normal and lemmatized text from an annotated RMH zip file")
 
     parser.add_argument(
         "-i",
         "--input-path",
         type=Path,
         required=True,
-        help="Path to directory with .xml files",
+        help="Path to the annotated RMH zip file",
     )
 
     parser.add_argument(
@@ -121,7 +131,37 @@ if __name__ == "__main__":
         help="Path to output directory",
     )
 
+    parser.add_argument(
+        "--flatten_depth",
+        type=int,
+        default=extract_rmh.DEFAULT_FLATTEN_DEPTH,
+        help="Combine the files within folders deeper than 'flatten_depth' into a single pair of output files, "
+             "see extract_rmh.py --help.",
+    )
+
+    parser.add_argument(
+        "--suffixes",
+        nargs="+",
+        default=[".ana", ".xml"],
+        help="The suffixes of the files to extract. Defaults to .ana .xml, i.e. files ending with .ana.xml",
+    )
+
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=16,
+        help="The number of worker processes which read and parse the XML files.",
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=10,
+        help="The number of XML files to send to each process.",
+    )
+
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
 
     try:
         check_and_make_paths(args.input_path, args.output_path)
@@ -129,4 +169,11 @@ if __name__ == "__main__":
         print(e)
         sys.exit(1)
 
-    extract_lemmas(args.input_path, args.output_path)
+    extract_lemmas(
+        args.input_path,
+        args.output_path,
+        flatten_depth=args.flatten_depth,
+        accepted_suffixes=args.suffixes,
+        processes=args.processes,
+        chunksize=args.chunksize,
+    )
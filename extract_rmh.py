@@ -22,23 +22,71 @@
 """
 
 
+import cProfile
+import heapq
 import json
 import logging
+import math
+import os
+import queue
+import random
+import re
+import time
 import uuid
 import zipfile
-from collections import defaultdict
+from collections import Counter, defaultdict, namedtuple
 from functools import partial
 from multiprocessing import Pool
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from tokenizer import split_into_sentences
 from tqdm import tqdm
 
+import merge_text_segments
+import rmhdedup
 import rmhfile
+import rmhindex
+import rmhshard
+import rmhsplit
+import rmhstats
+import rmhwriter
+
+log = logging.getLogger(__name__)
 
 DEFAULT_EXPORT_DIR = Path("./extracted_rmh")
 DEFAULT_FLATTEN_DEPTH = 0
+DEFAULT_CHUNK_BYTES = 1024 * 1024
+SAMPLE_WEIGHTS = ("count", "size")
+MANIFEST_FILE_NAME = "extract_manifest.jsonl"
+DEDUP_STORE_FILE_NAME = "dedup_store.sqlite"
+DEDUP_REPORT_FILE_NAME = "dedup_report.tsv"
+STATS_FILE_NAME = "extract_stats.json"
+STATS_SAMPLES_FILE_NAME = "extract_stats.samples.jsonl"
+PROFILE_FILE_NAME = "extract_profile.prof"
+DEFAULT_WRITE_BUFFER_SIZE = 4 * 1024 * 1024
+FSYNC_POLICIES = ("never", "close", "always")
+
+# A chunk of files from an archive (zip file) which is sent to a worker, along with the output file, the position
+# of the chunk within the output file and the total uncompressed size of the chunk
+ExtractionTask = namedtuple("ExtractionTask", "archive output_file index archive_files size")
+# An archive to extract, to output files in out_dir which are assigned with flatten_depth
+ArchiveSpec = namedtuple("ArchiveSpec", "zip_file_path out_dir flatten_depth")
+# The output files of an archive which are to be extracted, with their archive files, the manifest entries they
+# get once they are complete and the uncompressed sizes of the archive files
+ArchivePlan = namedtuple("ArchivePlan", "spec output_files manifest_entries file_sizes")
+# A file in the archive which was skipped by a worker because it could not be extracted
+SkippedFile = namedtuple("SkippedFile", "reason")
+# A sample of size files from each output file of an archive, where each file is equally likely to be chosen
+# (weight "count") or in proportion to its uncompressed size (weight "size"), see sample_archive_files
+SampleSpec = namedtuple("SampleSpec", "size weight seed")
+# The options of the worker processes of a pool, which are passed to _init_worker as its only initarg, e.g.
+# initargs=(WorkerOptions(zip_file_path, parsing_function, skip_errors=True),). Only the archive and the parsing
+# function are required, see _init_worker.
+WorkerOptions = namedtuple(
+    "WorkerOptions",
+    "zip_file_path parsing_function document_filter skip_errors split_options dedup profile index parser_engine",
+    defaults=(None, False, None, False, False, False, None),
+)
 
 
 def archive_file_to_output_file(
@@ -60,6 +108,81 @@ def archive_file_to_output_file(
     return namelist_mapping
 
 
+def sample_archive_files(
+    archive_files: List[Path], file_sizes: Dict[Path, int], sample: SampleSpec, stratum: str
+) -> List[Path]:
+    """Choose sample.size of the archive_files of a stratum (an output file) at random, without replacement,
+    keeping their order. With the weight "size", a file is chosen with a probability proportional to its
+    uncompressed size (by giving each file the key log(u) / size, u uniform in (0, 1], and keeping the largest
+    keys). The choice only depends on the seed, the stratum and its files, so it is the same in every run."""
+    if len(archive_files) <= sample.size:
+        return archive_files
+    rng = random.Random(f"{sample.seed}:{stratum}")
+    if sample.weight == "count":
+        chosen = set(rng.sample(sorted(archive_files), sample.size))
+    else:
+        keys = {x: math.log(1.0 - rng.random()) / max(file_sizes[x], 1) for x in sorted(archive_files)}
+        chosen = set(heapq.nlargest(sample.size, keys, key=keys.__getitem__))
+    return [x for x in archive_files if x in chosen]
+
+
+def load_archive_config(config_path: Path, out_dir: Path) -> List[ArchiveSpec]:
+    """Read the archives to extract from a json config file:
+    {"archives": [{"path": "IGC-News1-21.05.zip", "flatten_depth": 1, "out_dir": "news1"}, ...]}
+    Relative paths of archives are relative to the config file, and the optional out_dir of an archive is relative
+    to out_dir (which it defaults to). The flatten_depth defaults to DEFAULT_FLATTEN_DEPTH."""
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    archives = []
+    for entry in config["archives"]:
+        archives.append(
+            ArchiveSpec(
+                config_path.parent / entry["path"],
+                out_dir / entry.get("out_dir", ""),
+                entry.get("flatten_depth", DEFAULT_FLATTEN_DEPTH),
+            )
+        )
+    for spec in archives:
+        if not spec.zip_file_path.is_file():
+            raise ValueError(f"Archive {spec.zip_file_path} in {config_path} does not exist")
+    return archives
+
+
+def load_manifest(manifest_path: Path) -> Dict[str, Dict]:
+    """Read the manifest of an output directory, mapping each completed output file to its manifest entry.
+    The manifest is append-only, so the last entry of an output file is the current one."""
+    manifest: Dict[str, Dict] = {}
+    if not manifest_path.is_file():
+        return manifest
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # An interrupted run may leave a truncated last line.
+                log.warning(f"Ignoring a corrupt line in {manifest_path}")
+                continue
+            manifest[entry["output_file"]] = entry
+    return manifest
+
+
+def manifest_entry_unchanged(recorded: Optional[Dict], entry: Dict) -> bool:
+    """Whether an output file recorded in the manifest would be extracted from the same archive files (by CRC32 and
+    size) with the same options. The path of the archive is only recorded for information, so a new release of an
+    archive under a new name only extracts the output files whose archive files changed."""
+    return recorded is not None and all(recorded.get(key) == entry[key] for key in ("options", "members"))
+
+
+def append_to_manifest(manifest_path: Path, entry: Dict) -> None:
+    """Record a completed output file in the manifest."""
+    with open(manifest_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
 def extract_rmh_to_txt(
     rmhf: rmhfile.RMHFile,
     sentence_separator="\n",
@@ -73,11 +196,11 @@ def extract_rmh_to_txt(
                 sentence_separator.join(  # Join sentences into paragraphs again.
                     map(
                         lambda x: x.lstrip(" "),  # Remove the space at the beginning of consecutive sentences
-                        split_into_sentences(paragraph, original=True),
+                        sentences,
                     )
                 )
                 + sentence_separator
-                for paragraph in rmhf.paragraphs()
+                for sentences in rmhsplit.split_paragraphs(rmhf.paragraphs())
             ]
         )
         + paragraph_separator
@@ -96,10 +219,10 @@ def extract_rmh_to_json_string(rmhf: rmhfile.RMHFile, domains: Optional[List[str
                     list(
                         map(
                             lambda sentence: sentence.lstrip(" "),  # Remove the space at the beginning of consecutive sentences
-                            split_into_sentences(paragraph, original=True),
+                            sentences,
                         )
                     )
-                    for paragraph in rmhf.paragraphs()
+                    for sentences in rmhsplit.split_paragraphs(rmhf.paragraphs())
                 ],
                 "domains": domains,
                 "title": rmhf.title,
@@ -110,60 +233,843 @@ def extract_rmh_to_json_string(rmhf: rmhfile.RMHFile, domains: Optional[List[str
     )
 
 
-def extract_all(
+def extract_rmh_to_segments(rmhf: rmhfile.RMHFile, max_chars: int = merge_text_segments.MAX_CHARS_IN_BATCH) -> str:
+    """Extract a single RMHFile to merged segments, file_id.par.sent<TAB>text lines where sent is a range of
+    sentences, as merge_text_segments.py would merge the sentences of the document, one per line.
+    The file id is the idno, and paragraphs and sentences are numbered from 1."""
+    file_id = rmhf.idno
+    corpus_lines = (
+        merge_text_segments.CorpusLine(
+            file_id, str(par_idx), str(sent_idx), " ".join(sentence.split())[:max_chars]
+        )
+        for par_idx, sentences in enumerate(rmhsplit.split_paragraphs(rmhf.paragraphs()), start=1)
+        for sent_idx, sentence in enumerate(sentences, start=1)
+    )
+    return "".join(
+        merged + "\n" for merged in merge_text_segments.corpus_line_merger(corpus_lines, max_len=max_chars)
+    )
+
+
+class DocumentFilter:
+    """Conditions on the header of a document, which are checked before the rest of the document is parsed.
+    Dates are compared on the precision of the bound, so date_to="2001" includes all of 2001."""
+
+    def __init__(
+        self,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        id_regex: Optional[str] = None,
+        author: Optional[str] = None,
+        title_contains: Optional[str] = None,
+    ):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.id_regex = id_regex
+        self.author = author
+        self.title_contains = title_contains
+        self._id_pattern = re.compile(id_regex) if id_regex is not None else None
+
+    def as_dict(self) -> Dict[str, Optional[str]]:
+        """Return the conditions, e.g. for the manifest."""
+        return {
+            "date_from": self.date_from,
+            "date_to": self.date_to,
+            "id_regex": self.id_regex,
+            "author": self.author,
+            "title_contains": self.title_contains,
+        }
+
+    def is_empty(self) -> bool:
+        """Return True if there are no conditions."""
+        return all(x is None for x in self.as_dict().values())
+
+    def accepts(self, rmhf: rmhfile.RMHFile) -> bool:
+        """Return True if the document fulfills all the conditions. Only the header of the document is read."""
+        if self.date_from is not None or self.date_to is not None:
+            date = rmhf.date
+            if date is None:
+                return False
+            if self.date_from is not None and date[: len(self.date_from)] < self.date_from:
+                return False
+            if self.date_to is not None and date[: len(self.date_to)] > self.date_to:
+                return False
+        if self._id_pattern is not None:
+            idno = rmhf.idno
+            if self._id_pattern.search(rmhf.id) is None and (idno is None or self._id_pattern.search(idno) is None):
+                return False
+        if self.author is not None and rmhf.author != self.author:
+            return False
+        if self.title_contains is not None:
+            try:
+                title = rmhf.title
+            except ValueError:
+                return False
+            if self.title_contains not in title:
+                return False
+        return True
+
+
+# Turns a parsed file into the result which is sent back from a worker, usually a serialized string
+ParsingFunction = Callable[[rmhfile.RMHFile], Any]
+
+# Each worker process opens its own handle to each archive, the default archive in _init_worker
+_archive: Optional[zipfile.ZipFile] = None
+_archives: Dict[str, zipfile.ZipFile] = {}
+_parsing_function: Optional[ParsingFunction] = None
+_document_filter: Optional[DocumentFilter] = None
+_skip_errors = False
+_dedup = False
+_profile = False
+_index = False
+
+
+def _init_worker(options: WorkerOptions) -> None:
+    """Open the archive once per worker process and configure its sentence splitter and parser engine.
+    Without a zip_file_path, the archive of each chunk is opened when it is first needed, see extract_chunk.
+    The files are parsed with the parsing_function, and, with the other options:
+    document_filter: only the files it accepts are parsed, see extract_signed_member
+    skip_errors: files which can not be extracted are returned as SkippedFile instead of raising an error
+    split_options: passed to rmhsplit.configure()
+    dedup, index: also compute the signatures, or the ids and sizes, of the documents, see extract_chunk
+    profile: profile each chunk with cProfile
+    parser_engine: passed to rmhfile.configure()"""
+    global _archive, _parsing_function, _document_filter, _skip_errors, _dedup, _profile, _index
+    _archive = _open_archive(options.zip_file_path) if options.zip_file_path is not None else None
+    _parsing_function = options.parsing_function
+    _document_filter = options.document_filter
+    _skip_errors = options.skip_errors
+    _dedup = options.dedup
+    _profile = options.profile
+    _index = options.index
+    if options.split_options is not None:
+        rmhsplit.configure(**options.split_options)
+    if options.parser_engine is not None:
+        rmhfile.configure(options.parser_engine)
+
+
+def _open_archive(zip_file_path: Path) -> zipfile.ZipFile:
+    """Return the handle of this worker to the archive, opening it if needed."""
+    if str(zip_file_path) not in _archives:
+        _archives[str(zip_file_path)] = zipfile.ZipFile(str(zip_file_path))
+    return _archives[str(zip_file_path)]
+
+
+def _output_size(result: Any) -> int:
+    """The size in bytes of a serialized result, or 0 if it is not text."""
+    if isinstance(result, str):
+        return len(result.encode("utf-8"))
+    if isinstance(result, tuple):
+        return sum(_output_size(x) for x in result)
+    return 0
+
+
+def extract_signed_member(
+    archive_file: Path, zip_file_path: Optional[Path] = None
+) -> Tuple[Any, Optional[rmhdedup.Signature], Optional[rmhindex.DocumentInfo]]:
+    """Like extract_member, but if the worker deduplicates, also returns the signature of the document,
+    which is computed from its paragraphs as they are serialized (None if it has no words), and if the worker
+    indexes the documents, their ids and serialized size. The file is read from zip_file_path, by default the archive of the worker.
+    The time spent reading, parsing, splitting and serializing the file is recorded in rmhstats."""
+    archive = _open_archive(zip_file_path) if zip_file_path is not None else _archive
+    assert archive is not None and _parsing_function is not None, "Worker has not been initialized"
+    try:
+        with archive.open(str(archive_file)) as item:
+            rmhf = rmhfile.RMHFile.from_stream(
+                rmhstats.TimedStream(item), archive_file, wrap_events=partial(rmhstats.timed, "parse")  # type: ignore
+            )
+            if _document_filter is not None and not _document_filter.accepts(rmhf):
+                return None, None, None
+            paragraphs = rmhdedup.record_paragraphs(rmhf) if _dedup else None
+            with rmhstats.stage("serialize"):
+                result = _parsing_function(rmhf)
+            size = _output_size(result)
+            rmhstats.count("bytes_out", size)
+            info = rmhindex.document_info(rmhf, size) if _index else None
+            if paragraphs is None:
+                return result, None, info
+            with rmhstats.stage("dedup"):
+                return result, rmhdedup.signature(paragraphs), info
+    except Exception as e:
+        if not _skip_errors:
+            raise
+        return SkippedFile(f"{type(e).__name__}: {e}"), None, None
+
+
+def extract_member(archive_file: Path) -> Any:
+    """Read, parse and serialize a single file from the archive. Runs in a worker process.
+    Returns None if the file is rejected by the document filter, in which case only its header is parsed.
+    If errors are skipped, a file which can not be extracted is returned as a SkippedFile."""
+    return extract_signed_member(archive_file)[0]
+
+
+def extract_members(archive_files: List[Path]) -> List[Any]:
+    """Read, parse and serialize a chunk of files from the archive. Runs in a worker process."""
+    return [extract_member(archive_file) for archive_file in archive_files]
+
+
+def extract_chunk(
     zip_file_path: Path,
-    output_file: Path,
-    flatten_depth: int,
+    archive_files: List[Path],
+) -> Tuple[
+    List[Any], List[Optional[rmhdedup.Signature]], List[Optional[rmhindex.DocumentInfo]], Dict[str, float], Optional[Dict]
+]:
+    """Like extract_members, for files from the archive at zip_file_path, but also returns the signatures of the
+    documents (None unless the worker deduplicates, or for documents without words), their ids and sizes (None
+    unless the worker indexes), the statistics of the worker for the chunk and, if the worker profiles, the
+    statistics of a cProfile.Profile of the chunk."""
+    profiler = cProfile.Profile() if _profile else None
+    if profiler is not None:
+        profiler.enable()
+    start = time.perf_counter()
+    signed = [extract_signed_member(archive_file, zip_file_path) for archive_file in archive_files]
+    rmhstats.count("busy_wall", time.perf_counter() - start)
+    profile = None
+    if profiler is not None:
+        profiler.disable()
+        profiler.create_stats()
+        profile = profiler.stats  # type: ignore
+    return (
+        [result for result, _, _ in signed],
+        [signature for _, signature, _ in signed],
+        [info for _, _, info in signed],
+        {**rmhsplit.take_stats(), **rmhstats.take_stats()},
+        profile,
+    )
+
+
+def chunk_archive_files(
+    archive_files: List[Path], file_sizes: Dict[Path, int], chunksize: Optional[int], chunk_bytes: Optional[int]
+) -> Iterator[List[Path]]:
+    """Split archive files into consecutive chunks of at most chunksize files and at most chunk_bytes of
+    uncompressed xml. A file which is larger than chunk_bytes is a chunk of its own."""
+    chunk: List[Path] = []
+    size = 0
+    for archive_file in archive_files:
+        if chunk and (
+            (chunksize is not None and len(chunk) >= chunksize)
+            or (chunk_bytes is not None and size + file_sizes[archive_file] > chunk_bytes)
+        ):
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(archive_file)
+        size += file_sizes[archive_file]
+    if chunk:
+        yield chunk
+
+
+def make_tasks(
+    plans: List[ArchivePlan], chunksize: Optional[int], chunk_bytes: Optional[int] = None
+) -> Iterator[ExtractionTask]:
+    """Split the archive files of each output file into chunks, in output order, see chunk_archive_files.
+    The output files of all the archives are extracted largest first, so the long running ones start early and
+    the pool is kept busy by the small ones at the end. Ties keep the order of the archives and their output
+    files. The files of an output file must stay in order, but large files are chunks of their own, so they
+    are extracted in parallel with the files that follow them."""
+    output_files = [
+        (plan, output_file, archive_files)
+        for plan in plans
+        for output_file, archive_files in plan.output_files.items()
+    ]
+    output_files.sort(key=lambda x: -sum(x[0].file_sizes[archive_file] for archive_file in x[2]))
+    for plan, output_file, archive_files in output_files:
+        for index, chunk in enumerate(chunk_archive_files(archive_files, plan.file_sizes, chunksize, chunk_bytes)):
+            yield ExtractionTask(
+                plan.spec.zip_file_path, output_file, index, chunk, sum(plan.file_sizes[x] for x in chunk)
+            )
+
+
+def imap_per_output_file(
+    pool: Pool,
+    func: Callable,
+    tasks: Iterable[ExtractionTask],
+    max_in_flight: Optional[int],
+    max_in_flight_bytes: Optional[int] = None,
+    stats: Optional[rmhstats.StatsReport] = None,
+    in_order: bool = False,
+) -> Iterator[Tuple[ExtractionTask, List[str]]]:
+    """Run the tasks in the pool, calling func with the archive and the archive files of each task, and yield their
+    results as soon as they are next in line for their output file. The results of each output file are yielded in
+    order, while tasks of several output files are kept in flight. With in_order, all the results are yielded in
+    the order of the tasks, so they are handled in the same order in every run whichever worker finishes first.
+
+    At most max_in_flight archive files and max_in_flight_bytes of uncompressed xml (either may be None for no limit)
+    are submitted but not yet yielded at any time. The tasks are submitted in order, so the earliest task which has
+    not been yielded is always in flight and the pipeline cannot stall. A task larger than the limits (e.g. a single
+    large file) is not counted against them but takes a slot of its own, so one such task is in flight at a time
+    alongside the other tasks, and neither holds up the other.
+
+    With stats, the number of files in flight, of results which the main process has not handled yet and of results
+    which are waiting for an earlier result of their output file are recorded whenever a result is handled."""
+    completed: "queue.Queue[Tuple[Optional[ExtractionTask], int, object]]" = queue.Queue()
+    # The results which are waiting for an earlier result, by output file (or all together with in_order)
+    waiting: Dict[Optional[Path], Dict[int, Tuple[ExtractionTask, List[str]]]] = defaultdict(dict)
+    next_index: Dict[Optional[Path], int] = defaultdict(int)
+    in_flight_files = 0
+    in_flight_bytes = 0
+    # The number of files of the task larger than the limits which is in flight, if any
+    oversized_files = 0
+    out_of_order = 0
+
+    def oversized(t: ExtractionTask) -> bool:
+        return (max_in_flight is not None and len(t.archive_files) > max_in_flight) or (
+            max_in_flight_bytes is not None and t.size > max_in_flight_bytes
+        )
+
+    tasks = iter(tasks)
+    task: Optional[ExtractionTask] = next(tasks, None)
+    submitted = 0
+    yielded = 0
+    while task is not None or yielded < submitted:
+        while task is not None:
+            if oversized(task):
+                if oversized_files:
+                    break
+                oversized_files = len(task.archive_files)
+            elif (max_in_flight is not None and in_flight_files + len(task.archive_files) > max_in_flight) or (
+                max_in_flight_bytes is not None and in_flight_bytes + task.size > max_in_flight_bytes
+            ):
+                break
+            else:
+                in_flight_files += len(task.archive_files)
+                in_flight_bytes += task.size
+            pool.apply_async(
+                func,
+                (task.archive, task.archive_files),
+                callback=lambda result, t=task, n=submitted: completed.put((t, n, result)),
+                error_callback=lambda e: completed.put((None, 0, e)),
+            )
+            submitted += 1
+            task = next(tasks, None)
+        with rmhstats.stage("wait"):
+            done, number, result = completed.get()
+        if done is None:
+            raise result  # type: ignore
+        if stats is not None:
+            stats.observe("in_flight_files", in_flight_files + oversized_files)
+            stats.observe("unhandled_results", completed.qsize())
+            stats.observe("out_of_order_results", out_of_order)
+        key, index = (None, number) if in_order else (done.output_file, done.index)
+        waiting[key][index] = (done, result)  # type: ignore
+        out_of_order += 1
+        key_waiting = waiting[key]
+        while next_index[key] in key_waiting:
+            ready, texts = key_waiting.pop(next_index[key])
+            out_of_order -= 1
+            next_index[key] += 1
+            if oversized(ready):
+                oversized_files = 0
+            else:
+                in_flight_files -= len(ready.archive_files)
+                in_flight_bytes -= ready.size
+            yielded += 1
+            yield ready, texts
+        if not key_waiting:
+            del waiting[key]
+
+
+class TextOutputFile:
+    """A text output file which is written under a temporary name until it is complete.
+
+    The texts are encoded as utf-8 and collected until there are at least buffer_size bytes, which are then
+    written with a single write (or more, if the file system writes only part of them). With fsync "close", the
+    file is synced to disk before it is moved to its final name, and with "always", also after each write."""
+
+    def __init__(self, path: Path, buffer_size: int = DEFAULT_WRITE_BUFFER_SIZE, fsync: str = "never"):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync}, expected one of {', '.join(FSYNC_POLICIES)}")
+        self.path = path
+        self.buffer_size = buffer_size
+        self.fsync = fsync
+        self.partial_path = path.with_name(path.name + rmhwriter.PARTIAL_FILE_SUFFIX)
+        self.f = open(self.partial_path, "wb", buffering=0)
+        self.pending: List[bytes] = []
+        self.pending_bytes = 0
+
+    def writelines(self, texts: Iterable[str]) -> None:
+        for text in texts:
+            data = text.encode("utf-8")
+            self.pending.append(data)
+            self.pending_bytes += len(data)
+        if self.pending_bytes >= self.buffer_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self.pending:
+            data = memoryview(b"".join(self.pending))
+            # The file is unbuffered, and a raw write may write only part of the data, e.g. on network storage
+            while data:
+                data = data[self.f.write(data) :]
+            self.pending = []
+            self.pending_bytes = 0
+            if self.fsync == "always":
+                os.fsync(self.f.fileno())
+
+    def close(self) -> None:
+        """Finish the file and move it to its final name."""
+        self._flush()
+        if self.fsync == "close":
+            os.fsync(self.f.fileno())
+        self.f.close()
+        os.replace(self.partial_path, self.path)
+
+    def abort(self) -> None:
+        """Close the file without moving it, e.g. when the extraction fails."""
+        self.pending = []
+        self.f.close()
+
+
+def plan_archive(
+    spec: ArchiveSpec,
+    accepted_suffixes: List[str],
+    output_file_suffix: str,
+    options: Dict[str, Any],
+    resume: bool = False,
+    members: Optional[Iterable[str]] = None,
+    sample: Optional[SampleSpec] = None,
+) -> ArchivePlan:
+    """Assign the files of an archive to output files and find the manifest entries they get once they are
+    complete. With a sample, only a sample of the files of each output file is assigned to it, which is chosen
+    from the central directory of the zip file, see sample_archive_files. With resume, output files whose archive files and options are unchanged according to the manifest
+    in the output directory of the archive are left out."""
+    zip_file_path, out_dir, flatten_depth = spec
+    with zipfile.ZipFile(str(zip_file_path)) as archive:
+        file_infos = {Path(x.filename): x for x in archive.infolist()}
+    if members is not None:
+        selected = {Path(x) for x in members}
+        file_infos = {path: info for path, info in file_infos.items() if path in selected}
+    file_sizes = {path: info.file_size for path, info in file_infos.items()}
+    archive_file_to_output_file_map = archive_file_to_output_file(
+        list(file_infos),
+        out_dir,
+        flatten_depth,
+        accepted_suffixes,
+        output_file_suffix=output_file_suffix,
+    )
+    output_file_to_archive_files_map = defaultdict(list)
+    for archive_file, output_file in archive_file_to_output_file_map.items():
+        output_file_to_archive_files_map[output_file].append(archive_file)
+    if sample is not None:
+        total = len(archive_file_to_output_file_map)
+        for output_file, archive_files in output_file_to_archive_files_map.items():
+            output_file_to_archive_files_map[output_file] = sample_archive_files(
+                archive_files, file_sizes, sample, str(output_file.relative_to(out_dir))
+            )
+        sampled = sum(len(x) for x in output_file_to_archive_files_map.values())
+        log.info(
+            f"{zip_file_path}: sampled {sampled} of {total} files "
+            f"from {len(output_file_to_archive_files_map)} output files"
+        )
+
+    manifest_entries = {
+        output_file: {
+            "output_file": str(output_file.relative_to(out_dir)),
+            "archive": str(zip_file_path),
+            "options": options,
+            "members": {
+                str(x): [file_infos[x].CRC, file_infos[x].file_size]
+                for x in output_file_to_archive_files_map[output_file]
+            },
+        }
+        for output_file in output_file_to_archive_files_map
+    }
+    if resume:
+        manifest = load_manifest(out_dir / MANIFEST_FILE_NAME)
+        unchanged = [
+            output_file
+            for output_file, entry in manifest_entries.items()
+            if output_file.is_file() and manifest_entry_unchanged(manifest.get(entry["output_file"]), entry)
+        ]
+        for output_file in unchanged:
+            del output_file_to_archive_files_map[output_file]
+        log.info(
+            f"{zip_file_path}: skipping {len(unchanged)} unchanged output files, "
+            f"{len(output_file_to_archive_files_map)} remaining"
+        )
+        current = {entry["output_file"] for entry in manifest_entries.values()}
+        for stale in sorted(set(manifest) - current):
+            if manifest[stale]["archive"] == str(zip_file_path):
+                log.warning(f"Output file {out_dir / stale} is no longer produced by {zip_file_path}")
+    return ArchivePlan(spec, dict(output_file_to_archive_files_map), manifest_entries, file_sizes)
+
+
+def extract_archive(zip_file_path: Path, out_dir: Path, flatten_depth: int, *args, **kwargs) -> None:
+    """Extract all files from a zip file to output files in out_dir, see extract_archives."""
+    extract_archives([ArchiveSpec(zip_file_path, out_dir, flatten_depth)], out_dir, *args, **kwargs)
+
+
+def extract_archives(
+    archives: List[ArchiveSpec],
+    out_dir: Path,
     accepted_suffixes: List[str],
+    parsing_function: ParsingFunction,
+    open_output: Callable[[Path], Any],
+    output_file_suffix: str,
+    options: Dict[str, Any],
     processes: int,
-    chunksize: int,
+    chunksize: Optional[int],
+    max_in_flight: Optional[int] = None,
+    max_in_flight_bytes: Optional[int] = None,
+    resume: bool = False,
+    members: Optional[Iterable[str]] = None,
+    document_filter: Optional[DocumentFilter] = None,
+    skip_errors: bool = False,
+    split_options: Optional[Dict[str, int]] = None,
+    dedup_threshold: Optional[float] = None,
+    dedup_store_path: Optional[Path] = None,
+    stats_interval: Optional[float] = None,
+    profile: bool = False,
+    chunk_bytes: Optional[int] = None,
+    doc_index: bool = False,
+    parser_engine: Optional[str] = None,
+    writer_queue_size: int = rmhwriter.DEFAULT_QUEUE_SIZE,
+    sample: Optional[SampleSpec] = None,
+) -> None:
+    """Extract all files from the zip files to output files, which are assigned by archive_file_to_output_file
+    with the output directory and flatten depth of each archive. The files of all the archives are extracted by a
+    single pool of workers, the largest output files first, see make_tasks.
+    The workers read, parse and serialize the files themselves using the parsing_function, the main process only
+    passes the results to the output files, which are opened with open_output and are completed with close().
+    The output files are written and completed by a writer thread (see rmhwriter.BackgroundWriter), at most
+    writer_queue_size writes behind, so a slow disk does not hold up handing out work to the pool.
+    The files are sent to the workers in chunks of at most chunksize files and chunk_bytes of uncompressed xml,
+    at least one of which must be given. Reading, parsing and writing overlap, with at most max_in_flight files
+    and max_in_flight_bytes of uncompressed xml in flight, possibly spread over several output files. By default,
+    up to four chunks per process are in flight: max_in_flight is processes * chunksize * 4 when chunking by
+    count, and max_in_flight_bytes is processes * chunk_bytes * 4 when chunking by size.
+
+    Each completed output file is recorded in a manifest in the output directory of its archive, along with the
+    options and the CRC32 and size of its archive files. With resume, output files whose archive files and options
+    are unchanged are skipped. If members is given, only those files are extracted from the archives, and with a
+    sample, only a sample of the files of each output file, which is chosen without reading the files, see
+    sample_archive_files. Files which are rejected by the document_filter are skipped as soon as their header has been parsed. With skip_errors,
+    files which can not be extracted are reported and skipped instead of stopping the extraction. The split_options
+    are passed to rmhsplit.configure() in each worker, and the files are parsed with the parser_engine (by default
+    rmhfile.DEFAULT_ENGINE), see rmhfile.ENGINES.
+
+    With a dedup_threshold, documents which are exact duplicates of, or whose estimated Jaccard similarity to an
+    earlier document is at least the threshold, are dropped and listed in a report in out_dir. The
+    documents kept so far are stored in dedup_store_path (by default in out_dir), which can be shared
+    between extractions to deduplicate across archives. The parsing_function must read the document through
+    RMHFile.paragraphs(). The documents are checked in the order of the tasks (see make_tasks), so the first copy
+    in that order is kept in every run, however the workers finish.
+
+    The time spent in each stage (reading, parsing, splitting, serializing, writing, ...), the bytes read and
+    serialized, the depths of the queues, the utilization of the workers and the time the writer thread spent
+    writing (disk) and waiting for writes (idle) are written to a stats report in
+    out_dir at the end, and with a stats_interval, also sampled about that often (in seconds) while the
+    extraction runs. With profile, each worker is profiled with cProfile and the profiles are merged into a single
+    file in out_dir.
+
+    With doc_index, the id, idno, source archive file, byte offset and length of each document that is written
+    are recorded in an index in out_dir, see rmhindex.DocumentIndex. The results must be text which is written
+    to the output files as is."""
+    # Please note that the zipfile module is not thread-safe even though it should be: https://bugs.python.org/issue42369
+    # We therefore never share a ZipFile between processes, each worker opens its own.
+    if chunksize is None and chunk_bytes is None:
+        raise ValueError("Either chunksize or chunk_bytes must be given")
+    if chunk_bytes is not None:
+        if max_in_flight_bytes is None:
+            max_in_flight_bytes = processes * chunk_bytes * 4
+    elif max_in_flight is None:
+        max_in_flight = processes * chunksize * 4  # type: ignore
+    if members is not None:
+        members = list(members)
+    if sample is not None and sample.weight not in SAMPLE_WEIGHTS:
+        raise ValueError(f"Unknown sample weight {sample.weight}, expected one of {', '.join(SAMPLE_WEIGHTS)}")
+
+    if document_filter is not None and document_filter.is_empty():
+        document_filter = None
+    options = dict(
+        options,
+        filter=document_filter.as_dict() if document_filter is not None else None,
+        sample=dict(sample._asdict()) if sample is not None else None,
+    )
+    plans = [
+        plan_archive(spec, accepted_suffixes, output_file_suffix, options, resume, members, sample)
+        for spec in archives
+    ]
+    # The plan of each output file which is extracted
+    output_file_plans: Dict[Path, ArchivePlan] = {}
+    for plan in plans:
+        for output_file in plan.output_files:
+            if output_file in output_file_plans:
+                other = output_file_plans[output_file].spec.zip_file_path
+                raise ValueError(
+                    f"Output file {output_file} would be written from both {other} and {plan.spec.zip_file_path}, "
+                    "use a separate output directory for each archive"
+                )
+            output_file_plans[output_file] = plan
+    for plan in plans:
+        plan.spec.out_dir.mkdir(parents=True, exist_ok=True)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    dedup_store: Optional[rmhdedup.DedupStore] = None
+    dedup_report = None
+    if dedup_threshold is not None:
+        dedup_store = rmhdedup.DedupStore(dedup_store_path or out_dir / DEDUP_STORE_FILE_NAME, dedup_threshold)
+        # Documents from an earlier extraction of the output files which are extracted now are not duplicates
+        dedup_store.forget_output_files(str(x) for x in output_file_plans)
+        dedup_report = open(out_dir / DEDUP_REPORT_FILE_NAME, "a" if resume else "w", encoding="utf-8")
+    index: Optional[rmhindex.DocumentIndex] = None
+    if doc_index:
+        index = rmhindex.DocumentIndex(out_dir / rmhindex.INDEX_FILE_NAME)
+        index.forget_output_files(output_file_plans)
+
+    total_archive_files = sum(len(x) for plan in plans for x in plan.output_files.values())
+    description = archives[0].zip_file_path if len(archives) == 1 else f"{len(archives)} archives"
+    p_bar = tqdm(desc=f"Extracting {description}", total=total_archive_files, unit="files")
+    tasks = list(make_tasks(plans, chunksize, chunk_bytes))
+    remaining_tasks: Dict[Path, int] = defaultdict(int)
+    for task in tasks:
+        remaining_tasks[task.output_file] += 1
+    open_files: Dict[Path, Any] = {}
+    rejected = 0
+    skipped = 0
+    duplicates: Counter = Counter()
+    # Documents without words, which are kept without being checked for duplicates
+    unsigned = 0
+    stats = rmhstats.StatsReport(
+        processes,
+        samples_path=out_dir / STATS_SAMPLES_FILE_NAME if stats_interval is not None else None,
+        interval=stats_interval or 0.0,
+    )
+    writer = rmhwriter.BackgroundWriter(writer_queue_size)
+
+    def complete(output_file: Path) -> None:
+        # Runs in the writer thread, after the last write to the output file
+        open_files[output_file].close()
+        del open_files[output_file]
+        plan = output_file_plans[output_file]
+        append_to_manifest(plan.spec.out_dir / MANIFEST_FILE_NAME, plan.manifest_entries[output_file])
+
+    try:
+        with Pool(
+            processes=processes,
+            initializer=_init_worker,
+            initargs=(
+                WorkerOptions(
+                    None,
+                    parsing_function,
+                    document_filter=document_filter,
+                    skip_errors=skip_errors,
+                    split_options=split_options,
+                    dedup=dedup_store is not None,
+                    profile=profile,
+                    index=index is not None,
+                    parser_engine=parser_engine,
+                ),
+            ),
+        ) as pool:
+            # Only the names are sent to the workers, they read and parse the xml.
+            # Several output files are in flight at once, each of them is written in order.
+            for task, (results, signatures, infos, chunk_stats, chunk_profile) in imap_per_output_file(
+                pool,
+                extract_chunk,
+                tasks,
+                max_in_flight,
+                max_in_flight_bytes,
+                stats=stats,
+                # The documents are checked for duplicates in the order of the tasks, so the same copy is kept
+                in_order=dedup_store is not None,
+            ):
+                stats.update_thread("writer", writer.take_stats())
+                stats.observe("writer_queue", writer.queue.qsize())
+                stats.update(chunk_stats)
+                if chunk_profile is not None:
+                    stats.add_profile(chunk_profile)
+                if task.output_file not in open_files:
+                    task.output_file.parent.mkdir(parents=True, exist_ok=True)
+                    open_files[task.output_file] = open_output(task.output_file)
+                accepted = []
+                for archive_file, result, signature, info in zip(task.archive_files, results, signatures, infos):
+                    if result is None:
+                        rejected += 1
+                        continue
+                    if isinstance(result, SkippedFile):
+                        log.warning(f"Skipping problematic file: {archive_file} ({result.reason})")
+                        skipped += 1
+                        continue
+                    if dedup_store is not None and signature is None:
+                        unsigned += 1
+                    elif dedup_store is not None:
+                        with rmhstats.stage("dedup"):
+                            duplicate = dedup_store.check_and_add(
+                                str(archive_file), str(task.output_file), signature
+                            )
+                        if duplicate is not None:
+                            duplicates[duplicate.kind] += 1
+                            dedup_report.write(  # type: ignore
+                                f"{archive_file}\t{duplicate.kind}\t{duplicate.similarity:.3f}\t"
+                                f"{duplicate.original_member}\n"
+                            )
+                            continue
+                    accepted.append(result)
+                    if index is not None:
+                        index.add(task.output_file, task.archive, archive_file, info)
+                with rmhstats.stage("write"):
+                    writer.submit(open_files[task.output_file].writelines, accepted)
+                p_bar.update(len(results))
+                remaining_tasks[task.output_file] -= 1
+                if remaining_tasks[task.output_file] == 0:
+                    if dedup_store is not None:
+                        dedup_store.commit()
+                    if index is not None:
+                        index.commit()
+                    with rmhstats.stage("write"):
+                        writer.submit(complete, task.output_file)
+        with rmhstats.stage("write"):
+            writer.close()
+        stats.update_thread("writer", writer.take_stats())
+    finally:
+        writer.abort()
+        for f in open_files.values():
+            f.abort()
+        if dedup_store is not None:
+            dedup_store.close()
+            dedup_report.close()  # type: ignore
+        if index is not None:
+            index.close()
+    p_bar.close()
+    if document_filter is not None:
+        log.info(f"{rejected} of {total_archive_files} files were rejected by the document filter")
+    if skipped:
+        log.warning(f"Skipped {skipped} of {total_archive_files} files which could not be extracted")
+    if dedup_store is not None:
+        log.info(
+            f"Dropped {duplicates['exact']} exact and {duplicates['near']} near duplicates, "
+            f"see {out_dir / DEDUP_REPORT_FILE_NAME}"
+        )
+        if unsigned:
+            log.info(f"Kept {unsigned} documents without words, which are not checked for duplicates")
+    split = stats.workers
+    if split["split_paragraphs"]:
+        log.info(
+            f"Sentence splitting: {split['split_paragraphs']} paragraphs, "
+            f"{split['split_cache_hits'] / split['split_paragraphs']:.1%} cache hits, "
+            f"{split['split_tokenizer_calls']} tokenizer calls"
+        )
+    stats.log_summary()
+    stats.write(out_dir / STATS_FILE_NAME)
+    log.info(f"Wrote extraction statistics to {out_dir / STATS_FILE_NAME}")
+    if profile:
+        stats.write_profile(out_dir / PROFILE_FILE_NAME)
+        log.info(f"Wrote the merged profile of the workers to {out_dir / PROFILE_FILE_NAME}, see python -m pstats")
+
+
+def extract_all(zip_file_path: Path, output_file: Path, flatten_depth: int, *args, **kwargs) -> None:
+    """Extract all files from a zip file to files in the output_file directory, see extract_many."""
+    extract_many([ArchiveSpec(zip_file_path, output_file, flatten_depth)], output_file, *args, **kwargs)
+
+
+def extract_many(
+    archives: List[ArchiveSpec],
+    out_dir: Path,
+    accepted_suffixes: List[str],
+    processes: int,
+    chunksize: Optional[int],
     to_jsonl: bool,
     domains: Optional[List[str]],
+    max_in_flight: Optional[int] = None,
+    max_in_flight_bytes: Optional[int] = None,
+    resume: bool = False,
+    members: Optional[Iterable[str]] = None,
+    document_filter: Optional[DocumentFilter] = None,
+    to_shards: bool = False,
+    split_options: Optional[Dict[str, int]] = None,
+    dedup_threshold: Optional[float] = None,
+    dedup_store_path: Optional[Path] = None,
+    compression: Optional[str] = None,
+    shard_max_bytes: Optional[int] = None,
+    shard_max_docs: Optional[int] = None,
+    stats_interval: Optional[float] = None,
+    profile: bool = False,
+    to_segments: bool = False,
+    segment_max_chars: int = merge_text_segments.MAX_CHARS_IN_BATCH,
+    chunk_bytes: Optional[int] = None,
+    doc_index: bool = False,
+    parser_engine: Optional[str] = None,
+    write_buffer_size: int = DEFAULT_WRITE_BUFFER_SIZE,
+    fsync: str = "never",
+    writer_queue_size: int = rmhwriter.DEFAULT_QUEUE_SIZE,
+    sample: Optional[SampleSpec] = None,
 ) -> None:
-    """Extract all files from a zip file to a files."""
-    # Please note that the zipfile module is not thread-safe even though it should be: https://bugs.python.org/issue42369
+    """Extract all files from the zip files to files, in a single pool of workers, see extract_archives.
+    The reports of the extraction (statistics, duplicates, ...) are written to out_dir. With to_shards, the tokens of the annotated files are extracted to a token shard per output file instead.
+    With to_segments, the sentences are merged into segments of at most segment_max_chars characters, see
+    extract_rmh_to_segments. Deduplication is only supported for text, jsonl and segment output.
+
+    With a compression, shard_max_bytes or shard_max_docs, each text or jsonl output file is written as
+    compressed shards of at most about shard_max_bytes (uncompressed) or shard_max_docs documents, along with a
+    .shards.jsonl index, see rmhwriter.ShardedOutputFile.
+
+    With doc_index, the documents are recorded in an index which the documents can be read back with, by their
+    id, see rmhindex.py. Only supported for uncompressed text, jsonl and segment output.
+
+    The uncompressed text, jsonl and segment output is written in writes of about write_buffer_size bytes, and
+    synced to disk according to fsync, see TextOutputFile."""
+    if to_shards and dedup_threshold is not None:
+        raise ValueError("Deduplication is not supported for token shards")
+    sharded = compression is not None or shard_max_bytes is not None or shard_max_docs is not None
+    if to_shards and sharded:
+        raise ValueError("Token shards can not be compressed or rotated")
+    if doc_index and (to_shards or sharded):
+        raise ValueError("The document index is not supported for token shards or compressed shards")
     output_file_suffix = ".txt"
-    parsing_function = extract_rmh_to_txt
+    parsing_function: ParsingFunction = extract_rmh_to_txt
+    open_output: Callable[[Path], Any] = partial(TextOutputFile, buffer_size=write_buffer_size, fsync=fsync)
     if to_jsonl:
         output_file_suffix = ".jsonl"
         parsing_function = partial(extract_rmh_to_json_string, domains=domains)
-
-    with zipfile.ZipFile(str(zip_file_path)) as archive:
-        archive_paths = [Path(x) for x in archive.namelist()]
-        archive_file_to_output_file_map = archive_file_to_output_file(
-            archive_paths,
-            output_file,
-            flatten_depth,
-            accepted_suffixes,
-            output_file_suffix=output_file_suffix,
+    elif to_segments:
+        output_file_suffix = ".tsv"
+        parsing_function = partial(extract_rmh_to_segments, max_chars=segment_max_chars)
+    elif to_shards:
+        output_file_suffix = rmhshard.SHARD_FILE_SUFFIX
+        parsing_function = rmhshard.extract_rmh_to_shard
+        open_output = rmhshard.TokenShardWriter
+    if sharded:
+        open_output = partial(
+            rmhwriter.ShardedOutputFile,
+            shard_suffix=output_file_suffix,
+            compression=compression or "none",
+            max_bytes=shard_max_bytes,
+            max_docs=shard_max_docs,
         )
-        output_file_to_archive_files_map = defaultdict(list)
-        for archive_file, output_file in archive_file_to_output_file_map.items():
-            output_file_to_archive_files_map[output_file].append(archive_file)
-
-        total_archive_files = len(archive_file_to_output_file_map)
-        p_bar = tqdm(desc=f"Extracting {zip_file_path}", total=total_archive_files, unit="files")
-        reading_batch_size = (
-            processes * chunksize * 4
-        )  # Reading the file on the main thread is blocking, so we try to read in batches
-        with Pool(processes=processes) as pool:
-            for output_file, archive_files in output_file_to_archive_files_map.items():
-                output_file.parent.mkdir(parents=True, exist_ok=True)
-                with open(output_file, "w", encoding="utf-8") as f:
-                    for current_idx in range(0, len(archive_files), reading_batch_size):
-                        batch = archive_files[current_idx : current_idx + reading_batch_size]
-                        rmh_files = []
-                        for archive_file in batch:
-                            # We read the zipfile on the main thread.
-                            with archive.open(str(archive_file)) as item:
-                                text = item.read().decode("utf-8")
-                                rmh_files.append(rmhfile.RMHFile(text, archive_file))
-                        # Parse the xml
-                        for text in pool.map(parsing_function, rmh_files, chunksize=chunksize):
-                            f.write(text)
-                            p_bar.update()
-                        rmh_files.clear()
-        p_bar.close()
+        output_file_suffix = rmhwriter.SHARD_INDEX_SUFFIX
+    extract_archives(
+        archives,
+        out_dir,
+        accepted_suffixes,
+        parsing_function=parsing_function,
+        open_output=open_output,
+        output_file_suffix=output_file_suffix,
+        options={
+            "to_jsonl": to_jsonl,
+            "to_shards": to_shards,
+            "to_segments": segment_max_chars if to_segments else None,
+            "domains": domains,
+            "dedup": dedup_threshold,
+            "sharding": [compression, shard_max_bytes, shard_max_docs] if sharded else None,
+            "doc_index": doc_index,
+        },
+        processes=processes,
+        chunksize=chunksize,
+        chunk_bytes=chunk_bytes,
+        doc_index=doc_index,
+        parser_engine=parser_engine,
+        writer_queue_size=writer_queue_size,
+        sample=sample,
+        max_in_flight=max_in_flight,
+        max_in_flight_bytes=max_in_flight_bytes,
+        resume=resume,
+        members=members,
+        document_filter=document_filter,
+        split_options=split_options,
+        dedup_threshold=dedup_threshold,
+        dedup_store_path=dedup_store_path,
+        stats_interval=stats_interval,
+        profile=profile,
+    )
 
 
 if __name__ == "__main__":
@@ -182,9 +1088,19 @@ if __name__ == "__main__":
         "--in_path",
         dest="in_path",
         type=file_type_guard,
-        required=True,
+        required=False,
+        default=None,
         help="Path to RMH zip file",
     )
+    parser.add_argument(
+        "--config",
+        type=file_type_guard,
+        default=None,
+        help="Path to a json file listing the archives to extract, with the flatten depth and output directory "
+             '(relative to --out_dir) of each: {"archives": [{"path": "IGC-News1-21.05.zip", "flatten_depth": 1, '
+             '"out_dir": "news1"}, ...]}. The files of all the archives are extracted by the same workers, '
+             "largest output files first. The other options apply to every archive. Replaces --in_path.",
+    )
     parser.add_argument(
         "-o",
         "--out_dir",
@@ -208,13 +1124,35 @@ if __name__ == "__main__":
         "--processes",
         type=int,
         default=20,
-        help="The number of processes to use when parsing XML for each output file.",
+        help="The number of worker processes which read, parse and serialize the XML files.",
     )
     parser.add_argument(
         "--chunksize",
         type=int,
-        default=10,
-        help="The number of XML files to send to each process.",
+        default=None,
+        help="The maximum number of XML files to send to each process at a time. "
+             "If only this is given, the files are chunked by count instead of by size.",
+    )
+    parser.add_argument(
+        "--chunk_bytes",
+        type=int,
+        default=None,
+        help="The maximum uncompressed size of the XML files to send to each process at a time. Larger files are "
+             f"sent on their own. Defaults to {DEFAULT_CHUNK_BYTES} unless --chunksize is given.",
+    )
+    parser.add_argument(
+        "--max_in_flight",
+        type=int,
+        default=None,
+        help="The maximum number of XML files which are being read, parsed or waiting to be written at any time. "
+             "Defaults to processes * chunksize * 4 when chunking by count, otherwise not limited.",
+    )
+    parser.add_argument(
+        "--max_in_flight_bytes",
+        type=int,
+        default=None,
+        help="The maximum total uncompressed size of the XML files in flight at any time, besides a single larger "
+             "file. Defaults to processes * chunk_bytes * 4 when chunking by size, otherwise not limited.",
     )
     parser.add_argument(
         "--to_jsonl",
@@ -222,6 +1160,26 @@ if __name__ == "__main__":
         default=False,
         help="If true, the output files will be in jsonl format. Otherwise, they will be in txt format.",
     )
+    parser.add_argument(
+        "--to_segments",
+        action="store_true",
+        default=False,
+        help="Write merged segments, file_id.par.sent<TAB>text lines, like merge_text_segments.py would write "
+             "for the sentences of each document, to .tsv files.",
+    )
+    parser.add_argument(
+        "--segment_max_chars",
+        type=int,
+        default=merge_text_segments.MAX_CHARS_IN_BATCH,
+        help="With --to_segments, the maximum number of characters in a merged segment.",
+    )
+    parser.add_argument(
+        "--to_shards",
+        action="store_true",
+        default=False,
+        help="Extract the tokens of an annotated (.ana.xml) archive to binary token shards, "
+             "with the forms, lemmas and tags stored as ids into interned vocabularies (see rmhshard.py).",
+    )
     parser.add_argument(
         "--domains",
         type=str,
@@ -231,17 +1189,243 @@ if __name__ == "__main__":
              "Usage: --domains domain1 domain2 domain3",
     )
 
+    parser.add_argument(
+        "--resume",
+        "--incremental",
+        dest="resume",
+        action="store_true",
+        default=False,
+        help="Skip output files which are already complete and whose XML files are unchanged according to the "
+             f"manifest ({MANIFEST_FILE_NAME}) in the output directory. "
+             "Use this to continue an interrupted extraction or to update the output for a new version of the archive.",
+    )
+
+    parser.add_argument(
+        "--members",
+        type=file_type_guard,
+        default=None,
+        help="Path to a file with the names of the XML files to extract, one per line, "
+             "e.g. the output of a catalog_rmh.py query. Other files in the archive are ignored.",
+    )
+
+    sample_group = parser.add_argument_group(
+        "sampling",
+        "Extract a random sample of the XML files of each output file (as assigned by --flatten_depth), "
+        "e.g. of each top-level source with --flatten_depth 1. The sample is chosen from the directory of the zip "
+        "file, so only the chosen files are decompressed and parsed.",
+    )
+    sample_group.add_argument(
+        "--sample",
+        type=int,
+        default=None,
+        help="The number of XML files to extract for each output file. Output files with fewer files are extracted "
+             "whole.",
+    )
+    sample_group.add_argument(
+        "--sample_weight",
+        choices=SAMPLE_WEIGHTS,
+        default="count",
+        help="Choose every file with the same probability (count), or in proportion to its uncompressed size (size).",
+    )
+    sample_group.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="The seed of the sample. The same seed gives the same sample of the same archive.",
+    )
+
+    parser.add_argument(
+        "--split_cache_size",
+        type=int,
+        default=rmhsplit.DEFAULT_CACHE_SIZE,
+        help="The number of distinct paragraphs whose sentences are cached by each worker, "
+             "so repeated paragraphs are only split once. 0 disables the cache.",
+    )
+    parser.add_argument(
+        "--split_batch_chars",
+        type=int,
+        default=rmhsplit.DEFAULT_BATCH_CHARS,
+        help="Split short paragraphs into sentences in batches of about this many characters. "
+             "0 (the default) splits each paragraph with a separate tokenizer call.",
+    )
+    shard_group = parser.add_argument_group(
+        "compressed shards",
+        "Write each text or jsonl output file as numbered, compressed shards, e.g. IGC-News1.00000.txt.gz, along "
+        f"with an index (e.g. IGC-News1{rmhwriter.SHARD_INDEX_SUFFIX}) listing the shards with their document "
+        "counts and sizes. Used if any of these options is given.",
+    )
+    shard_group.add_argument(
+        "--compression",
+        choices=list(rmhwriter.COMPRESSION_SUFFIXES),
+        default=None,
+        help="The compression of the shards. zstd requires the zstandard package. Defaults to none.",
+    )
+    shard_group.add_argument(
+        "--shard_max_bytes",
+        type=int,
+        default=None,
+        help="Start a new shard when the current one has at least this many bytes of uncompressed text.",
+    )
+    shard_group.add_argument(
+        "--shard_max_docs",
+        type=int,
+        default=None,
+        help="Start a new shard when the current one has this many documents.",
+    )
+    parser.add_argument(
+        "--parser",
+        choices=list(rmhfile.ENGINES),
+        default=rmhfile.DEFAULT_ENGINE,
+        help="The engine which parses the XML files. expat extracts the text and tokens without building a tree, "
+             "lxml is available if the lxml package is installed. All engines give the same output.",
+    )
+    parser.add_argument(
+        "--doc_index",
+        action="store_true",
+        default=False,
+        help=f"Record the id, idno, source file, byte offset and length of each document in {rmhindex.INDEX_FILE_NAME} "
+             "in the output directory, so documents can be read by their id with rmhindex.py. "
+             "Not supported with --to_shards or compressed shards.",
+    )
+    write_group = parser.add_argument_group(
+        "writing",
+        "The output files are written by a writer thread, so writing to a slow disk (e.g. network storage) "
+        "overlaps with the extraction. The time it spends writing is reported in the extraction statistics.",
+    )
+    write_group.add_argument(
+        "--write_buffer_size",
+        type=int,
+        default=DEFAULT_WRITE_BUFFER_SIZE,
+        help="Collect this many bytes of text, jsonl or segment output before writing them to the output file.",
+    )
+    write_group.add_argument(
+        "--fsync",
+        choices=FSYNC_POLICIES,
+        default="never",
+        help="Sync the text, jsonl or segment output to disk before an output file is moved to its final name "
+             "(close) or after every write (always). Defaults to never, leaving it to the operating system.",
+    )
+    write_group.add_argument(
+        "--writer_queue_size",
+        type=int,
+        default=rmhwriter.DEFAULT_QUEUE_SIZE,
+        help="The maximum number of writes which the writer thread can be behind before the extraction waits for it.",
+    )
+    parser.add_argument(
+        "--stats_interval",
+        type=float,
+        default=None,
+        help=f"Append a snapshot of the extraction statistics to {STATS_SAMPLES_FILE_NAME} in the output directory "
+             f"about every this many seconds. The final statistics are always written to {STATS_FILE_NAME}.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help=f"Profile the workers with cProfile and write the merged profile to {PROFILE_FILE_NAME} "
+             "in the output directory.",
+    )
+    dedup_group = parser.add_argument_group(
+        "deduplication",
+        "Drop documents which are exact or near duplicates of documents which have already been extracted. "
+        f"The dropped documents are listed in {DEDUP_REPORT_FILE_NAME} in the output directory.",
+    )
+    dedup_group.add_argument(
+        "--dedup",
+        action="store_true",
+        default=False,
+        help="Drop duplicate documents. Not supported with --to_shards.",
+    )
+    dedup_group.add_argument(
+        "--dedup_threshold",
+        type=float,
+        default=rmhdedup.DEFAULT_THRESHOLD,
+        help="Drop documents whose estimated Jaccard similarity (of word 5-grams) to an earlier document is at least "
+             "this. Documents which only differ in case, punctuation and whitespace are always dropped.",
+    )
+    dedup_group.add_argument(
+        "--dedup_store",
+        type=Path,
+        default=None,
+        help=f"Path to the store of the documents seen so far. Defaults to {DEDUP_STORE_FILE_NAME} in the output "
+             "directory. Use the same store for several archives to deduplicate across them.",
+    )
+    filter_group = parser.add_argument_group(
+        "document filter",
+        "Only extract documents whose header fulfills all the given conditions. "
+        "The rest of a document is not parsed if its header is rejected.",
+    )
+    filter_group.add_argument("--date_from", default=None, help="Earliest date, e.g. 2001 or 2001-06-01")
+    filter_group.add_argument("--date_to", default=None, help="Latest date (inclusive), e.g. 2001 or 2001-06-30")
+    filter_group.add_argument("--id_regex", default=None, help="Only documents whose id or idno matches this regex")
+    filter_group.add_argument("--author", default=None, help="Only documents by this author")
+    filter_group.add_argument("--title_contains", default=None, help="Only documents with this text in the title")
+
     args = parser.parse_args()
+    if (args.in_path is None) == (args.config is None):
+        parser.error("Exactly one of --in_path and --config must be given")
+    if args.config is not None and args.members is not None:
+        parser.error("--members can not be used with --config")
+    if args.to_jsonl + args.to_shards + args.to_segments > 1:
+        parser.error("Only one of --to_jsonl, --to_shards and --to_segments can be used")
+    if args.dedup and args.to_shards:
+        parser.error("--dedup can not be used with --to_shards")
+    if args.to_shards and (
+        args.compression is not None or args.shard_max_bytes is not None or args.shard_max_docs is not None
+    ):
+        parser.error("--compression, --shard_max_bytes and --shard_max_docs can not be used with --to_shards")
+    if args.doc_index and (
+        args.to_shards
+        or args.compression is not None
+        or args.shard_max_bytes is not None
+        or args.shard_max_docs is not None
+    ):
+        parser.error("--doc_index can not be used with --to_shards or compressed shards")
+    if args.sample is not None and args.sample < 1:
+        parser.error("--sample must be at least 1")
+    if args.chunksize is None and args.chunk_bytes is None:
+        args.chunk_bytes = DEFAULT_CHUNK_BYTES
     logging.basicConfig(level=logging.INFO)
 
-    extract_all(
-        zip_file_path=args.in_path,
-        output_file=args.out_dir,
-        flatten_depth=args.flatten_depth,
-        # TODO: Add support for ana.xml
-        accepted_suffixes=[".xml"],
+    if args.config is not None:
+        archives = load_archive_config(args.config, args.out_dir)
+    else:
+        archives = [ArchiveSpec(args.in_path, args.out_dir, args.flatten_depth)]
+    extract_many(
+        archives=archives,
+        out_dir=args.out_dir,
+        accepted_suffixes=[".ana", ".xml"] if args.to_shards else [".xml"],
         processes=args.processes,
         chunksize=args.chunksize,
+        chunk_bytes=args.chunk_bytes,
+        doc_index=args.doc_index,
+        parser_engine=args.parser,
+        write_buffer_size=args.write_buffer_size,
+        fsync=args.fsync,
+        writer_queue_size=args.writer_queue_size,
+        sample=SampleSpec(args.sample, args.sample_weight, args.seed) if args.sample is not None else None,
         to_jsonl=args.to_jsonl,
+        to_shards=args.to_shards,
+        to_segments=args.to_segments,
+        segment_max_chars=args.segment_max_chars,
+        split_options={"cache_size": args.split_cache_size, "batch_chars": args.split_batch_chars},
         domains=args.domains,
+        max_in_flight=args.max_in_flight,
+        max_in_flight_bytes=args.max_in_flight_bytes,
+        resume=args.resume,
+        dedup_threshold=args.dedup_threshold if args.dedup else None,
+        dedup_store_path=args.dedup_store,
+        compression=args.compression,
+        shard_max_bytes=args.shard_max_bytes,
+        shard_max_docs=args.shard_max_docs,
+        stats_interval=args.stats_interval,
+        profile=args.profile,
+        members=args.members.read_text(encoding="utf-8").splitlines() if args.members is not None else None,
+        document_filter=DocumentFilter(
+            date_from=args.date_from,
+            date_to=args.date_to,
+            id_regex=args.id_regex,
+            author=args.author,
+            title_contains=args.title_contains,
+        ),
     )
@@ -20,13 +20,20 @@
       Utility script that merges adjacent text segments until they are close to a
       certain length. If a sentence is too long, the characters that exceed the max_length
       will be removed.
+
+      With --processes, the input is read in large chunks which are cut where the file id changes,
+      and the chunks are merged in parallel, giving the same output as merging sequentially.
 """
 
+import io
 import sys
-from collections import namedtuple
+from collections import deque, namedtuple
+from contextlib import nullcontext
+from multiprocessing import Pool
 
 MAX_CHARS_IN_BATCH = 400
 MAX_LINES_MERGED_IN_BATCH = 6
+CHUNK_CHARS = 16 * 1024 * 1024
 CorpusLine = namedtuple("CorpusLine", ["file_id", "par_idx", "sent_idx", "text"])
 
 
@@ -82,12 +89,18 @@ def as_docs(line_stream):
 
 
 def line_merger(lines, max_len=MAX_CHARS_IN_BATCH, max_merge=MAX_LINES_MERGED_IN_BATCH):
+    return corpus_line_merger(
+        (parse_line(line.strip(), max_len) for line in lines), max_len=max_len, max_merge=max_merge
+    )
+
+
+def corpus_line_merger(corpus_lines, max_len=MAX_CHARS_IN_BATCH, max_merge=MAX_LINES_MERGED_IN_BATCH):
+    """Merge CorpusLines whose text is at most max_len characters, e.g. the sentences of a document
+    which are already in memory, as line_merger() does for the lines of a tsv file."""
     batch = []
     total = 0
     file_id = None
-    for line in lines:
-        line = parse_line(line.strip(), max_len)
-
+    for line in corpus_lines:
         if len(batch) == 0:
             par_idx = line.par_idx
             file_id = line.file_id
@@ -119,13 +132,96 @@ def line_merger(lines, max_len=MAX_CHARS_IN_BATCH, max_merge=MAX_LINES_MERGED_IN
         yield merge_lines(batch)
 
 
+def file_id_of(line):
+    """The file id of a line, as parse_line() reads it."""
+    return line.strip().split("\t", 1)[0].split(".", 1)[0]
+
+
+def last_file_boundary(block, previous_id=None):
+    """Find the start of the last line of a block of complete lines whose file id differs from that of the line
+    before it (previous_id, for the first line of the block), and return it, or None if there is none, along with
+    the file id of the last line. The file ids of a tsv file are grouped, so the position is found by bisecting the
+    lines between the first line and the last one, and only a few lines of the block are read."""
+    last_start = block.rfind("\n", 0, len(block) - 1) + 1
+    last_id = file_id_of(block[last_start:])
+    first_end = block.find("\n")
+    if file_id_of(block[: first_end if first_end != -1 else len(block)]) == last_id:
+        return (0 if previous_id is not None and previous_id != last_id else None), last_id
+    low, high = 0, last_start  # A line with another file id, and a later line with the last file id
+    while True:
+        middle = block.rfind("\n", 0, (low + high) // 2) + 1
+        if middle <= low:
+            middle = block.find("\n", low) + 1
+        if middle >= high:
+            return high, last_id
+        if file_id_of(block[middle : block.find("\n", middle)]) == last_id:
+            high = middle
+        else:
+            low = middle
+
+
+def chunks_at_file_boundaries(in_handle, chunk_chars=CHUNK_CHARS):
+    """Read the input in blocks of chunk_chars characters (completed to the end of a line), and yield it in chunks
+    which end at the last position in a block where the file id changes. A file which is larger than a block is
+    kept whole. Merged segments never span such a position, since the merger starts a new segment whenever the
+    file id changes. Only a few lines of each block are read here, the workers read every line when they merge."""
+    parts = []  # The input which has been read but not yielded
+    last_id = None  # The file id of the last line read
+    while True:
+        block = in_handle.read(chunk_chars)
+        if not block:
+            break
+        if not block.endswith("\n"):
+            block += in_handle.readline()
+        boundary, last_id = last_file_boundary(block, last_id)
+        if boundary is None:
+            parts.append(block)
+            continue
+        parts.append(block[:boundary])
+        chunk = "".join(parts)
+        if chunk:
+            yield chunk
+        parts = [block[boundary:]]
+    if parts:
+        yield "".join(parts)
+
+
+def merge_chunk(text, max_len=MAX_CHARS_IN_BATCH, max_merge=MAX_LINES_MERGED_IN_BATCH):
+    """Merge the lines of a chunk, returning the output lines as a single string. Runs in a worker process."""
+    return "".join(merged + "\n" for merged in line_merger(io.StringIO(text), max_len=max_len, max_merge=max_merge))
+
+
+def parallel_line_merger(
+    in_handle, processes, max_len=MAX_CHARS_IN_BATCH, max_merge=MAX_LINES_MERGED_IN_BATCH, chunk_chars=CHUNK_CHARS
+):
+    """Merge the lines of in_handle in a pool of worker processes, yielding the merged output of each chunk in the
+    order of the input. At most processes * 2 chunks are read but not yet yielded at any time."""
+    in_flight = deque()
+    with Pool(processes=processes) as pool:
+        for chunk in chunks_at_file_boundaries(in_handle, chunk_chars):
+            if len(in_flight) >= processes * 2:
+                yield in_flight.popleft().get()
+            in_flight.append(pool.apply_async(merge_chunk, (chunk, max_len, max_merge)))
+        while in_flight:
+            yield in_flight.popleft().get()
+
+
 def path_filetype(path_string):
     from pathlib import Path
 
+    if path_string == "-":
+        return path_string
     path = Path(path_string)
     return path if path.exists() else None
 
 
+def open_or_std(path, mode):
+    """Open path, or use stdin or stdout (without closing it) if path is -."""
+    if str(path) == "-":
+        return nullcontext(sys.stdin if "r" in mode else sys.stdout)
+    return open(str(path), mode=mode)
+
+
 def main():
     import argparse
 
@@ -150,7 +246,7 @@ def main():
         dest="out_file",
         required=False,
         type=str,
-        default=sys.stdout,
+        default="-",
         help="Path to the output file, defaults to stdout",
     )
     parser.add_argument(
@@ -171,11 +267,40 @@ def main():
         default=MAX_CHARS_IN_BATCH,
         help="Maximum number of chars after merging",
     )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        dest="processes",
+        required=False,
+        type=int,
+        default=1,
+        help="Merge chunks of the input in this many worker processes. The output is the same as with 1 (the default)",
+    )
+    parser.add_argument(
+        "--chunk-chars",
+        dest="chunk_chars",
+        required=False,
+        type=int,
+        default=CHUNK_CHARS,
+        help="Approximate number of characters in each chunk sent to a worker process",
+    )
 
     args = parser.parse_args()
+    if args.in_file is None:
+        parser.error("Input file does not exist")
 
-    with open(str(args.out_file), mode="w") as out_handle:
-        with open(str(args.in_file), mode="r") as in_handle:
+    with open_or_std(args.out_file, mode="w") as out_handle:
+        with open_or_std(args.in_file, mode="r") as in_handle:
+            if args.processes > 1:
+                for merged in parallel_line_merger(
+                    in_handle,
+                    args.processes,
+                    max_len=args.max_chars,
+                    max_merge=args.max_lines,
+                    chunk_chars=args.chunk_chars,
+                ):
+                    out_handle.write(merged)
+                return
             for output_line in line_merger(
                 in_handle, max_len=args.max_chars, max_merge=args.max_lines
             ):
@@ -0,0 +1,173 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     RMH deduplication
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Exact and near-duplicate detection of documents during extraction.
+     Workers compute a content hash and a MinHash signature of each document,
+     which are checked against a disk-backed store of the documents seen so far.
+"""
+
+import hashlib
+import random
+import re
+import sqlite3
+import struct
+from collections import namedtuple
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import rmhfile
+
+NUM_PERMUTATIONS = 64
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // NUM_BANDS
+SHINGLE_SIZE = 5
+DEFAULT_THRESHOLD = 0.8
+# The page cache of the store, in KiB, which bounds the memory used by the store
+STORE_CACHE_KIB = 256 * 1024
+
+# The same masks in every process, so signatures are comparable
+_MASKS = [random.Random(1234 + i).getrandbits(64) for i in range(NUM_PERMUTATIONS)]
+_WORD_RE = re.compile(r"\w+")
+
+# The content hash of a document and its MinHash signature
+Signature = namedtuple("Signature", "content_hash minhash")
+# A document which was dropped as a duplicate of an earlier document
+Duplicate = namedtuple("Duplicate", "kind original_member similarity")
+
+
+def record_paragraphs(rmhf: rmhfile.RMHFile) -> List[str]:
+    """Make the paragraphs of the file be recorded as they are read, so a signature can be computed from them
+    after the file has been serialized. Returns the list the paragraphs are recorded to."""
+    recorded: List[str] = []
+    paragraphs = rmhf.paragraphs
+
+    def recording_paragraphs():
+        for paragraph in paragraphs():
+            recorded.append(paragraph)
+            yield paragraph
+
+    rmhf.paragraphs = recording_paragraphs  # type: ignore
+    return recorded
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def signature(paragraphs: Iterable[str]) -> Optional[Signature]:
+    """Compute the signature of a document from its paragraphs. Both the content hash and the shingles ignore case,
+    punctuation and whitespace, so trivially different copies of a document are exact duplicates.
+    Documents without words have no signature, since they would all be duplicates of each other."""
+    words = _WORD_RE.findall(" ".join(paragraphs).lower())
+    if not words:
+        return None
+    content_hash = hashlib.blake2b(" ".join(words).encode("utf-8"), digest_size=16).digest()
+    shingles = {
+        _hash64(" ".join(words[i : i + SHINGLE_SIZE])) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))
+    }
+    minhash = struct.pack(f"<{NUM_PERMUTATIONS}Q", *(min(map(mask.__xor__, shingles)) for mask in _MASKS))
+    return Signature(content_hash, minhash)
+
+
+def _band_keys(minhash: bytes) -> List[int]:
+    """The LSH keys of a signature, one per band. Two documents are candidates if any of their keys match."""
+    band_size = ROWS_PER_BAND * 8
+    return [
+        band * (1 << 56) + int.from_bytes(hashlib.blake2b(minhash[band * band_size : (band + 1) * band_size],
+                                                          digest_size=7).digest(), "little")
+        for band in range(NUM_BANDS)
+    ]
+
+
+def similarity(minhash_a: bytes, minhash_b: bytes) -> float:
+    """Estimate the Jaccard similarity of two documents from their MinHash signatures."""
+    a = struct.unpack(f"<{NUM_PERMUTATIONS}Q", minhash_a)
+    b = struct.unpack(f"<{NUM_PERMUTATIONS}Q", minhash_b)
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERMUTATIONS
+
+
+class DedupStore:
+    """The signatures of all the documents kept so far, in a SQLite database on disk."""
+
+    def __init__(self, path: Path, threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute(f"PRAGMA cache_size = -{STORE_CACHE_KIB}")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                doc_id INTEGER PRIMARY KEY,
+                member TEXT NOT NULL,
+                output_file TEXT NOT NULL,
+                content_hash BLOB NOT NULL,
+                minhash BLOB
+            );
+            CREATE INDEX IF NOT EXISTS documents_content_hash ON documents (content_hash);
+            CREATE INDEX IF NOT EXISTS documents_output_file ON documents (output_file);
+            CREATE TABLE IF NOT EXISTS bands (band_key INTEGER NOT NULL, doc_id INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS bands_band_key ON bands (band_key);
+            """
+        )
+
+    def forget_output_files(self, output_files: Iterable[str]) -> None:
+        """Remove the documents of output files which are about to be extracted again."""
+        with self.conn:
+            for output_file in output_files:
+                self.conn.execute(
+                    "DELETE FROM bands WHERE doc_id IN (SELECT doc_id FROM documents WHERE output_file = ?)",
+                    (output_file,),
+                )
+                self.conn.execute("DELETE FROM documents WHERE output_file = ?", (output_file,))
+
+    def check_and_add(self, member: str, output_file: str, sig: Signature) -> Optional[Duplicate]:
+        """Return the earlier document this one duplicates, or add it to the store and return None."""
+        row = self.conn.execute(
+            "SELECT member FROM documents WHERE content_hash = ? LIMIT 1", (sig.content_hash,)
+        ).fetchone()
+        if row is not None:
+            return Duplicate("exact", row[0], 1.0)
+        band_keys = _band_keys(sig.minhash)
+        candidates = self.conn.execute(
+            f"SELECT DISTINCT d.member, d.minhash FROM bands b JOIN documents d ON b.doc_id = d.doc_id "
+            f"WHERE b.band_key IN ({', '.join('?' * len(band_keys))})",
+            band_keys,
+        ).fetchall()
+        best: Optional[Tuple[float, str]] = None
+        for candidate_member, candidate_minhash in candidates:
+            score = similarity(sig.minhash, candidate_minhash)
+            if score >= self.threshold and (best is None or score > best[0]):
+                best = (score, candidate_member)
+        if best is not None:
+            return Duplicate("near", best[1], best[0])
+        cursor = self.conn.execute(
+            "INSERT INTO documents (member, output_file, content_hash, minhash) VALUES (?, ?, ?, ?)",
+            (member, output_file, sig.content_hash, sig.minhash),
+        )
+        self.conn.executemany(
+            "INSERT INTO bands (band_key, doc_id) VALUES (?, ?)", ((key, cursor.lastrowid) for key in band_keys)
+        )
+        return None
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
@@ -19,15 +19,25 @@
     along with this program.  If not, see http://www.gnu.org/licenses/.
 
      Wrapper class for an xml resource file, as part of the RMH corpus.
+     Streamed files are parsed by a pluggable engine: expat (the default), lxml (if it is installed)
+     or ElementTree.
 """
 
 import logging
+import sys
 import xml.etree.cElementTree as ET
+import xml.parsers.expat
 from collections import namedtuple
+from functools import cached_property, partial
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from xml.etree.ElementTree import Element
 
+try:
+    import lxml.etree
+except ImportError:
+    lxml = None
+
 log = logging.getLogger(__name__)
 
 URI = "http://www.tei-c.org/ns/1.0"
@@ -35,18 +45,90 @@ TEI = "{" + URI + "}"
 NS = {"tei": URI}
 ET.register_namespace("", URI)
 
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+# The size of the blocks which the expat engine reads from a stream
+READ_SIZE = 64 * 1024
+
 RMHSentence = namedtuple("RMHSentence", "index tokens")
 RMHToken = namedtuple("RMHToken", "text lemma tag id")
+# A paragraph (tei:div/tei:p or tei:u/tei:seg) as a parser engine reports it: its n attribute, its text before
+# the first child element (None if there is none, as in ElementTree) and for each of its tei:s children, a tuple
+# of its n attribute and lists of the forms, lemmas and tags of its tokens
+RMHParagraph = namedtuple("RMHParagraph", "index text sentences")
+# The events of a parser engine: ("root", the root element without its content), ("header", the header
+# element) and ("paragraph", an RMHParagraph) for each paragraph which is not within the header or another paragraph
+ParseEvent = Tuple[str, Any]
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if value is not None else None
+
+
+class CompactSentence:
+    """A sentence stored as parallel lists of the forms, lemmas and tags of its tokens, where the lemmas and tags
+    are interned strings, so a large number of sentences can be kept in memory. The id of the sentence and the
+    RMHToken objects of the tokens are only built when asked for, so it can be used like an RMHSentence."""
+
+    __slots__ = ("document", "paragraph", "number", "forms", "lemmas", "tags")
+
+    def __init__(
+        self,
+        document: Optional[str],
+        paragraph: Optional[str],
+        number: Optional[str],
+        forms: List[Optional[str]],
+        lemmas: List[Optional[str]],
+        tags: List[Optional[str]],
+    ):
+        self.document = document
+        self.paragraph = paragraph
+        self.number = number
+        self.forms = forms
+        self.lemmas = lemmas
+        self.tags = tags
+
+    @property
+    def index(self) -> str:
+        """The id of the sentence, idno.paragraph.sentence, as in RMHSentence."""
+        return f"{self.document}.{self.paragraph}.{self.number}"
+
+    @property
+    def tokens(self) -> List[RMHToken]:
+        return [RMHToken(form, lemma, tag, form) for form, lemma, tag in zip(self.forms, self.lemmas, self.tags)]
+
+    def as_sentence(self) -> RMHSentence:
+        return RMHSentence(self.index, self.tokens)
+
+    def __iter__(self) -> Iterator:
+        """Unpack as an RMHSentence: index, tokens = sentence"""
+        return iter(self.as_sentence())
+
+    def __len__(self) -> int:
+        return len(self.forms)
 
 
 class RMHFile:
-    """An xml file that is part of the RMH corpus"""
+    """An xml file that is part of the RMH corpus.
+    The header fields are looked up once and then cached."""
 
     def __init__(self, data: str, path: Path):
         self.path = path
         self.root = ET.fromstring(data)
 
-    @property
+    @classmethod
+    def from_stream(
+        cls,
+        stream: BinaryIO,
+        path: Path,
+        engine: Optional[str] = None,
+        wrap_events: Optional[Callable[[Iterator[ParseEvent]], Iterator[ParseEvent]]] = None,
+    ) -> "StreamingRMHFile":
+        """Parse an RMH file incrementally from a byte stream, e.g. one returned by ZipFile.open(),
+        with one of the ENGINES, by default the one chosen with configure().
+        The events of the engine are passed through wrap_events if it is given, e.g. to time the parsing."""
+        return StreamingRMHFile(stream, path, engine, wrap_events)
+
+    @cached_property
     def header(self) -> Element:
         """Return the header element"""
         header = self.root.find(".//tei:teiHeader", NS)
@@ -54,7 +136,7 @@ class RMHFile:
             raise ValueError(f"No header found in file: {self.path}")
         return header
 
-    @property
+    @cached_property
     def author(self) -> Optional[str]:
         """Return the author text, if present."""
         author_elem = self.header.find(".//tei:biblStruct/tei:analytic/tei:author", NS)
@@ -62,7 +144,7 @@ class RMHFile:
             return author_elem.text
         return None
 
-    @property
+    @cached_property
     def date(self) -> Optional[str]:
         """Return the date string, if present."""
         date_elem = self.header.find(".//tei:biblStruct/tei:analytic/tei:date", NS)
@@ -70,7 +152,7 @@ class RMHFile:
             return date_elem.text
         return None
 
-    @property
+    @cached_property
     def title(self) -> str:
         """Return the title string, if present."""
         if self.is_social or self.is_news:
@@ -81,37 +163,45 @@ class RMHFile:
             raise ValueError(f"No title found in file: {self.path}")
         return title_elem.text
 
-    @property
+    @cached_property
     def id(self) -> str:
         """The id of the XML"""
-        id_elem = self.root.attrib.get("{http://www.w3.org/XML/1998/namespace}id")
+        id_elem = self.root.attrib.get(XML_ID)
         if id_elem is None:
             raise ValueError(f"No id found in file: {self.path}")
         return id_elem
 
-    @property
+    @cached_property
     def idno(self) -> Optional[str]:
         """Return the idno as string, if present."""
         idno_elem = self.root.find(".//tei:idno", NS)  # idno is in IGC-Adjud
         if idno_elem is not None:
             return idno_elem.text
-        return self.root.attrib.get("{http://www.w3.org/XML/1998/namespace}id")
+        return self.root.attrib.get(XML_ID)
 
-    @property
+    @cached_property
     def is_adjud(self) -> bool:
         """Return True if this is an adjudication file"""
         return self.id.startswith("IGC-Adjud")
 
-    @property
+    @cached_property
     def is_social(self) -> bool:
         """Return True if this is a social file"""
         return self.id.startswith("IGC-Social")
 
-    @property
+    @cached_property
     def is_news(self) -> bool:
         """Return True if this is a news file"""
         return self.id.startswith("IGC-News")
 
+    @cached_property
+    def source(self) -> Optional[str]:
+        """Return the title of the publication (tei:monogr) the text appeared in, if present."""
+        source_elem = self.header.find(".//tei:biblStruct/tei:monogr/tei:title", NS)
+        if source_elem is not None:
+            return source_elem.text
+        return None
+
     def ref(self):
         """Return the reference for this file"""
         el = self.header.find(".//tei:biblScope/tei:ref", NS)
@@ -128,25 +218,312 @@ class RMHFile:
             raise ValueError(f"No paragraphs found in file: {self.path}")
         return pgs  # type: ignore
 
+    def paragraph_records(self) -> Iterable[RMHParagraph]:
+        """Return the paragraphs with their sentences and tokens."""
+        return [_paragraph_record(pg) for pg in self._paragraphs()]
+
     def paragraphs(self) -> List[str]:
-        """for now just collecting paragraphs from the TEI untokenized format"""
+        """for now just collecting paragraphs from the TEI untokenized format.
+        Only the text of the paragraph elements is read, the sentences and tokens are not built."""
         return [pg.text for pg in self._paragraphs() if pg.text is not None]
 
+    def compact_sentences(self) -> Iterator[CompactSentence]:
+        """Return all the sentences in this file, as CompactSentences."""
+        idno = self.idno
+        for pg in self.paragraph_records():
+            for sent_idx, forms, lemmas, tags in pg.sentences:
+                yield CompactSentence(idno, pg.index, sent_idx, forms, lemmas, tags)
+
     def sentences(self) -> Iterable[RMHSentence]:
         """Return all the sentences in this file."""
-        idno = self.idno
-        for pg in self._paragraphs():
-            pg_idx = pg.attrib.get("n")
-            for sentence in pg.iterfind("tei:s", NS):
-                sent_idx = sentence.attrib.get("n")
-                tokens = []
-                for item in sentence:
-                    token = RMHToken(
-                        item.text,
-                        item.attrib.get("lemma", item.text),
-                        item.attrib.get("pos", item.text),
-                        item.attrib.get("xml:id", item.text),
-                    )
-                    tokens.append(token)
-                sent_id = f"{idno}.{pg_idx}.{sent_idx}"
-                yield RMHSentence(sent_id, tokens)
+        return (sentence.as_sentence() for sentence in self.compact_sentences())
+
+
+class StreamingRMHFile(RMHFile):
+    """An RMH xml file which is parsed incrementally from a byte stream.
+
+    Only the header is kept in memory. Paragraphs are yielded as soon as they have been parsed
+    and are then dropped, so the memory used does not depend on the size of the document.
+    As a consequence, the paragraphs of a file can only be iterated over once, using either
+    paragraphs(), sentences() or paragraph_records(). The file is parsed by the given engine,
+    by default the one chosen with configure().
+    """
+
+    def __init__(  # pylint: disable=super-init-not-called
+        self,
+        stream: BinaryIO,
+        path: Path,
+        engine: Optional[str] = None,
+        wrap_events: Optional[Callable[[Iterator[ParseEvent]], Iterator[ParseEvent]]] = None,
+    ):
+        self.path = path
+        self._root: Optional[Element] = None
+        self._header: Optional[Element] = None
+        self._parser = ENGINES[engine or _engine](stream)
+        if wrap_events is not None:
+            self._parser = wrap_events(self._parser)
+
+    def _next_event(self) -> Optional[ParseEvent]:
+        """Advance the parser by one event, recording the root and header. Returns None at the end of the file."""
+        event = next(self._parser, None)
+        if event is not None:
+            kind, value = event
+            if kind == "root":
+                self._root = value
+            elif kind == "header":
+                self._header = value
+        return event
+
+    def _next_paragraph(self) -> Optional[RMHParagraph]:
+        """Advance the parser to the next paragraph. Returns None at the end of the file."""
+        while True:
+            event = self._next_event()
+            if event is None:
+                return None
+            if event[0] == "paragraph":
+                return event[1]
+
+    def _read_header(self) -> None:
+        """Advance the parser until the header has been read. The header precedes the text in TEI files,
+        so a paragraph before the header is an error, rather than a reason to keep the paragraphs in memory."""
+        while self._header is None:
+            event = self._next_event()
+            if event is None:
+                break
+            if event[0] == "paragraph":
+                raise ValueError(f"Found a paragraph before the header in file: {self.path}")
+
+    @property  # type: ignore
+    def root(self) -> Element:
+        """Return the root element. Its text content is discarded as the file is parsed."""
+        self._read_header()
+        if self._root is None:
+            raise ValueError(f"No root element found in file: {self.path}")
+        return self._root
+
+    @cached_property
+    def header(self) -> Element:
+        """Return the header element"""
+        self._read_header()
+        if self._header is None:
+            raise ValueError(f"No header found in file: {self.path}")
+        return self._header
+
+    @cached_property
+    def idno(self) -> Optional[str]:
+        """Return the idno as string, if present."""
+        idno_elem = self.header.find(".//tei:idno", NS)
+        if idno_elem is not None:
+            return idno_elem.text
+        return self.root.attrib.get(XML_ID)
+
+    def paragraph_records(self) -> Iterator[RMHParagraph]:  # type: ignore
+        """Yield the paragraphs (tei:div/tei:p or tei:u/tei:seg) as they are parsed."""
+        count = 0
+        while True:
+            pg = self._next_paragraph()
+            if pg is None:
+                break
+            count += 1
+            yield pg
+        if count == 0:
+            raise ValueError(f"No paragraphs found in file: {self.path}")
+
+    def paragraphs(self) -> Iterator[str]:  # type: ignore
+        """Yield the text of each paragraph as it is parsed."""
+        return (pg.text for pg in self.paragraph_records() if pg.text is not None)
+
+
+def _is_paragraph(elem: Element, parent: Element) -> bool:
+    """Return True if elem is a paragraph: tei:div/tei:p, or tei:u/tei:seg in IGC-Parla."""
+    return (elem.tag == TEI + "p" and parent.tag == TEI + "div") or (
+        elem.tag == TEI + "seg" and parent.tag == TEI + "u"
+    )
+
+
+def _paragraph_record(pg: Element) -> RMHParagraph:
+    """The paragraph, sentences and tokens of a paragraph element."""
+    return RMHParagraph(
+        pg.attrib.get("n"),
+        pg.text,
+        [
+            (
+                sentence.attrib.get("n"),
+                [item.text for item in sentence],
+                [_intern(item.attrib.get("lemma", item.text)) for item in sentence],
+                [_intern(item.attrib.get("pos", item.text)) for item in sentence],
+            )
+            for sentence in pg.iterfind("tei:s", NS)
+        ],
+    )
+
+
+def _parse_tree(stream: BinaryIO, iterparse: Callable = ET.iterparse) -> Iterator[ParseEvent]:
+    """Parse the stream with an ElementTree style iterparse, building elements for the header and for each
+    paragraph, which are detached from the tree once they have been reported."""
+    stack: List[Element] = []
+    protected = 0  # The number of open elements which must be kept intact (the header or a paragraph)
+    for event, elem in iterparse(stream, events=("start", "end")):
+        if event == "start":
+            if not stack:
+                yield "root", elem
+            if elem.tag == TEI + "teiHeader" or (stack and _is_paragraph(elem, stack[-1])):
+                protected += 1
+            stack.append(elem)
+            continue
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if elem.tag == TEI + "teiHeader":
+            protected -= 1
+            yield "header", elem
+        elif parent is not None and _is_paragraph(elem, parent):
+            protected -= 1
+            if protected == 0:
+                yield "paragraph", _paragraph_record(elem)
+                parent.remove(elem)
+        elif parent is not None and protected == 0:
+            parent.remove(elem)
+
+
+def _parse_error(message: str, code: int, position: Tuple[int, int]) -> ET.ParseError:
+    """An ElementTree ParseError, so all the engines raise the same exception for malformed XML."""
+    error = ET.ParseError(message)
+    error.code, error.position = code, position
+    return error
+
+
+def _parse_lxml(stream: BinaryIO) -> Iterator[ParseEvent]:
+    """Parse the stream with lxml's iterparse, see _parse_tree. Comments and processing instructions are dropped,
+    as ElementTree drops them, so they do not split the text of an element."""
+    iterparse = partial(lxml.etree.iterparse, remove_comments=True, remove_pis=True)
+    try:
+        yield from _parse_tree(stream, iterparse=iterparse)
+    except lxml.etree.XMLSyntaxError as e:
+        raise _parse_error(str(e), e.code, e.position) from e
+
+
+# Element names as expat reports them with namespace_separator="}"
+_EXPAT_TEI = URI + "}"
+_EXPAT_HEADER = _EXPAT_TEI + "teiHeader"
+_EXPAT_S = _EXPAT_TEI + "s"
+_EXPAT_PARAGRAPH_PARENTS = {_EXPAT_TEI + "p": _EXPAT_TEI + "div", _EXPAT_TEI + "seg": _EXPAT_TEI + "u"}
+
+
+def _expat_name(name: str) -> str:
+    """The ElementTree name of an element or attribute name reported by expat."""
+    return "{" + name if "}" in name else name
+
+
+def _expat_attrib(attrs: Dict[str, str]) -> Dict[str, str]:
+    return {_expat_name(key): value for key, value in attrs.items()}
+
+
+def _parse_expat(stream: BinaryIO) -> Iterator[ParseEvent]:
+    """Parse the stream with expat, only building elements for the root (without content) and the header.
+    The text, sentences and tokens of the paragraphs are collected directly from the parser callbacks,
+    in the same way as ElementTree would see them: the text of an element is the text before its first child."""
+    parser = xml.parsers.expat.ParserCreate(namespace_separator="}")
+    parser.buffer_text = True
+    events: List[ParseEvent] = []
+    stack: List[str] = []
+    # The header while it is being parsed, and the depth of its element
+    header: Optional[ET.TreeBuilder] = None
+    header_depth = 0
+    # The paragraph being parsed (if pg_depth >= 0): its depth, n, text and sentences
+    pg_depth = -1
+    pg_index: Optional[str] = None
+    pg_text: List[str] = []
+    sentences: List[Tuple] = []
+    # The forms, lemmas and tags of the sentence being parsed, and the attributes and text of the token being parsed
+    forms: Optional[List[Optional[str]]] = None
+    lemmas: List[Optional[str]] = []
+    tags: List[Optional[str]] = []
+    token_attrs: Dict[str, str] = {}
+    token_text: List[str] = []
+    # The list which text is added to, until the element whose text it is gets a child
+    text_parts: Optional[List[str]] = None
+
+    def start(name: str, attrs: Dict[str, str]) -> None:
+        nonlocal header, header_depth, pg_depth, pg_index, pg_text, sentences, forms, lemmas, tags
+        nonlocal token_attrs, token_text, text_parts
+        depth = len(stack)
+        text_parts = None
+        if header is not None:
+            header.start(_expat_name(name), _expat_attrib(attrs))
+        elif pg_depth >= 0:
+            level = depth - pg_depth
+            if level == 1 and name == _EXPAT_S:
+                forms, lemmas, tags = [], [], []
+                sentences.append((attrs.get("n"), forms, lemmas, tags))
+            elif level == 2 and forms is not None:
+                token_attrs, token_text = attrs, []
+                text_parts = token_text
+        elif not stack:
+            events.append(("root", Element(_expat_name(name), _expat_attrib(attrs))))
+        elif name == _EXPAT_HEADER:
+            header, header_depth = ET.TreeBuilder(), depth
+            header.start(_expat_name(name), _expat_attrib(attrs))
+        elif _EXPAT_PARAGRAPH_PARENTS.get(name) == stack[-1]:
+            pg_depth, pg_index, pg_text, sentences = depth, attrs.get("n"), [], []
+            text_parts = pg_text
+        stack.append(name)
+
+    def end(name: str) -> None:
+        nonlocal header, pg_depth, forms, text_parts
+        stack.pop()
+        depth = len(stack)
+        text_parts = None
+        if header is not None:
+            header.end(_expat_name(name))
+            if depth == header_depth:
+                events.append(("header", header.close()))
+                header = None
+        elif pg_depth >= 0:
+            level = depth - pg_depth
+            if level == 0:
+                events.append(("paragraph", RMHParagraph(pg_index, "".join(pg_text) if pg_text else None, sentences)))
+                pg_depth, forms = -1, None
+            elif level == 1:
+                forms = None
+            elif level == 2 and forms is not None:
+                text = "".join(token_text) if token_text else None
+                forms.append(text)
+                lemmas.append(_intern(token_attrs.get("lemma", text)))
+                tags.append(_intern(token_attrs.get("pos", text)))
+
+    def data(text: str) -> None:
+        if header is not None:
+            header.data(text)
+        elif text_parts is not None:
+            text_parts.append(text)
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = data
+    while True:
+        block = stream.read(READ_SIZE)
+        try:
+            parser.Parse(block, not block)
+        except xml.parsers.expat.ExpatError as e:
+            message = f"{xml.parsers.expat.ErrorString(e.code)}: line {e.lineno}, column {e.offset}"
+            raise _parse_error(message, e.code, (e.lineno, e.offset)) from e
+        yield from events
+        events.clear()
+        if not block:
+            break
+
+
+# The parser engines of StreamingRMHFile, by name
+ENGINES: Dict[str, Callable[[BinaryIO], Iterator[ParseEvent]]] = {"expat": _parse_expat, "etree": _parse_tree}
+if lxml is not None:
+    ENGINES["lxml"] = _parse_lxml
+DEFAULT_ENGINE = "expat"
+_engine = DEFAULT_ENGINE
+
+
+def configure(engine: str = DEFAULT_ENGINE) -> None:
+    """Choose the parser engine of streamed files in the current process, e.g. in a worker initializer."""
+    global _engine
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown parser engine {engine}, choose one of {', '.join(ENGINES)}")
+    _engine = engine
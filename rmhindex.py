@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+    Reynir: Natural language processing for Icelandic
+
+     RMH document index
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     A SQLite index of the documents in the output files of an extraction, mapping the id and idno of each
+     document to its output file, byte offset and length, and the archive file it was extracted from,
+     so any document or range of documents can be read with a single seek.
+"""
+
+import mmap
+import os
+import sqlite3
+import sys
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import rmhfile
+
+INDEX_FILE_NAME = "doc_index.sqlite"
+COLUMNS = "output_file position archive member id idno offset length"
+
+# The ids of a document and the size in bytes of its serialized text, as a worker returns them
+DocumentInfo = namedtuple("DocumentInfo", "id idno size")
+# A document in an output file. The output file is relative to the directory of the index
+# and position is the number of documents before it in the output file.
+IndexedDocument = namedtuple("IndexedDocument", COLUMNS)
+
+
+def document_info(rmhf: rmhfile.RMHFile, size: int) -> DocumentInfo:
+    """The ids of a document which has been serialized to size bytes. Does not fail if the document has no id."""
+    return DocumentInfo(rmhf.root.attrib.get(rmhfile.XML_ID), rmhf.idno, size)
+
+
+class DocumentIndex:
+    """Records the documents as they are written to the output files of an extraction, in a SQLite database
+    in the output directory. The documents of an output file must be added in the order they are written."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                output_file TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                archive TEXT NOT NULL,
+                member TEXT NOT NULL,
+                id TEXT,
+                idno TEXT,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL,
+                PRIMARY KEY (output_file, position)
+            );
+            CREATE INDEX IF NOT EXISTS documents_id ON documents (id);
+            CREATE INDEX IF NOT EXISTS documents_idno ON documents (idno);
+            """
+        )
+        # The position and offset of the next document of each output file
+        self._next: Dict[str, Tuple[int, int]] = {}
+
+    def _relative(self, output_file: Path) -> str:
+        return os.path.relpath(output_file, self.path.parent)
+
+    def forget_output_files(self, output_files: Iterable[Path]) -> None:
+        """Remove the documents of output files which are about to be extracted again."""
+        with self.conn:
+            for output_file in output_files:
+                self.conn.execute("DELETE FROM documents WHERE output_file = ?", (self._relative(output_file),))
+
+    def add(self, output_file: Path, archive: Path, member: Path, info: DocumentInfo) -> None:
+        """Record the next document written to output_file."""
+        relative = self._relative(output_file)
+        position, offset = self._next.get(relative, (0, 0))
+        self.conn.execute(
+            "INSERT INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (relative, position, str(archive), str(member), info.id, info.idno, offset, info.size),
+        )
+        self._next[relative] = (position + 1, offset + info.size)
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+
+class DocumentReader:
+    """Looks up documents in an index written by DocumentIndex and reads them from the output files."""
+
+    def __init__(self, path: Path):
+        self.root = path.parent
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def _select(self, where: str, params: Tuple) -> List[IndexedDocument]:
+        rows = self.conn.execute(
+            f"SELECT {', '.join(COLUMNS.split())} FROM documents WHERE {where} ORDER BY output_file, position", params
+        )
+        return [IndexedDocument(*row) for row in rows]
+
+    def find(self, doc_id: str) -> List[IndexedDocument]:
+        """Return the documents whose id or idno is doc_id."""
+        return self._select("id = ? OR idno = ?", (doc_id, doc_id))
+
+    def output_files(self) -> List[str]:
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT output_file FROM documents ORDER BY output_file")]
+
+    def documents(self, output_file: str, start: int = 0, stop: Optional[int] = None) -> List[IndexedDocument]:
+        """Return the documents of an output file from position start up to (not including) stop."""
+        return self._select(
+            "output_file = ? AND position >= ? AND position < ?",
+            (output_file, start, stop if stop is not None else sys.maxsize),
+        )
+
+    def read(self, documents: List[IndexedDocument]) -> bytes:
+        """Read consecutive documents of an output file, e.g. a single one, with a single seek."""
+        if not documents:
+            return b""
+        first, last = documents[0], documents[-1]
+        with open(self.root / first.output_file, "rb") as f:
+            f.seek(first.offset)
+            return f.read(last.offset + last.length - first.offset)
+
+    def iter_texts(self, output_file: str) -> Iterator[Tuple[IndexedDocument, str]]:
+        """Yield every document of an output file along with its text, which is sliced from a memory map
+        of the file, e.g. for bulk access."""
+        with open(self.root / output_file, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for document in self.documents(output_file):
+                    yield document, mapped[document.offset : document.offset + document.length].decode("utf-8")
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("Read documents from extracted RMH output files by their id")
+    parser.add_argument(
+        "-x",
+        "--index",
+        type=Path,
+        required=True,
+        help=f"Path to the document index, {INDEX_FILE_NAME} in the output directory of extract_rmh.py --doc_index",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    get_parser = subparsers.add_parser("get", help="Print the documents with these ids or idnos")
+    get_parser.add_argument("ids", nargs="+", help="The ids (or idnos) of the documents")
+    get_parser.add_argument(
+        "--locate", action="store_true", default=False, help="Print where the documents are instead of their text"
+    )
+    range_parser = subparsers.add_parser("range", help="Print consecutive documents of an output file")
+    range_parser.add_argument("output_file", help="The output file, relative to the directory of the index")
+    range_parser.add_argument("start", type=int, help="The position of the first document in the output file")
+    range_parser.add_argument("stop", type=int, help="The position after the last document")
+    subparsers.add_parser("files", help="Print the indexed output files")
+
+    args = parser.parse_args()
+    reader = DocumentReader(args.index)
+    out = sys.stdout.buffer
+    try:
+        if args.command == "get":
+            for doc_id in args.ids:
+                found = reader.find(doc_id)
+                if not found:
+                    print(f"Document not found: {doc_id}", file=sys.stderr)
+                for document in found:
+                    if args.locate:
+                        out.write(("\t".join(str(x) for x in document) + "\n").encode("utf-8"))
+                    else:
+                        out.write(reader.read([document]))
+        elif args.command == "range":
+            out.write(reader.read(reader.documents(args.output_file, args.start, args.stop)))
+        else:
+            for output_file in reader.output_files():
+                print(output_file)
+    finally:
+        reader.close()
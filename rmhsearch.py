@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+    Reynir: Natural language processing for Icelandic
+
+     RMH concordance search
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     An inverted index of the forms, lemmas and tags of an annotated RMH zip file, which maps each of them to
+     the sentences it occurs in, and a search of the index which prints keyword-in-context lines.
+
+     The index is built in a single parallel pass with bounded memory: the posting lists are written to sorted
+     segment files when they grow too large, and the segments are merged at the end. A posting list is the
+     delta-encoded numbers of the sentences (in the order of the archive) as varints. The sentences themselves,
+     with their ids (idno.paragraph.sentence), are stored as json lines along with their offsets, so the
+     sentences of a hit can be read with a single seek.
+"""
+
+import fnmatch
+import heapq
+import json
+import logging
+import mmap
+import sqlite3
+import sys
+import tempfile
+import zipfile
+from array import array
+from itertools import groupby
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from tqdm import tqdm
+
+import extract_rmh
+import rmhfile
+
+log = logging.getLogger(__name__)
+
+TERMS_FILE_NAME = "terms.sqlite"
+POSTINGS_FILE_NAME = "postings.bin"
+SENTENCES_FILE_NAME = "sentences.jsonl"
+OFFSETS_FILE_NAME = "sentences.offsets"
+# The kinds of terms, and the field of a sentence (id, forms, lemmas, tags) they are taken from
+KINDS = {"form": 1, "lemma": 2, "tag": 3}
+DEFAULT_MAX_POSTINGS = 20_000_000
+DEFAULT_MAX_SEGMENT_BYTES = 1 << 30
+# An estimate of the memory of a term in a segment besides its key and postings: the array and the dict entry
+TERM_OVERHEAD = sys.getsizeof(array("I")) + 32
+POSTING_BYTES = array("I").itemsize
+DEFAULT_WIDTH = 60
+
+# The sentences of a chunk of files as json lines, and the numbers of the sentences within the chunk
+# in which each term ("kind:term") occurs
+ChunkIndex = Tuple[List[str], Dict[str, List[int]]]
+
+
+def encode_postings(numbers: Iterable[int], previous: int = 0) -> bytes:
+    """Encode increasing sentence numbers as the varints of their differences, starting from previous."""
+    out = bytearray()
+    for number in numbers:
+        delta = number - previous
+        previous = number
+        while delta >= 0x80:
+            out.append(delta & 0x7F | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_postings(data: bytes, previous: int = 0) -> Iterator[int]:
+    """Yield the sentence numbers of a posting list encoded by encode_postings, as they are decoded."""
+    delta = 0
+    shift = 0
+    for byte in data:
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += delta
+        yield previous
+        delta = 0
+        shift = 0
+
+
+def _split_first(data: bytes) -> Tuple[int, bytes]:
+    """Split a posting list into its first (absolute) number and the encoded rest."""
+    end = 0
+    while data[end] & 0x80:
+        end += 1
+    return next(decode_postings(data[: end + 1])), data[end + 1 :]
+
+
+def index_sentences(rmhf: rmhfile.RMHFile) -> List[Tuple[str, List, List, List]]:
+    """The id, forms, lemmas and tags of each sentence of a single annotated RMHFile"""
+    return [(s.index, s.forms, s.lemmas, s.tags) for s in rmhf.compact_sentences()]
+
+
+def index_members(archive_files: List[Path]) -> Tuple[ChunkIndex, int, int]:
+    """Index the sentences of a chunk of files from the archive. Runs in a worker process.
+    Returns the sentences and postings of the chunk, the number of files and the number of skipped files."""
+    lines: List[str] = []
+    postings: Dict[str, List[int]] = {}
+    skipped = 0
+    for archive_file, result in zip(archive_files, extract_rmh.extract_members(archive_files)):
+        if isinstance(result, extract_rmh.SkippedFile):
+            log.warning(f"Skipping problematic file: {archive_file} ({result.reason})")
+            skipped += 1
+            continue
+        for sentence in result:
+            number = len(lines)
+            lines.append(json.dumps(sentence, ensure_ascii=False) + "\n")
+            for kind, field in KINDS.items():
+                for term in set(sentence[field]):
+                    if term is not None:
+                        postings.setdefault(f"{kind}:{term}", []).append(number)
+    return (lines, postings), len(archive_files), skipped
+
+
+def _segment_lines(f: Iterable[str], segment: int) -> Iterator[Tuple[str, int, str]]:
+    """The lines of a segment file with their (json encoded) term and the number of the segment, for merging."""
+    for line in f:
+        yield line.split("\t", 1)[0], segment, line
+
+
+class SegmentedPostings:
+    """Posting lists which are written to sorted segment files on disk when they grow beyond max_postings,
+    or when their estimated memory (the terms, their arrays and the postings) grows beyond max_bytes,
+    and merged when they are read back, so the memory used is bounded. The sentence numbers must be added
+    in increasing order."""
+
+    def __init__(self, segment_dir: Path, max_postings: int, max_bytes: int = DEFAULT_MAX_SEGMENT_BYTES):
+        self.segment_dir = segment_dir
+        self.max_postings = max_postings
+        self.max_bytes = max_bytes
+        self.postings: Dict[str, array] = {}
+        self.size = 0
+        # The estimated memory of the terms in memory, without their postings
+        self.term_bytes = 0
+        self.segment_files: List[Path] = []
+
+    def add(self, postings: Dict[str, List[int]], base: int) -> None:
+        """Add the postings of a chunk whose sentence numbers start at base."""
+        for term, numbers in postings.items():
+            if term not in self.postings:
+                self.postings[term] = array("I")
+                self.term_bytes += sys.getsizeof(term) + TERM_OVERHEAD
+            self.postings[term].extend(base + x for x in numbers)
+            self.size += len(numbers)
+        if self.size > self.max_postings or self.memory() > self.max_bytes:
+            self.flush()
+
+    def memory(self) -> int:
+        """The estimated memory used by the postings in memory, in bytes."""
+        return self.term_bytes + self.size * POSTING_BYTES
+
+    def flush(self) -> None:
+        """Write the postings in memory to a new segment file, sorted on the (json encoded) term. Each line holds
+        the term, the number of its postings, its last sentence number and the encoded postings (as hex)."""
+        path = self.segment_dir / f"postings.{len(self.segment_files)}.tsv"
+        with open(path, "w", encoding="utf-8") as f:
+            for encoded, term in sorted((json.dumps(term, ensure_ascii=False), term) for term in self.postings):
+                numbers = self.postings[term]
+                f.write(f"{encoded}\t{len(numbers)}\t{numbers[-1]}\t")
+                f.write(encode_postings(numbers).hex() + "\n")
+        self.segment_files.append(path)
+        self.postings.clear()
+        self.size = 0
+        self.term_bytes = 0
+
+    def items(self) -> Iterator[Tuple[str, int, bytes]]:
+        """Yield each term with the number of its postings and its merged, encoded posting list,
+        sorted on the (json encoded) term."""
+        if self.postings or not self.segment_files:
+            self.flush()
+        files = [open(path, "r", encoding="utf-8") for path in self.segment_files]
+        try:
+            # The segments are merged in the order they were written, so the sentence numbers stay increasing
+            lines = heapq.merge(*(_segment_lines(f, i) for i, f in enumerate(files)))
+            for encoded, group in groupby(lines, key=lambda x: x[0]):
+                count = 0
+                previous = 0
+                parts = []
+                for _, _, line in group:
+                    _, part_count, last, data = line.rstrip("\n").split("\t")
+                    first, rest = _split_first(bytes.fromhex(data))
+                    parts.append(encode_postings([first], previous) + rest)
+                    count += int(part_count)
+                    previous = int(last)
+                yield json.loads(encoded), count, b"".join(parts)
+        finally:
+            for f in files:
+                f.close()
+
+
+def build_index(
+    zip_file_path: Path,
+    index_dir: Path,
+    accepted_suffixes: List[str],
+    processes: int,
+    chunksize: int,
+    max_postings: int = DEFAULT_MAX_POSTINGS,
+    max_segment_bytes: int = DEFAULT_MAX_SEGMENT_BYTES,
+) -> None:
+    """Index the sentences of all the annotated files in a zip file, in index_dir."""
+    with zipfile.ZipFile(str(zip_file_path)) as archive:
+        archive_files = [Path(x) for x in archive.namelist() if Path(x).suffixes == accepted_suffixes]
+    chunks = [archive_files[i : i + chunksize] for i in range(0, len(archive_files), chunksize)]
+    index_dir.mkdir(parents=True, exist_ok=True)
+    skipped = 0
+    offsets = array("Q", [0])
+    with tempfile.TemporaryDirectory(dir=str(index_dir)) as segment_dir:
+        postings = SegmentedPostings(Path(segment_dir), max_postings, max_segment_bytes)
+        p_bar = tqdm(desc=f"Indexing {zip_file_path}", total=len(archive_files), unit="files")
+        with open(index_dir / SENTENCES_FILE_NAME, "wb") as sentences, Pool(
+            processes=processes,
+            initializer=extract_rmh._init_worker,
+            initargs=(extract_rmh.WorkerOptions(zip_file_path, index_sentences, skip_errors=True),),
+        ) as pool:
+            # The chunks are handled in order, so the sentences are numbered in the order of the archive
+            for (lines, chunk_postings), chunk_files, chunk_skipped in pool.imap(index_members, chunks):
+                postings.add(chunk_postings, len(offsets) - 1)
+                for line in lines:
+                    data = line.encode("utf-8")
+                    sentences.write(data)
+                    offsets.append(offsets[-1] + len(data))
+                skipped += chunk_skipped
+                p_bar.update(chunk_files)
+        p_bar.close()
+        with open(index_dir / OFFSETS_FILE_NAME, "wb") as f:
+            offsets.tofile(f)
+        terms_path = index_dir / TERMS_FILE_NAME
+        if terms_path.exists():
+            terms_path.unlink()
+        conn = sqlite3.connect(str(terms_path))
+        conn.execute(
+            "CREATE TABLE terms (kind TEXT NOT NULL, term TEXT NOT NULL, count INTEGER NOT NULL, "
+            "offset INTEGER NOT NULL, length INTEGER NOT NULL, PRIMARY KEY (kind, term))"
+        )
+        conn.execute("CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT)")
+        terms = 0
+        with open(index_dir / POSTINGS_FILE_NAME, "wb") as f:
+            rows = []
+            for key, count, data in postings.items():
+                kind, _, term = key.partition(":")
+                rows.append((kind, term, count, f.tell(), len(data)))
+                f.write(data)
+                if len(rows) >= 10_000:
+                    conn.executemany("INSERT INTO terms VALUES (?, ?, ?, ?, ?)", rows)
+                    terms += len(rows)
+                    rows = []
+            conn.executemany("INSERT INTO terms VALUES (?, ?, ?, ?, ?)", rows)
+            terms += len(rows)
+        conn.executemany(
+            "INSERT INTO info VALUES (?, ?)",
+            [("archive", str(zip_file_path)), ("sentences", str(len(offsets) - 1))],
+        )
+        conn.commit()
+        conn.close()
+    log.info(f"Indexed {len(offsets) - 1} sentences with {terms} distinct terms in {index_dir}")
+    if skipped:
+        log.warning(f"Skipped {skipped} of {len(archive_files)} files which could not be parsed")
+
+
+def parse_query(query: List[str]) -> List[Tuple[str, str]]:
+    """Parse query terms of the form kind:pattern, e.g. lemma:hestur or tag:n*, where the pattern may use the
+    glob wildcards * and ? and character classes [...]."""
+    terms = []
+    for x in query:
+        kind, sep, pattern = x.partition(":")
+        if not sep or kind not in KINDS or not pattern:
+            raise ValueError(f"Expected kind:pattern with a kind of {', '.join(KINDS)}, e.g. lemma:hestur, got {x}")
+        terms.append((kind, pattern))
+    return terms
+
+
+def _union(streams: List[Iterator[int]]) -> Iterator[int]:
+    """Merge increasing streams of sentence numbers, without duplicates."""
+    previous = None
+    for number in heapq.merge(*streams):
+        if number != previous:
+            yield number
+            previous = number
+
+
+def _intersection(streams: List[Iterator[int]]) -> Iterator[int]:
+    """Yield the sentence numbers which are in all the increasing streams."""
+    current = [next(x, None) for x in streams]
+    while None not in current:
+        target = max(current)  # type: ignore
+        if all(x == target for x in current):
+            yield target
+            current = [next(x, None) for x in streams]
+            continue
+        for i, stream in enumerate(streams):
+            while current[i] is not None and current[i] < target:  # type: ignore
+                current[i] = next(stream, None)
+
+
+class ConcordanceIndex:
+    """Searches an index written by build_index for sentences whose tokens match a query."""
+
+    def __init__(self, index_dir: Path):
+        self.conn = sqlite3.connect(f"file:{index_dir / TERMS_FILE_NAME}?mode=ro", uri=True)
+        self._postings = open(index_dir / POSTINGS_FILE_NAME, "rb")
+        self._sentences = open(index_dir / SENTENCES_FILE_NAME, "rb")
+        with open(index_dir / OFFSETS_FILE_NAME, "rb") as f:
+            self._offsets_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = memoryview(self._offsets_map).cast("Q")
+
+    def __len__(self) -> int:
+        """The number of indexed sentences"""
+        return len(self.offsets) - 1
+
+    def terms(self, kind: str, pattern: str) -> List[Tuple[str, int]]:
+        """Return the terms of a kind which match the glob pattern, with the number of sentences they occur in."""
+        return list(
+            self.conn.execute(
+                "SELECT term, count FROM terms WHERE kind = ? AND term GLOB ? ORDER BY term", (kind, pattern)
+            )
+        )
+
+    def _postings_of(self, kind: str, pattern: str) -> Iterator[int]:
+        streams = []
+        for offset, length in self.conn.execute(
+            "SELECT offset, length FROM terms WHERE kind = ? AND term GLOB ?", (kind, pattern)
+        ):
+            self._postings.seek(offset)
+            streams.append(decode_postings(self._postings.read(length)))
+        return _union(streams)
+
+    def sentence(self, number: int) -> Tuple[str, List, List, List]:
+        """Return the id, forms, lemmas and tags of a sentence."""
+        start, end = self.offsets[number], self.offsets[number + 1]
+        self._sentences.seek(start)
+        return tuple(json.loads(self._sentences.read(end - start)))  # type: ignore
+
+    def search(self, query: List[Tuple[str, str]]) -> Iterator[Tuple[str, List[str], int]]:
+        """Yield the id and forms of each sentence with a token which matches all the (kind, pattern) terms of
+        the query, along with the position of the token, once for each such token, in the order of the archive.
+        The candidate sentences are found by intersecting the posting lists of the terms, and are read lazily."""
+        for number in _intersection([self._postings_of(kind, pattern) for kind, pattern in query]):
+            sentence = self.sentence(number)
+            for position in range(len(sentence[1])):
+                if all(
+                    sentence[KINDS[kind]][position] is not None
+                    and fnmatch.fnmatchcase(sentence[KINDS[kind]][position], pattern)
+                    for kind, pattern in query
+                ):
+                    yield sentence[0], sentence[1], position
+
+    def close(self) -> None:
+        self.offsets.release()
+        self._offsets_map.close()
+        self._postings.close()
+        self._sentences.close()
+        self.conn.close()
+
+
+def kwic_line(sentence_id: str, forms: List[str], position: int, width: int = DEFAULT_WIDTH) -> str:
+    """Format a hit as a keyword-in-context line: the sentence id, the left context (right-aligned),
+    the keyword and the right context, separated by tabs. The contexts are cut to width characters."""
+    left = " ".join(x or "" for x in forms[:position])[-width:]
+    right = " ".join(x or "" for x in forms[position + 1 :])[:width]
+    return f"{sentence_id}\t{left:>{width}}\t{forms[position]}\t{right}"
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from itertools import islice
+
+    parser = argparse.ArgumentParser("Build and search a concordance index of an annotated RMH zip file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Index the forms, lemmas and tags of an annotated zip file")
+    build_parser.add_argument("-i", "--in_path", type=Path, required=True, help="Path to RMH zip file")
+    build_parser.add_argument("-o", "--index_dir", type=Path, required=True, help="The directory of the index")
+    build_parser.add_argument(
+        "--suffixes",
+        nargs="+",
+        default=[".ana", ".xml"],
+        help="The suffixes of the files to index. Defaults to .ana .xml, i.e. files ending with .ana.xml",
+    )
+    build_parser.add_argument("--processes", type=int, default=20, help="The number of worker processes.")
+    build_parser.add_argument(
+        "--chunksize", type=int, default=50, help="The number of XML files to send to each process."
+    )
+    build_parser.add_argument(
+        "--max_postings",
+        type=int,
+        default=DEFAULT_MAX_POSTINGS,
+        help="The number of postings kept in memory before they are written to a segment file on disk.",
+    )
+    build_parser.add_argument(
+        "--max_segment_bytes",
+        type=int,
+        default=DEFAULT_MAX_SEGMENT_BYTES,
+        help="The estimated memory (in bytes) of the terms and postings kept in memory before they are written "
+        "to a segment file on disk. Defaults to 1 GiB.",
+    )
+    query_parser = subparsers.add_parser(
+        "query",
+        help="Print keyword-in-context lines of the tokens which match all the terms, e.g. lemma:hestur tag:n*",
+    )
+    query_parser.add_argument("-x", "--index_dir", type=Path, required=True, help="The directory of the index")
+    query_parser.add_argument(
+        "terms", nargs="+", help="Terms of the form kind:pattern, where kind is form, lemma or tag"
+    )
+    query_parser.add_argument("--limit", type=int, default=100, help="Print at most this many lines")
+    query_parser.add_argument(
+        "--width", type=int, default=DEFAULT_WIDTH, help="The number of characters of context on each side"
+    )
+    terms_parser = subparsers.add_parser(
+        "terms", help="Print the terms which match a pattern, with the number of sentences they occur in"
+    )
+    terms_parser.add_argument("-x", "--index_dir", type=Path, required=True, help="The directory of the index")
+    terms_parser.add_argument("term", help="A term of the form kind:pattern, e.g. lemma:hest*")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "build":
+        build_index(
+            args.in_path,
+            args.index_dir,
+            args.suffixes,
+            args.processes,
+            args.chunksize,
+            args.max_postings,
+            args.max_segment_bytes,
+        )
+    else:
+        try:
+            query = parse_query(args.terms if args.command == "query" else [args.term])
+        except ValueError as e:
+            parser.error(str(e))
+        index = ConcordanceIndex(args.index_dir)
+        try:
+            if args.command == "query":
+                start = time.perf_counter()
+                hits = 0
+                for sentence_id, forms, position in islice(index.search(query), args.limit):
+                    print(kwic_line(sentence_id, forms, position, args.width))
+                    hits += 1
+                log.info(f"{hits} hits in {(time.perf_counter() - start) * 1000:.1f} ms")
+            else:
+                for term, count in index.terms(*query[0]):
+                    print(f"{term}\t{count}")
+        finally:
+            index.close()
@@ -0,0 +1,238 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     RMH token shards
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Compact, columnar storage for the tokens of the annotated (.ana.xml) RMH.
+     Forms, lemmas and tags are stored as integer ids into interned vocabularies,
+     and a shard can be written to and reloaded from a binary file.
+"""
+
+import json
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import rmhfile
+import rmhwriter
+
+SHARD_MAGIC = b"RMHSHARD"
+SHARD_VERSION = 2
+SHARD_FILE_SUFFIX = ".rmhshard"
+
+
+class Vocabulary:
+    """Interns strings (or None) as consecutive integer ids."""
+
+    def __init__(self, strings: Optional[List[Optional[str]]] = None):
+        self.strings: List[Optional[str]] = strings if strings is not None else []
+        self.ids: Dict[Optional[str], int] = {s: i for i, s in enumerate(self.strings)}
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def add(self, string: Optional[str]) -> int:
+        """Return the id of the string, adding it if needed."""
+        idx = self.ids.get(string)
+        if idx is None:
+            idx = len(self.strings)
+            self.ids[string] = idx
+            self.strings.append(string)
+        return idx
+
+    def remap(self, other: "Vocabulary") -> List[int]:
+        """Add the strings of another vocabulary and return the mapping from its ids to ours."""
+        return [self.add(s) for s in other.strings]
+
+
+class TokenShard:
+    """The tokens of a collection of documents, stored in columns.
+
+    Token i has the form forms.strings[form_ids[i]], and likewise for lemmas and tags.
+    Sentence j consists of the tokens sentence_offsets[j] to sentence_offsets[j + 1] and its id is
+    built from documents[sentence_documents[j]] and the paragraph and sentence numbers
+    numbers.strings[sentence_paragraphs[j]] and numbers.strings[sentence_numbers[j]]. The numbers are
+    kept as they are written in the file (None if missing), so the ids are those of RMHFile.sentences()."""
+
+    def __init__(self):
+        self.forms = Vocabulary()
+        self.lemmas = Vocabulary()
+        self.tags = Vocabulary()
+        self.numbers = Vocabulary()
+        self.documents: List[str] = []
+        self.form_ids = array("I")
+        self.lemma_ids = array("I")
+        self.tag_ids = array("I")
+        self.sentence_offsets = array("Q", [0])
+        self.sentence_documents = array("I")
+        self.sentence_paragraphs = array("I")
+        self.sentence_numbers = array("I")
+
+    @property
+    def n_tokens(self) -> int:
+        return len(self.form_ids)
+
+    @property
+    def n_sentences(self) -> int:
+        return len(self.sentence_documents)
+
+    def add_document(self, rmhf: rmhfile.RMHFile) -> None:
+        """Add all the sentences of an annotated file."""
+        doc_idx = len(self.documents)
+        self.documents.append(str(rmhf.idno))
+        for pg in rmhf.paragraph_records():
+            pg_idx = self.numbers.add(pg.index)
+            for sent_idx, forms, lemmas, tags in pg.sentences:
+                self.form_ids.extend(map(self.forms.add, forms))
+                self.lemma_ids.extend(map(self.lemmas.add, lemmas))
+                self.tag_ids.extend(map(self.tags.add, tags))
+                self.sentence_offsets.append(len(self.form_ids))
+                self.sentence_documents.append(doc_idx)
+                self.sentence_paragraphs.append(pg_idx)
+                self.sentence_numbers.append(self.numbers.add(sent_idx))
+
+    def extend(self, other: "TokenShard") -> None:
+        """Append the contents of another shard, remapping its ids into our vocabularies."""
+        for ids, vocab, other_ids, other_vocab in (
+            (self.form_ids, self.forms, other.form_ids, other.forms),
+            (self.lemma_ids, self.lemmas, other.lemma_ids, other.lemmas),
+            (self.tag_ids, self.tags, other.tag_ids, other.tags),
+        ):
+            ids.extend(map(vocab.remap(other_vocab).__getitem__, other_ids))
+        offset = self.sentence_offsets[-1]
+        self.sentence_offsets.extend(x + offset for x in other.sentence_offsets[1:])
+        doc_offset = len(self.documents)
+        self.documents.extend(other.documents)
+        self.sentence_documents.extend(x + doc_offset for x in other.sentence_documents)
+        numbers = self.numbers.remap(other.numbers)
+        self.sentence_paragraphs.extend(map(numbers.__getitem__, other.sentence_paragraphs))
+        self.sentence_numbers.extend(map(numbers.__getitem__, other.sentence_numbers))
+
+    def sentence_id(self, idx: int) -> str:
+        """The id of a sentence, in the same idno.paragraph.sentence format as RMHFile.sentences()."""
+        doc = self.documents[self.sentence_documents[idx]]
+        paragraph = self.numbers.strings[self.sentence_paragraphs[idx]]
+        return f"{doc}.{paragraph}.{self.numbers.strings[self.sentence_numbers[idx]]}"
+
+    def sentence_columns(self, idx: int) -> Tuple[List[str], List[str], List[str]]:
+        """The forms, lemmas and tags of a sentence."""
+        start, end = self.sentence_offsets[idx], self.sentence_offsets[idx + 1]
+        return (
+            [self.forms.strings[x] for x in self.form_ids[start:end]],
+            [self.lemmas.strings[x] for x in self.lemma_ids[start:end]],
+            [self.tags.strings[x] for x in self.tag_ids[start:end]],
+        )
+
+    def sentences(self) -> Iterator[rmhfile.RMHSentence]:
+        """Return all the sentences, in the same format as RMHFile.sentences()."""
+        for idx in range(self.n_sentences):
+            forms, lemmas, tags = self.sentence_columns(idx)
+            tokens = [rmhfile.RMHToken(*token, token[0]) for token in zip(forms, lemmas, tags)]
+            yield rmhfile.RMHSentence(self.sentence_id(idx), tokens)
+
+    def _columns(self) -> List[array]:
+        return [
+            self.form_ids,
+            self.lemma_ids,
+            self.tag_ids,
+            self.sentence_offsets,
+            self.sentence_documents,
+            self.sentence_paragraphs,
+            self.sentence_numbers,
+        ]
+
+    def save(self, path: Path) -> None:
+        """Write the shard to a binary file: a json header with the vocabularies, followed by the raw columns."""
+        header = json.dumps(
+            {
+                "byteorder": sys.byteorder,
+                "n_tokens": self.n_tokens,
+                "n_sentences": self.n_sentences,
+                "forms": self.forms.strings,
+                "lemmas": self.lemmas.strings,
+                "tags": self.tags.strings,
+                "numbers": self.numbers.strings,
+                "documents": self.documents,
+                "columns": [(column.typecode, column.itemsize) for column in self._columns()],
+            },
+            ensure_ascii=False,
+        ).encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(SHARD_MAGIC + struct.pack("<IQ", SHARD_VERSION, len(header)))
+            f.write(header)
+            for column in self._columns():
+                column.tofile(f)
+
+    @classmethod
+    def load(cls, path: Path) -> "TokenShard":
+        """Read a shard written by save()."""
+        shard = cls()
+        with open(path, "rb") as f:
+            prefix = f.read(len(SHARD_MAGIC) + 12)
+            if prefix[: len(SHARD_MAGIC)] != SHARD_MAGIC:
+                raise ValueError(f"Not a token shard: {path}")
+            version, header_length = struct.unpack("<IQ", prefix[len(SHARD_MAGIC) :])
+            if version != SHARD_VERSION:
+                raise ValueError(f"Unsupported token shard version {version}: {path}")
+            header = json.loads(f.read(header_length).decode("utf-8"))
+            shard.forms = Vocabulary(header["forms"])
+            shard.lemmas = Vocabulary(header["lemmas"])
+            shard.tags = Vocabulary(header["tags"])
+            shard.numbers = Vocabulary(header["numbers"])
+            shard.documents = header["documents"]
+            lengths = [header["n_tokens"]] * 3 + [header["n_sentences"] + 1] + [header["n_sentences"]] * 3
+            for column, (typecode, itemsize), length in zip(shard._columns(), header["columns"], lengths):
+                if column.typecode != typecode or column.itemsize != itemsize:
+                    raise ValueError(f"Incompatible column type in token shard: {path}")
+                del column[:]
+                column.fromfile(f, length)
+                if header["byteorder"] != sys.byteorder:
+                    column.byteswap()
+        return shard
+
+
+class TokenShardWriter:
+    """Collects the token shards of the documents of an output file and writes them as a single shard on close.
+    Has the same interface as the text output files of extract_rmh."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.shard = TokenShard()
+
+    def writelines(self, shards: Iterable[TokenShard]) -> None:
+        for shard in shards:
+            self.shard.extend(shard)
+
+    def close(self) -> None:
+        """Write the shard under a temporary name and then move it to its final name."""
+        partial_path = self.path.with_name(self.path.name + rmhwriter.PARTIAL_FILE_SUFFIX)
+        self.shard.save(partial_path)
+        os.replace(partial_path, self.path)
+
+    def abort(self) -> None:
+        """Discard the shard, e.g. when the extraction fails."""
+        self.shard = TokenShard()
+
+
+def extract_rmh_to_shard(rmhf: rmhfile.RMHFile) -> TokenShard:
+    """Extract the tokens of a single annotated RMHFile to a token shard"""
+    shard = TokenShard()
+    shard.add_document(rmhf)
+    return shard
@@ -0,0 +1,183 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     RMH sentence splitting
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Batched and memoized sentence splitting of paragraphs, shared by the serializers of extract_rmh.
+"""
+
+import hashlib
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from tokenizer import split_into_sentences
+
+import rmhstats
+
+DEFAULT_CACHE_SIZE = 50_000
+# Batching is off by default: with tokenizer 3.x the cost of a call is dominated by the text itself,
+# so splitting in batches was measured to be no faster than splitting each paragraph on its own.
+DEFAULT_BATCH_CHARS = 0
+
+# Paragraphs are joined with this separator when they are split in a batch. The double newlines force a sentence
+# break and the marker becomes a sentence of its own, which tells us where each paragraph ends.
+PARAGRAPH_MARKER = "RMHPARAGRAPHBREAK"
+PARAGRAPH_SEPARATOR = "\n\n" + PARAGRAPH_MARKER + "\n\n"
+
+
+def split_paragraph(paragraph: str) -> List[str]:
+    """Split a single paragraph into sentences, keeping the original whitespace."""
+    return list(split_into_sentences(paragraph, original=True))
+
+
+def _can_batch(paragraph: str) -> bool:
+    """Paragraphs which start with whitespace only, or which could be confused with the separator,
+    are split on their own."""
+    return bool(paragraph.strip()) and not paragraph.startswith("\n") and PARAGRAPH_MARKER not in paragraph
+
+
+def split_batch(paragraphs: List[str]) -> List[List[str]]:
+    """Split several paragraphs with a single tokenizer call, giving the same result as calling
+    split_paragraph() on each of them. The sentences of each paragraph are checked to join up to its text
+    (without the trailing whitespace, which the tokenizer drops); if they do not, e.g. if the paragraph
+    boundaries can not be recovered, the paragraphs are split one by one."""
+    if len(paragraphs) == 1:
+        return [split_paragraph(paragraphs[0])]
+    result: List[List[str]] = [[]]
+    after_marker = False
+    for sentence in split_into_sentences(PARAGRAPH_SEPARATOR.join(paragraphs), original=True):
+        if sentence.strip() == PARAGRAPH_MARKER:
+            result.append([])
+            after_marker = True
+            continue
+        if after_marker:
+            # The whitespace of the separator is attached to the first sentence of the next paragraph
+            if sentence.startswith("\n\n"):
+                sentence = sentence[2:]
+            after_marker = False
+        result[-1].append(sentence)
+    if len(result) != len(paragraphs) or any(
+        "".join(sentences) != paragraph.rstrip() for sentences, paragraph in zip(result, paragraphs)
+    ):
+        return [split_paragraph(paragraph) for paragraph in paragraphs]
+    return result
+
+
+class SentenceSplitter:
+    """Splits paragraphs into sentences with tokenizer.split_into_sentences(original=True).
+
+    Short paragraphs can be split in batches of up to batch_chars characters, to reduce the overhead of each
+    tokenizer call (0 splits each paragraph on its own). The sentences of the most recent cache_size distinct
+    paragraphs are kept in an LRU cache keyed on a hash of the paragraph, so repeated paragraphs (bylines,
+    disclaimers, signatures, ...) are only split once."""
+
+    def __init__(self, cache_size: int = DEFAULT_CACHE_SIZE, batch_chars: int = DEFAULT_BATCH_CHARS):
+        self.cache_size = cache_size
+        self.batch_chars = batch_chars
+        self.cache: "OrderedDict[bytes, List[str]]" = OrderedDict()
+        self.stats: Counter = Counter()
+
+    def _lookup(self, key: bytes):
+        sentences = self.cache.get(key)
+        if sentences is not None:
+            self.cache.move_to_end(key)
+            self.stats["split_cache_hits"] += 1
+        else:
+            self.stats["split_cache_misses"] += 1
+        return sentences
+
+    def _store(self, key: bytes, sentences: List[str]) -> None:
+        if self.cache_size <= 0:
+            return
+        self.cache[key] = sentences
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _split_pending(self, pending: List[Tuple[bytes, str]]) -> List[List[str]]:
+        """Split the paragraphs which were not found in the cache, in as few tokenizer calls as possible."""
+        results: List[List[str]] = []
+        batch: List[str] = []
+        batch_chars = 0
+
+        def flush():
+            nonlocal batch, batch_chars
+            if batch:
+                results.extend(split_batch(batch))
+                self.stats["split_tokenizer_calls"] += 1
+                batch, batch_chars = [], 0
+
+        for _, paragraph in pending:
+            if not _can_batch(paragraph):
+                flush()
+                results.append(split_paragraph(paragraph))
+                self.stats["split_tokenizer_calls"] += 1
+                continue
+            if batch and batch_chars + len(paragraph) > self.batch_chars:
+                flush()
+            batch.append(paragraph)
+            batch_chars += len(paragraph)
+        flush()
+        for (key, _), sentences in zip(pending, results):
+            self._store(key, sentences)
+        return results
+
+    def split(self, paragraphs: Iterable[str]) -> Iterator[List[str]]:
+        """Yield the sentences of each paragraph, in order. The paragraphs are consumed lazily,
+        about batch_chars characters at a time."""
+        window: List[Tuple[bytes, str]] = []
+        window_chars = 0
+        for paragraph in paragraphs:
+            window.append((hashlib.blake2b(paragraph.encode("utf-8"), digest_size=16).digest(), paragraph))
+            window_chars += len(paragraph)
+            if window_chars >= self.batch_chars:
+                yield from self._split_window(window)
+                window, window_chars = [], 0
+        yield from self._split_window(window)
+
+    def _split_window(self, window: List[Tuple[bytes, str]]) -> List[List[str]]:
+        self.stats["split_paragraphs"] += len(window)
+        with rmhstats.stage("split"):
+            found = [self._lookup(key) for key, _ in window]
+            pending = [item for item, sentences in zip(window, found) if sentences is None]
+            split = iter(self._split_pending(pending))
+            return [sentences if sentences is not None else next(split) for sentences in found]
+
+    def take_stats(self) -> Dict[str, int]:
+        """Return the counters since the last call and reset them."""
+        stats = dict(self.stats)
+        self.stats.clear()
+        return stats
+
+
+# The splitter of the current process, see configure()
+_splitter = SentenceSplitter()
+
+
+def configure(cache_size: int = DEFAULT_CACHE_SIZE, batch_chars: int = DEFAULT_BATCH_CHARS) -> None:
+    """Replace the splitter of the current process, e.g. in a worker initializer."""
+    global _splitter
+    _splitter = SentenceSplitter(cache_size=cache_size, batch_chars=batch_chars)
+
+
+def split_paragraphs(paragraphs: Iterable[str]) -> Iterator[List[str]]:
+    """Yield the sentences of each paragraph, using the splitter of the current process."""
+    return _splitter.split(paragraphs)
+
+
+def take_stats() -> Dict[str, int]:
+    """Return the counters of the splitter of the current process since the last call, and reset them."""
+    return _splitter.take_stats()
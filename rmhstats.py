@@ -0,0 +1,226 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     RMH extraction statistics
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Per-stage wall and CPU time, byte counts and queue depths of an extraction,
+     collected in each process and aggregated in the main process. Threads of the main process
+     (e.g. the writer) count their own times, which are added with StatsReport.update_thread().
+"""
+
+import json
+import logging
+import pstats
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import IO, Any, Dict, Iterator, List, Optional
+
+log = logging.getLogger(__name__)
+
+# The counters of the current process since the last take_stats()
+_stats: Counter = Counter()
+# The stages which are being timed, innermost last, with the wall and CPU time when each was entered or resumed
+_stack: List[List[Any]] = []
+
+
+def _charge(entry: List[Any], wall: float, cpu: float) -> None:
+    _stats[f"{entry[0]}_wall"] += wall - entry[1]
+    _stats[f"{entry[0]}_cpu"] += cpu - entry[2]
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage of the work in the current process. Stages can be nested, and the time of a nested stage is
+    not counted in the enclosing one, e.g. the time spent reading from the zip file while a file is parsed is only
+    counted as read, not as parse."""
+    wall, cpu = time.perf_counter(), time.process_time()
+    if _stack:
+        _charge(_stack[-1], wall, cpu)
+    entry = [name, wall, cpu]
+    _stack.append(entry)
+    _stats[f"{name}_calls"] += 1
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter(), time.process_time()
+        _charge(entry, wall, cpu)
+        _stack.pop()
+        if _stack:
+            _stack[-1][1], _stack[-1][2] = wall, cpu
+
+
+def count(name: str, value: float = 1) -> None:
+    """Add to a counter of the current process."""
+    _stats[name] += value
+
+
+def take_stats() -> Dict[str, float]:
+    """Return the counters of the current process since the last call, and reset them."""
+    stats = dict(_stats)
+    _stats.clear()
+    return stats
+
+
+# The end of an iterator, see timed()
+_END = object()
+
+
+def timed(name: str, iterator: Iterator[Any]) -> Iterator[Any]:
+    """Yield the items of an iterator, timing the production of each one as the given stage,
+    e.g. the events of a parser, whose reads are counted in their own stage."""
+    while True:
+        with stage(name):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+class TimedStream:
+    """A binary stream whose reads are timed as the read stage and counted as bytes_in,
+    e.g. a file in a zip file, whose reads include the decompression."""
+
+    def __init__(self, stream: IO[bytes]):
+        self.stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        with stage("read"):
+            data = self.stream.read(size)
+        _stats["bytes_in"] += len(data)
+        return data
+
+
+def _stages(stats: Dict[str, float]) -> Dict[str, Any]:
+    """Split counters into the wall and CPU time and number of calls of each stage, and the other counters."""
+    stages: Dict[str, Dict[str, float]] = {}
+    counters: Dict[str, float] = {}
+    for key, value in sorted(stats.items()):
+        name, _, kind = key.rpartition("_")
+        if kind in ("wall", "cpu", "calls") and f"{name}_wall" in stats and f"{name}_calls" in stats:
+            stages.setdefault(name, {})[kind] = value
+        else:
+            counters[key] = value
+    return {"stages": stages, "counters": counters}
+
+
+class StatsReport:
+    """The statistics of an extraction: the stages and counters of the workers, summed over all the workers, of
+    the main process and of its threads, the depths of the queues between them and the utilization of the workers.
+
+    With a samples_path, a snapshot of the report is appended to it (one json object per line) at most every
+    interval seconds, when the main process handles a result. With profiling, the cProfile statistics of the
+    workers are merged with add_profile()."""
+
+    def __init__(self, processes: int, samples_path: Optional[Path] = None, interval: float = 10.0):
+        self.processes = processes
+        self.samples_path = samples_path
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last_sample = self.start
+        self.workers: Counter = Counter()
+        self.main: Counter = Counter()
+        self.threads: Dict[str, Counter] = {}
+        # The number of observations, their sum and maximum, for each queue
+        self.queues: Dict[str, List[float]] = {}
+        self.profile: Optional[pstats.Stats] = None
+        take_stats()  # Only count the main process from now on
+        if samples_path is not None:
+            samples_path.write_text("", encoding="utf-8")
+
+    def update(self, worker_stats: Dict[str, float]) -> None:
+        """Add the counters which a worker returned with a chunk of results."""
+        self.workers.update(worker_stats)
+        if self.samples_path is not None and time.perf_counter() - self.last_sample >= self.interval:
+            self.sample()
+
+    def update_thread(self, name: str, thread_stats: Dict[str, float]) -> None:
+        """Add the counters of a thread of the main process, which can not use stage() since it is not thread-safe."""
+        self.threads.setdefault(name, Counter()).update(thread_stats)
+
+    def observe(self, queue: str, depth: float) -> None:
+        """Record the current depth of a queue."""
+        observed = self.queues.setdefault(queue, [0, 0, 0])
+        observed[0] += 1
+        observed[1] += depth
+        observed[2] = max(observed[2], depth)
+
+    def add_profile(self, profile: Dict) -> None:
+        """Merge the statistics of a cProfile.Profile of a worker (its stats attribute after create_stats())."""
+        stats = pstats.Stats()
+        stats.stats = profile  # type: ignore
+        stats.get_top_level_stats()
+        if self.profile is None:
+            self.profile = stats
+        else:
+            self.profile.add(stats)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the report. Worker times are summed over all the workers."""
+        self.main.update(take_stats())
+        wall = time.perf_counter() - self.start
+        workers = _stages(self.workers)
+        busy = workers["counters"].pop("busy_wall", 0.0)
+        return {
+            "wall_seconds": wall,
+            "processes": self.processes,
+            "worker_utilization": busy / (self.processes * wall) if wall > 0 and self.processes else None,
+            "workers": workers,
+            "main": _stages(self.main),
+            "threads": {name: _stages(counters) for name, counters in sorted(self.threads.items())},
+            "queues": {
+                name: {"mean": total / observations, "max": maximum}
+                for name, (observations, total, maximum) in sorted(self.queues.items())
+                if observations
+            },
+        }
+
+    def log_summary(self) -> None:
+        """Log the share of the time of the workers spent in each stage, and their utilization, and the time the
+        writer thread spent writing."""
+        report = self.as_dict()
+        writer = self.threads.get("writer")
+        if writer:
+            log.info(
+                f"Writer thread: {writer['disk_wall']:.1f}s writing, {writer['idle_wall']:.1f}s idle, "
+                f"main process blocked on it for {writer['blocked_wall']:.1f}s"
+            )
+        stages = report["workers"]["stages"]
+        total = sum(x.get("wall", 0.0) for x in stages.values())
+        if total <= 0:
+            return
+        shares = ", ".join(
+            f"{name} {x.get('wall', 0.0) / total:.0%}"
+            for name, x in sorted(stages.items(), key=lambda x: -x[1].get("wall", 0.0))
+        )
+        log.info(f"Worker time: {shares}; worker utilization {report['worker_utilization']:.0%}")
+
+    def sample(self) -> None:
+        self.last_sample = time.perf_counter()
+        with open(self.samples_path, "a", encoding="utf-8") as f:  # type: ignore
+            f.write(json.dumps(self.as_dict()) + "\n")
+
+    def write(self, path: Path) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.as_dict(), f, indent=2)
+            f.write("\n")
+
+    def write_profile(self, path: Path) -> None:
+        """Write the merged profile of the workers, which can be read with pstats."""
+        if self.profile is not None:
+            self.profile.dump_stats(str(path))
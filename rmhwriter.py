@@ -0,0 +1,295 @@
+"""
+    Reynir: Natural language processing for Icelandic
+
+     RMH output writers
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Writers of the output files of extract_rmh, so writing overlaps with the extraction: BackgroundWriter is
+     the thread which writes and completes all the output files of an extraction, and ShardedOutputFile
+     splits an output file into size-rotated shards, compressed by a thread of its own, with an index
+     listing the shards with their document counts and sizes. Files are written under a temporary
+     name (PARTIAL_FILE_SUFFIX) until they are complete.
+"""
+
+import gzip
+import json
+import lzma
+import os
+import queue
+import re
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SHARD_INDEX_SUFFIX = ".shards.jsonl"
+PARTIAL_FILE_SUFFIX = ".partial"
+COMPRESSION_SUFFIXES = {"none": "", "gzip": ".gz", "xz": ".xz", "zstd": ".zst"}
+DEFAULT_QUEUE_SIZE = 64
+
+
+def open_compressed(path: Path, compression: str) -> IO[bytes]:
+    """Open a binary file for writing, compressed with gzip, xz or zstd (if the zstandard package is installed)."""
+    if compression == "none":
+        return open(path, "wb")
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=6)  # type: ignore
+    if compression == "xz":
+        return lzma.open(path, "wb")  # type: ignore
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package: pip install zstandard")
+        return zstandard.ZstdCompressor(level=3).stream_writer(open(path, "wb"))
+    raise ValueError(f"Unknown compression: {compression}")
+
+
+class ShardedOutputFile:
+    """An output file which is written as numbered shards, e.g. IGC-News1.shards.jsonl is written as
+    IGC-News1.00000.txt.gz, IGC-News1.00001.txt.gz, ... A new shard is started when the current one has at least
+    max_bytes of uncompressed text or max_docs documents. Documents are never split between shards.
+
+    The shards are compressed and written by a background thread, so compression overlaps with the rest of the
+    extraction. Each shard is written under a temporary name until it is complete. When the output file is closed,
+    the index (the path of the output file) is written with a line per shard: its name, the number of documents
+    and the uncompressed and compressed sizes. Has the same interface as extract_rmh.TextOutputFile."""
+
+    def __init__(
+        self,
+        path: Path,
+        shard_suffix: str = ".txt",
+        compression: str = "gzip",
+        max_bytes: Optional[int] = None,
+        max_docs: Optional[int] = None,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        if not path.name.endswith(SHARD_INDEX_SUFFIX):
+            raise ValueError(f"The path of a sharded output file must end with {SHARD_INDEX_SUFFIX}: {path}")
+        if compression not in COMPRESSION_SUFFIXES:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.path = path
+        self.stem = path.name[: -len(SHARD_INDEX_SUFFIX)]
+        self.shard_suffix = shard_suffix + COMPRESSION_SUFFIXES[compression]
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_docs = max_docs
+        self.shards: List[Dict[str, Any]] = []
+        self.error: Optional[BaseException] = None
+        self.queue: "queue.Queue[Optional[List[bytes]]]" = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._write_shards, name=f"writer-{self.stem}", daemon=True)
+        self.thread.start()
+
+    def shard_path(self, index: int) -> Path:
+        return self.path.with_name(f"{self.stem}.{index:05d}{self.shard_suffix}")
+
+    def _current_shard(self) -> Dict[str, Any]:
+        """The shard which the next document goes to, starting a new one if the current one is full."""
+        if self.shards:
+            shard = self.shards[-1]
+            if not (
+                (self.max_bytes is not None and shard["bytes"] >= self.max_bytes)
+                or (self.max_docs is not None and shard["documents"] >= self.max_docs)
+            ):
+                return shard
+        self.shards.append({"shard": self.shard_path(len(self.shards)).name, "documents": 0, "bytes": 0})
+        return self.shards[-1]
+
+    def writelines(self, texts: Iterable[str]) -> None:
+        """Queue the documents for writing. The shard of each document is decided here, in the caller's thread,
+        and a new shard is signalled to the writer thread by the index of the shard."""
+        self._check_error()
+        batch: List[Any] = []
+        for text in texts:
+            data = text.encode("utf-8")
+            shard = self._current_shard()
+            if shard["documents"] == 0:
+                batch.append(len(self.shards) - 1)
+            shard["documents"] += 1
+            shard["bytes"] += len(data)
+            batch.append(data)
+        if batch:
+            self.queue.put(batch)
+
+    def _write_shards(self) -> None:
+        """Runs in the writer thread: write the queued documents, rotating the shards as instructed."""
+        f: Optional[IO[bytes]] = None
+        index = -1
+        # Whether the sentinel of _stop() has been read, after which nothing more is queued
+        stopped = False
+        try:
+            while True:
+                batch = self.queue.get()
+                if batch is None:
+                    stopped = True
+                    break
+                if self.error is not None:
+                    continue
+                for item in batch:
+                    if isinstance(item, int):
+                        if f is not None:
+                            f.close()
+                            self._complete_shard(index)
+                        index = item
+                        f = open_compressed(self._partial_path(index), self.compression)
+                    else:
+                        f.write(item)  # type: ignore
+            if f is not None:
+                last, f = f, None
+                last.close()
+                if self.error is None:
+                    self._complete_shard(index)
+        except BaseException as e:
+            self.error = e
+            if f is not None:
+                try:
+                    f.close()
+                except BaseException:
+                    pass  # The first error is the one reported
+            if not stopped:
+                # Keep consuming, so the caller is never blocked on a full queue
+                while self.queue.get() is not None:
+                    pass
+
+    def _partial_path(self, index: int) -> Path:
+        path = self.shard_path(index)
+        return path.with_name(path.name + PARTIAL_FILE_SUFFIX)
+
+    def _complete_shard(self, index: int) -> None:
+        os.replace(self._partial_path(index), self.shard_path(index))
+
+    def _check_error(self) -> None:
+        if self.error is not None:
+            raise RuntimeError(f"Writing {self.path} failed") from self.error
+
+    def _stop(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+
+    def close(self) -> None:
+        """Wait for the writer thread to finish the shards, write the index and remove stale shards which were
+        left by an earlier extraction with more shards."""
+        self._stop()
+        self._check_error()
+        if not self.shards:
+            # An output file without documents still gets an (empty) shard
+            open_compressed(self.shard_path(0), self.compression).close()
+            self.shards.append({"shard": self.shard_path(0).name, "documents": 0, "bytes": 0})
+        for shard in self.shards:
+            shard["compressed_bytes"] = (self.path.parent / shard["shard"]).stat().st_size
+        partial_path = self.path.with_name(self.path.name + PARTIAL_FILE_SUFFIX)
+        with open(partial_path, "w", encoding="utf-8") as f:
+            for shard in self.shards:
+                f.write(json.dumps(shard, ensure_ascii=False) + "\n")
+        os.replace(partial_path, self.path)
+        current = {shard["shard"] for shard in self.shards}
+        pattern = re.compile(re.escape(self.stem) + r"\.\d{5}" + re.escape(self.shard_suffix))
+        for stale in self.path.parent.iterdir():
+            if pattern.fullmatch(stale.name) and stale.name not in current:
+                stale.unlink()
+
+    def abort(self) -> None:
+        """Stop writing and remove the incomplete shard, e.g. when the extraction fails.
+        Completed shards are left in place but no index is written."""
+        self.error = self.error or RuntimeError("Aborted")
+        self._stop()
+        if self.shards:
+            self._partial_path(len(self.shards) - 1).unlink(missing_ok=True)
+
+
+def read_shard_index(path: Path) -> List[Dict[str, Any]]:
+    """Read the index of a sharded output file."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class BackgroundWriter:
+    """Runs the writes of the output files of an extraction (writelines(), close(), ...) in a dedicated thread, in
+    the order they are submitted, so a slow disk does not hold up the main process. At most queue_size operations
+    are queued, after which submit() blocks.
+
+    Counts the time the thread spends on the operations (disk), waiting for operations (idle), and the time the
+    callers of submit() were blocked on a full queue (blocked). If an operation fails, the queued operations are
+    discarded and the error is raised by the next submit() or close()."""
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.queue: "queue.Queue[Optional[Tuple[Callable, Tuple]]]" = queue.Queue(maxsize=queue_size)
+        self.error: Optional[BaseException] = None
+        self.stopped = False
+        self._stats: Counter = Counter()
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="writer", daemon=True)
+        self.thread.start()
+
+    def _count(self, **values: float) -> None:
+        with self._lock:
+            self._stats.update(values)
+
+    def _run(self) -> None:
+        while True:
+            start = time.perf_counter()
+            item = self.queue.get()
+            started = time.perf_counter()
+            self._count(idle_wall=started - start, idle_calls=1)
+            if item is None:
+                break
+            if self.error is not None:
+                # Keep consuming, so the callers are never blocked on a full queue
+                continue
+            function, args = item
+            try:
+                function(*args)
+            except BaseException as e:
+                self.error = e
+            self._count(disk_wall=time.perf_counter() - started, disk_calls=1)
+
+    def _check_error(self) -> None:
+        if self.error is not None:
+            raise RuntimeError("Writing the output failed") from self.error
+
+    def submit(self, function: Callable, *args: Any) -> None:
+        """Queue a call of function(*args) in the writer thread."""
+        self._check_error()
+        start = time.perf_counter()
+        self.queue.put((function, args))
+        self._count(blocked_wall=time.perf_counter() - start)
+
+    def take_stats(self) -> Dict[str, float]:
+        """Return the counters of the writer since the last call, and reset them."""
+        with self._lock:
+            stats = dict(self._stats)
+            self._stats.clear()
+        return stats
+
+    def _stop(self) -> None:
+        if not self.stopped:
+            self.stopped = True
+            self.queue.put(None)
+            self.thread.join()
+
+    def close(self) -> None:
+        """Wait for all the queued operations, and raise the error of a failed one."""
+        self._stop()
+        self._check_error()
+
+    def abort(self) -> None:
+        """Discard the queued operations and stop the thread, e.g. when the extraction fails."""
+        self.error = self.error or RuntimeError("Aborted")
+        self._stop()
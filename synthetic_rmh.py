@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+    Reynir: Natural language processing for Icelandic
+
+     Synthetic RMH archives
+
+    Copyright (C) 2020 Miðeind ehf.
+
+       This program is free software: you can redistribute it and/or modify
+       it under the terms of the GNU General Public License as published by
+       the Free Software Foundation, either version 3 of the License, or
+       (at your option) any later version.
+       This program is distributed in the hope that it will be useful,
+       but WITHOUT ANY WARRANTY; without even the implied warranty of
+       MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+       GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses/.
+
+     Generate zip files of TEI documents which imitate the layout of the IGC sub-corpora,
+     for testing and benchmarking without the licensed archives.
+"""
+
+import logging
+import random
+import zipfile
+from collections import namedtuple
+from pathlib import Path
+from typing import Dict, List
+from xml.sax.saxutils import escape, quoteattr
+
+log = logging.getLogger(__name__)
+
+# A generated document: its id, header fields and paragraphs, each a list of sentences of (form, lemma, tag) tokens
+SyntheticDocument = namedtuple("SyntheticDocument", "id idno title author date source paragraphs")
+
+# Frequent tokens, in descending order of frequency. Other tokens are made up from SYLLABLES.
+VOCABULARY = [
+    ("og", "og", "c"),
+    ("í", "í", "af"),
+    ("að", "að", "cn"),
+    ("á", "á", "af"),
+    ("er", "vera", "sfg3en"),
+    ("sem", "sem", "ct"),
+    ("til", "til", "af"),
+    ("ekki", "ekki", "aa"),
+    ("við", "við", "af"),
+    ("hann", "hann", "fpken"),
+    ("var", "vera", "sfg3eþ"),
+    ("það", "það", "fphen"),
+    ("um", "um", "af"),
+    ("með", "með", "af"),
+    ("hefur", "hafa", "sfg3en"),
+    ("fyrir", "fyrir", "af"),
+    ("árið", "ár", "nhengi"),
+    ("ríkisstjórnin", "ríkisstjórn", "nvengi"),
+    ("dómurinn", "dómur", "nkengi"),
+    ("Alþingi", "Alþingi", "nhe-s"),
+    ("Reykjavík", "Reykjavík", "nven-s"),
+    ("sagði", "segja", "sfg3eþ"),
+    ("málið", "mál", "nhengi"),
+    ("fólk", "fólk", "nheo"),
+    ("mikið", "mikill", "lhensf"),
+    ("nýja", "nýr", "lhenvf"),
+    ("frumvarpið", "frumvarp", "nhengi"),
+    ("krónur", "króna", "nvfo"),
+    ("stefndi", "stefna", "sfg3eþ"),
+    ("landsins", "land", "nhegg"),
+]
+_WEIGHTS = [1 / rank for rank in range(1, len(VOCABULARY) + 1)]
+SYLLABLES = ["ka", "ra", "ður", "sta", "fjö", "lur", "gar", "ði", "hús", "ver", "ný", "sk", "óli", "inn", "um", "ar"]
+PUNCTUATION = [(",", ",", "pk"), (".", ".", "pl")]
+NAMES = ["Jón Jónsson", "Guðrún Sigurðardóttir", "Anna Björk Einarsdóttir", "Sigurður Ólafsson", "Helga Pétursdóttir"]
+SOURCES = ["mbl", "visir", "ruv", "dv", "kjarninn"]
+COURTS = ["Haestirettur", "Heradsdomstolar", "Landsrettur"]
+BYLINES = ["Ljósmynd: Morgunblaðið.", "Frétt uppfærð klukkan 14:30.", "Deila á Facebook.", "Skráðu þig í áskrift."]
+
+SUBCORPORA = ["news", "parla", "adjud"]
+
+
+def _token(rng: random.Random, rare_fraction: float):
+    """A token, mostly from the Zipf distributed VOCABULARY and otherwise made up."""
+    if rng.random() < rare_fraction:
+        form = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5)))
+        return form, form, rng.choice(["nkeo", "nven", "nhfn", "lkensf", "sng"])
+    return rng.choices(VOCABULARY, weights=_WEIGHTS)[0]
+
+
+def _sentence(rng: random.Random, mean_tokens: int, rare_fraction: float):
+    length = max(1, int(rng.expovariate(1 / mean_tokens)))
+    tokens = [_token(rng, rare_fraction) for _ in range(length)]
+    tokens[0] = (tokens[0][0][:1].upper() + tokens[0][0][1:],) + tokens[0][1:]
+    if length > 6 and rng.random() < 0.3:
+        tokens.insert(length // 2, PUNCTUATION[0])
+    tokens.append(PUNCTUATION[1])
+    return tokens
+
+
+def make_document(
+    rng: random.Random,
+    subcorpus: str,
+    index: int,
+    paragraphs: int = 8,
+    sentences: int = 4,
+    tokens: int = 15,
+    rare_fraction: float = 0.2,
+) -> SyntheticDocument:
+    """Generate a document of the subcorpus with about the given mean number of paragraphs,
+    sentences per paragraph and tokens per sentence."""
+    year = rng.randint(2000, 2021)
+    date = f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    text = [
+        [_sentence(rng, tokens, rare_fraction) for _ in range(max(1, int(rng.expovariate(1 / sentences))))]
+        for _ in range(max(1, int(rng.expovariate(1 / paragraphs))))
+    ]
+    title = " ".join(form for form, _, _ in _sentence(rng, 6, rare_fraction)[:-1])
+    if subcorpus == "news":
+        source = rng.choice(SOURCES)
+        if rng.random() < 0.5:
+            # Repeated paragraphs, as in the news sites
+            text.append([[(form, form, "x") for form in rng.choice(BYLINES).split(" ")]])
+        return SyntheticDocument(f"IGC-News1-{source}_{index}", None, title, rng.choice(NAMES), date, source, text)
+    if subcorpus == "parla":
+        return SyntheticDocument(f"IGC-Parla_{year}_{index}", None, title, None, date, "Alþingi", text)
+    if subcorpus == "adjud":
+        court = rng.choice(COURTS)
+        return SyntheticDocument(f"IGC-Adjud_{court}_{index}", f"{index}/{year}", title, None, date, court, text)
+    raise ValueError(f"Unknown subcorpus: {subcorpus}")
+
+
+def _plain_text(sentences) -> str:
+    """The untokenized text of a paragraph, with the punctuation attached to the preceding word."""
+    return " ".join(
+        "".join(form if tag.startswith("p") or i == 0 else " " + form for i, (form, _, tag) in enumerate(sentence))
+        for sentence in sentences
+    )
+
+
+def _annotated_text(sentences) -> str:
+    return "".join(
+        f'<s n="{s_idx}">'
+        + "".join(
+            f"<pc>{escape(form)}</pc>"
+            if tag.startswith("p")
+            else f"<w lemma={quoteattr(lemma)} pos={quoteattr(tag)}>{escape(form)}</w>"
+            for form, lemma, tag in sentence
+        )
+        + "</s>"
+        for s_idx, sentence in enumerate(sentences, start=1)
+    )
+
+
+def document_to_xml(subcorpus: str, doc: SyntheticDocument, annotated: bool = False) -> str:
+    """Serialize a document as a TEI file like those of the subcorpus: news documents have their title, author
+    and date in the biblStruct, adjudications have an idno, and the text of parliament speeches is in tei:u/tei:seg.
+    Annotated documents have tei:s sentences of tei:w and tei:pc tokens."""
+    analytic = f"<title>{escape(doc.title)}</title>"
+    if doc.author is not None:
+        analytic += f"<author>{escape(doc.author)}</author>"
+    analytic += f"<date>{doc.date}</date>"
+    idno = f"<idno>{escape(doc.idno)}</idno>" if doc.idno is not None else ""
+    header = (
+        "<teiHeader><fileDesc>"
+        f'<titleStmt><title type="main">{escape(doc.source)}</title><title type="sub">{escape(doc.title)}</title>'
+        "</titleStmt>"
+        f"<publicationStmt><publisher>Árni Magnússon Institute for Icelandic Studies</publisher>{idno}</publicationStmt>"
+        f"<sourceDesc><biblStruct><analytic>{analytic}</analytic>"
+        f"<monogr><title>{escape(doc.source)}</title><imprint><date>{doc.date}</date></imprint></monogr>"
+        "</biblStruct></sourceDesc></fileDesc></teiHeader>"
+    )
+    if subcorpus == "parla":
+        outer, inner = '<u who="#speaker">', "seg"
+    else:
+        outer, inner = "", "p"
+    body = "".join(
+        f'<{inner} n="{p_idx}">'
+        + (_annotated_text(sentences) if annotated else escape(_plain_text(sentences)))
+        + f"</{inner}>"
+        for p_idx, sentences in enumerate(doc.paragraphs, start=1)
+    )
+    if outer:
+        body = outer + body + "</u>"
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<TEI xmlns="http://www.tei-c.org/ns/1.0" xml:id={quoteattr(doc.id)}>'
+        f"{header}<text><body><div>{body}</div></body></text></TEI>\n"
+    )
+
+
+def member_path(subcorpus: str, doc: SyntheticDocument, annotated: bool = False) -> str:
+    """The path of the document in the archive, nested like the IGC zip files."""
+    suffix = ".ana.xml" if annotated else ".xml"
+    year, month = doc.date[:4], doc.date[5:7]
+    if subcorpus == "news":
+        return f"CC_BY/{doc.source}/{year}/{month}/{doc.id}{suffix}"
+    if subcorpus == "parla":
+        return f"IGC-Parla-21.12.TEI/{year}/{doc.id}{suffix}"
+    if subcorpus == "adjud":
+        return f"IGC-Adjud-21.05.TEI/{doc.source}/{year}/{doc.id}{suffix}"
+    raise ValueError(f"Unknown subcorpus: {subcorpus}")
+
+
+def write_archive(
+    path: Path,
+    subcorpus: str,
+    documents: int,
+    annotated: bool = False,
+    seed: int = 0,
+    duplicate_fraction: float = 0.0,
+    **document_options,
+) -> Dict[str, int]:
+    """Write a zip file with the given number of generated documents of the subcorpus. The same seed always gives
+    the same documents, so archives can be compared between runs. A duplicate_fraction of the documents are copies
+    of an earlier document with a new id. Returns the number of documents and their total uncompressed size."""
+    rng = random.Random(seed)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    written: List[SyntheticDocument] = []
+    total_bytes = 0
+    with zipfile.ZipFile(str(path), "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for index in range(documents):
+            if written and rng.random() < duplicate_fraction:
+                original = rng.choice(written)
+                doc = original._replace(id=f"{original.id}_copy{index}")
+            else:
+                doc = make_document(rng, subcorpus, index, **document_options)
+                written.append(doc)
+            data = document_to_xml(subcorpus, doc, annotated=annotated).encode("utf-8")
+            archive.writestr(member_path(subcorpus, doc, annotated=annotated), data)
+            total_bytes += len(data)
+    log.info(f"Wrote {documents} documents ({total_bytes / 1e6:.1f} MB uncompressed) to {path}")
+    return {"documents": documents, "bytes": total_bytes}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("Generate a zip file of synthetic TEI documents in the layout of an IGC sub-corpus")
+    parser.add_argument("-o", "--out_path", dest="out_path", type=Path, required=True, help="Path to the zip file")
+    parser.add_argument("--subcorpus", choices=SUBCORPORA, default="news", help="The layout to imitate.")
+    parser.add_argument("--documents", type=int, default=1000, help="The number of documents.")
+    parser.add_argument(
+        "--annotated",
+        action="store_true",
+        default=False,
+        help="Write annotated .ana.xml files, with tei:s sentences of tei:w tokens with lemmas and tags.",
+    )
+    parser.add_argument("--paragraphs", type=int, default=8, help="The mean number of paragraphs per document.")
+    parser.add_argument("--sentences", type=int, default=4, help="The mean number of sentences per paragraph.")
+    parser.add_argument("--tokens", type=int, default=15, help="The mean number of tokens per sentence.")
+    parser.add_argument(
+        "--rare_fraction",
+        type=float,
+        default=0.2,
+        help="The fraction of tokens which are made up, rather than drawn from a small vocabulary.",
+    )
+    parser.add_argument(
+        "--duplicate_fraction",
+        type=float,
+        default=0.0,
+        help="The fraction of documents which are copies of an earlier document.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the random generator.")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    write_archive(
+        args.out_path,
+        args.subcorpus,
+        args.documents,
+        annotated=args.annotated,
+        seed=args.seed,
+        duplicate_fraction=args.duplicate_fraction,
+        paragraphs=args.paragraphs,
+        sentences=args.sentences,
+        tokens=args.tokens,
+        rare_fraction=args.rare_fraction,
+    )
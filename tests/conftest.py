@@ -0,0 +1,42 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# The modules are scripts in the root of the repository
+sys.path.insert(0, str(REPO_DIR))
+
+
+@pytest.fixture
+def run_script():
+    """Run a script of the repository with arguments, and return its log (stderr)."""
+
+    def run(script, *args):
+        result = subprocess.run(
+            [sys.executable, script, *(str(x) for x in args)],
+            cwd=str(REPO_DIR),
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        return result.stderr
+
+    return run
+
+
+@pytest.fixture
+def read_outputs():
+    """Read the output files of an extraction, without the statistics, the stores and the manifest, which
+    vary between runs."""
+
+    def read(out_dir):
+        return {
+            str(path.relative_to(out_dir)): path.read_bytes()
+            for path in sorted(out_dir.rglob("*"))
+            if path.is_file() and path.suffix not in (".json", ".jsonl") and ".sqlite" not in path.name
+        }
+
+    return read
@@ -0,0 +1,38 @@
+import io
+import sqlite3
+import zipfile
+from pathlib import Path
+
+import pytest
+
+import catalog_rmh
+import rmhfile
+import synthetic_rmh
+
+
+@pytest.mark.parametrize("engine", list(rmhfile.ENGINES))
+def test_build_catalog_skips_broken_member(tmp_path, engine):
+    zip_path = tmp_path / "news.zip"
+    synthetic_rmh.write_archive(zip_path, "news", 5)
+    with zipfile.ZipFile(zip_path) as archive:
+        members = archive.namelist()
+        data = archive.read(members[0])
+    # A member which is cut off in the middle of its header
+    with zipfile.ZipFile(zip_path, "a") as archive:
+        archive.writestr("CC_BY/broken.xml", data[: data.index(b"<title") + 3])
+
+    catalog_path = tmp_path / "catalog.sqlite"
+    catalog_rmh.build_catalog(zip_path, catalog_path, processes=1, chunksize=2, parser_engine=engine)
+
+    conn = sqlite3.connect(str(catalog_path))
+    catalogued = [row[0] for row in conn.execute("SELECT member FROM documents ORDER BY rowid")]
+    conn.close()
+    assert catalogued == members
+
+
+@pytest.mark.parametrize("engine", list(rmhfile.ENGINES))
+def test_engines_raise_parse_error(engine):
+    rmhf = rmhfile.RMHFile.from_stream(io.BytesIO(b"<TEI><teiHeader><title"), Path("broken.xml"), engine)
+    with pytest.raises(rmhfile.ET.ParseError) as error:
+        rmhf.header
+    assert error.value.position[0] == 1
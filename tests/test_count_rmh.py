@@ -0,0 +1,43 @@
+import json
+import random
+from collections import Counter
+
+import count_rmh
+
+
+def _updates(seed):
+    rng = random.Random(seed)
+    keys = ["hestur", "Hestur", "á\tflipa", "ný\nlína", "", ("hestur", "nkeng"), ("vera", "sfg3en")] + [
+        f"orð{i}" for i in range(50)
+    ]
+    return [Counter(rng.choice(keys) for _ in range(rng.randint(0, 30))) for _ in range(40)]
+
+
+def test_spilled_counts_merge_to_the_totals(tmp_path):
+    updates = _updates(0)
+    expected = Counter()
+    for counts in updates:
+        expected.update(counts)
+
+    counter = count_rmh.SpillingCounter(tmp_path, "forms", max_entries=5)
+    for counts in updates:
+        counter.update(counts)
+    items = list(counter.items())
+
+    assert len(counter.spill_files) > 1
+    # Tuple keys are read back as lists, as they are encoded in json
+    assert {json.dumps(key): count for key, count in items} == {
+        json.dumps(key): count for key, count in expected.items()
+    }
+    encoded = [count_rmh._encode(key) for key, _ in items]
+    assert encoded == sorted(encoded)
+
+
+def test_counts_in_memory_are_the_same_as_spilled_counts(tmp_path):
+    in_memory = count_rmh.SpillingCounter(tmp_path, "lemmas", max_entries=10_000)
+    spilled = count_rmh.SpillingCounter(tmp_path, "tags", max_entries=3)
+    for counts in _updates(1):
+        in_memory.update(counts)
+        spilled.update(counts)
+    assert not in_memory.spill_files
+    assert list(in_memory.items()) == list(spilled.items())
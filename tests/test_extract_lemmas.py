@@ -0,0 +1,16 @@
+import extract_lemmas
+import rmhfile
+
+EMPTY_TOKENS = """<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader><fileDesc><publicationStmt><idno>1</idno></publicationStmt>
+</fileDesc></teiHeader><text><body><div><p n="1">
+<s n="1"><w lemma="hestur" pos="nkeng">Hesturinn</w><w pos="x"/><w lemma="hlaupa" pos="sfg3eþ">hljóp</w><pc>.</pc></s>
+<s n="2"><w/><w lemma="" pos="x">og</w></s>
+</p></div></body></text></TEI>
+"""
+
+
+def test_tokens_without_a_form_or_lemma_are_kept():
+    text, lemmas = extract_lemmas.extract_rmh_to_lemma_pair(rmhfile.RMHFile(EMPTY_TOKENS, "x.ana.xml"))
+    assert text == "Hesturinn  hljóp .\n og\n"
+    assert lemmas == "hestur  hlaupa .\n \n"
@@ -0,0 +1,257 @@
+import io
+import random
+import threading
+import time
+import zipfile
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+import extract_rmh
+import rmhfile
+import rmhindex
+import rmhsplit
+import synthetic_rmh
+
+MANIFEST = "extract_manifest.jsonl"
+
+
+def _extract(run_script, zip_path, out_dir, *args):
+    return run_script("extract_rmh.py", "-i", zip_path, "-o", out_dir, "--flatten_depth", 2, "--processes", 2, *args)
+
+
+def _manifest_lines(out_dir):
+    return (out_dir / MANIFEST).read_text(encoding="utf-8").splitlines()
+
+
+def test_resume_skips_complete_output_files_and_extracts_missing_ones(tmp_path, run_script, read_outputs):
+    zip_path = tmp_path / "news.zip"
+    synthetic_rmh.write_archive(zip_path, "news", 40, paragraphs=2)
+    out_dir = tmp_path / "out"
+    _extract(run_script, zip_path, out_dir)
+    outputs = read_outputs(out_dir)
+    entries = len(_manifest_lines(out_dir))
+    assert entries == len(outputs) > 1
+
+    log = _extract(run_script, zip_path, out_dir, "--resume")
+    assert f"skipping {entries} unchanged output files, 0 remaining" in log
+    assert len(_manifest_lines(out_dir)) == entries
+
+    # An output file which is lost, e.g. by an interrupted run, is extracted again
+    lost = sorted(outputs)[0]
+    (out_dir / lost).unlink()
+    log = _extract(run_script, zip_path, out_dir, "--resume")
+    assert f"skipping {entries - 1} unchanged output files, 1 remaining" in log
+    assert read_outputs(out_dir) == outputs
+
+
+def test_resume_with_a_renamed_archive_extracts_only_changed_files(tmp_path, run_script, read_outputs):
+    old_zip = tmp_path / "IGC-News1-21.05.zip"
+    synthetic_rmh.write_archive(old_zip, "news", 40, paragraphs=2)
+    out_dir = tmp_path / "out"
+    _extract(run_script, old_zip, out_dir)
+    entries = len(_manifest_lines(out_dir))
+
+    # A new release under a new name, in which one member has changed
+    new_zip = tmp_path / "release" / "IGC-News1-22.10.zip"
+    new_zip.parent.mkdir()
+    with zipfile.ZipFile(old_zip) as old, zipfile.ZipFile(new_zip, "w") as new:
+        members = old.namelist()
+        for member in members:
+            data = old.read(member)
+            if member == members[0]:
+                data = data.replace(b"</p>", b" Ein setning enn.</p>", 1)
+            new.writestr(member, data)
+
+    log = _extract(run_script, new_zip, out_dir, "--resume")
+    assert f"skipping {entries - 1} unchanged output files, 1 remaining" in log
+    assert len(_manifest_lines(out_dir)) == entries + 1
+    fresh_dir = tmp_path / "fresh"
+    _extract(run_script, new_zip, fresh_dir)
+    assert read_outputs(out_dir) == read_outputs(fresh_dir)
+
+
+class ShortWrites:
+    """A raw file which writes at most a few bytes at a time, like a raw write to network storage may."""
+
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, data):
+        return self.f.write(data[:3])
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+def test_text_output_file_writes_everything_despite_short_writes(tmp_path):
+    path = tmp_path / "out.txt"
+    output = extract_rmh.TextOutputFile(path, buffer_size=10)
+    output.f = ShortWrites(output.f)
+    texts = [f"Skjal númer {i}.\n" for i in range(20)]
+    output.writelines(texts[:10])
+    output.writelines(texts[10:])
+    output.close()
+    assert path.read_text(encoding="utf-8") == "".join(texts)
+
+
+class SlowLargeTaskPool:
+    """A pool which runs the tasks in a thread, the small ones (of size 1) right away and the large one only
+    after a few small ones have finished since it was submitted (or after a second), and records how many small
+    tasks were submitted while the large one was running."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = []
+        self.large_submitted_at = None
+        self.finished_small = 0
+        self.submitted_alongside_large = 0
+        self.running_when_large_submitted = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def apply_async(self, func, args, callback, error_callback):
+        size = args[0]
+        with self.lock:
+            if size > 1:
+                self.large_submitted_at = (time.monotonic(), self.finished_small)
+                self.running_when_large_submitted = len(self.running)
+            elif self.large_submitted_at is not None:
+                self.submitted_alongside_large += 1
+            self.running.append((size, callback))
+
+    def _run(self):
+        while True:
+            time.sleep(0.001)
+            with self.lock:
+                for size, callback in self.running:
+                    if size == 1:
+                        self.finished_small += 1
+                        break
+                    started, finished_before = self.large_submitted_at
+                    if self.finished_small - finished_before >= 5 or time.monotonic() - started > 1:
+                        self.large_submitted_at = None
+                        break
+                else:
+                    continue
+                self.running.remove((size, callback))
+            callback(size)
+
+
+def test_a_large_task_runs_alongside_small_tasks():
+    sizes = [1] * 10 + [100] + [1] * 10
+    tasks = [
+        extract_rmh.ExtractionTask(size, Path("out.txt"), index, [f"{index}.xml"], size)
+        for index, size in enumerate(sizes)
+    ]
+    pool = SlowLargeTaskPool()
+    results = list(extract_rmh.imap_per_output_file(pool, None, tasks, None, max_in_flight_bytes=20))
+    assert [task.index for task, _ in results] == list(range(len(sizes)))
+    assert pool.running_when_large_submitted > 0
+    assert pool.submitted_alongside_large >= 5
+
+
+def _header_only(subcorpus, **fields):
+    """A streamed file with the given header fields, which is cut off after its header, so reading any further
+    would be an error."""
+    doc = synthetic_rmh.make_document(random.Random(0), subcorpus, 0)._replace(**fields)
+    xml = synthetic_rmh.document_to_xml(subcorpus, doc).encode("utf-8")
+    return rmhfile.RMHFile.from_stream(io.BytesIO(xml[: xml.index(b"<text>") + 20]), Path("x.xml"))
+
+
+@pytest.mark.parametrize(
+    "conditions, accepted",
+    [
+        ({}, True),
+        ({"date_from": "2010"}, True),
+        ({"date_from": "2010-05-03"}, False),
+        ({"date_to": "2010-05"}, True),
+        ({"date_to": "2010-05-01"}, False),
+        ({"date_from": "2010", "date_to": "2010"}, True),
+        ({"id_regex": "kjarninn_[0-9]+$"}, True),
+        ({"id_regex": "^IGC-Adjud"}, False),
+        ({"author": "Jón Jónsson"}, True),
+        ({"author": "Anna Jónsdóttir"}, False),
+        ({"title_contains": "hestar"}, True),
+        ({"title_contains": "kýr"}, False),
+    ],
+)
+def test_document_filter(conditions, accepted):
+    rmhf = _header_only(
+        "news", id="IGC-News1-kjarninn_7", date="2010-05-02", author="Jón Jónsson", title="Um hestar og menn"
+    )
+    assert extract_rmh.DocumentFilter(**conditions).accepts(rmhf) is accepted
+
+
+def test_document_filter_on_the_idno_and_missing_fields():
+    rmhf = _header_only("adjud", idno="12/2015")
+    assert extract_rmh.DocumentFilter(id_regex="/2015$").accepts(rmhf)
+    assert not extract_rmh.DocumentFilter(id_regex="/2016$").accepts(rmhf)
+    # Adjudications have no author
+    assert not extract_rmh.DocumentFilter(author="Jón Jónsson").accepts(_header_only("adjud"))
+    assert extract_rmh.DocumentFilter().is_empty()
+    assert not extract_rmh.DocumentFilter(author="Jón Jónsson").is_empty()
+
+
+def test_to_segments_is_the_same_as_merging_the_extracted_sentences(tmp_path, run_script):
+    zip_path = tmp_path / "adjud.zip"
+    synthetic_rmh.write_archive(zip_path, "adjud", 20, paragraphs=4, sentences=6)
+    out_dir = tmp_path / "out"
+    run_script(
+        "extract_rmh.py", "-i", zip_path, "-o", out_dir, "--flatten_depth", 0, "--processes", 2, "--to_segments",
+        "--segment_max_chars", 150,
+    )
+    (segments,) = list(out_dir.glob("*.tsv"))
+
+    # The sentences of the documents as file_id.par.sent<TAB>text lines, merged by merge_text_segments.py
+    sentences = tmp_path / "sentences.tsv"
+    with zipfile.ZipFile(zip_path) as archive, open(sentences, "w", encoding="utf-8") as f:
+        for name in archive.namelist():
+            rmhf = rmhfile.RMHFile(archive.read(name).decode("utf-8"), Path(name))
+            for par_idx, paragraph in enumerate(rmhsplit.split_paragraphs(rmhf.paragraphs()), start=1):
+                for sent_idx, sentence in enumerate(paragraph, start=1):
+                    f.write(f"{rmhf.idno}.{par_idx}.{sent_idx}\t{' '.join(sentence.split())}\n")
+    merged = tmp_path / "merged.tsv"
+    run_script("merge_text_segments.py", "-i", sentences, "-o", merged, "--max-chars", 150)
+
+    expected = merged.read_text(encoding="utf-8")
+    assert segments.read_text(encoding="utf-8") == expected
+    # Sentences were merged
+    assert len(expected.splitlines()) < len(sentences.read_text(encoding="utf-8").splitlines())
+
+
+def _sampled_members(out_dir):
+    reader = rmhindex.DocumentReader(out_dir / rmhindex.INDEX_FILE_NAME)
+    members = {output_file: [d.member for d in reader.documents(output_file)] for output_file in reader.output_files()}
+    reader.close()
+    return members
+
+
+@pytest.mark.parametrize("weight", extract_rmh.SAMPLE_WEIGHTS)
+def test_sample_is_the_same_for_the_same_seed(tmp_path, run_script, read_outputs, weight):
+    zip_path = tmp_path / "news.zip"
+    synthetic_rmh.write_archive(zip_path, "news", 60, paragraphs=1)
+    with zipfile.ZipFile(zip_path) as archive:
+        names = archive.namelist()
+
+    def sample(name, seed, processes):
+        out_dir = tmp_path / name
+        run_script(
+            "extract_rmh.py", "-i", zip_path, "-o", out_dir, "--flatten_depth", 1, "--processes", processes,
+            "--doc_index", "--sample", 5, "--sample_weight", weight, "--seed", seed,
+        )
+        return read_outputs(out_dir), _sampled_members(out_dir)
+
+    outputs, members = sample("first", 7, 2)
+    assert (outputs, members) == sample("second", 7, 1)
+    per_output_file = Counter(
+        str(output_file)
+        for output_file in extract_rmh.archive_file_to_output_file([Path(x) for x in names], Path(), 1, [".xml"]).values()
+    )
+    assert len(members) == len(per_output_file) > 1
+    assert sum(len(sampled) for sampled in members.values()) < len(names)
+    for output_file, sampled in members.items():
+        assert len(sampled) == min(5, per_output_file[output_file])
+        # The sampled files keep the order of the archive
+        assert sampled == sorted(sampled, key=names.index)
+    assert sample("other_seed", 8, 2)[1] != members
@@ -0,0 +1,58 @@
+import io
+import random
+
+import pytest
+
+import merge_text_segments
+
+
+def _lines(file_id, count, length=20):
+    return "".join(f"{file_id}.1.{i}\t{'x' * length}\n" for i in range(count))
+
+
+def _file_ids(chunk):
+    return [merge_text_segments.file_id_of(line) for line in chunk.splitlines()]
+
+
+@pytest.mark.parametrize("chunk_chars", [1, 27, 100, 10_000])
+def test_chunks_end_at_file_boundaries(chunk_chars):
+    text = _lines("a", 3) + _lines("b", 50) + _lines("c", 2) + _lines("d", 4)
+    chunks = list(merge_text_segments.chunks_at_file_boundaries(io.StringIO(text), chunk_chars=chunk_chars))
+    assert "".join(chunks) == text
+    for chunk, next_chunk in zip(chunks, chunks[1:]):
+        assert _file_ids(chunk)[-1] != _file_ids(next_chunk)[0]
+    # The large file b is kept whole
+    assert sum("b" in _file_ids(chunk) for chunk in chunks) == 1
+
+
+def test_chunks_without_a_final_newline():
+    text = _lines("a", 3) + _lines("b", 3).rstrip("\n")
+    chunks = list(merge_text_segments.chunks_at_file_boundaries(io.StringIO(text), chunk_chars=30))
+    assert chunks == [_lines("a", 3), _lines("b", 3).rstrip("\n")]
+    chunks = list(merge_text_segments.chunks_at_file_boundaries(io.StringIO("a.1.0\tx\nb.1.0\tx"), chunk_chars=1))
+    assert chunks == ["a.1.0\tx\n", "b.1.0\tx"]
+
+
+def test_only_a_few_lines_of_each_block_are_read(monkeypatch):
+    text = "".join(_lines(f"f{i}", 5) for i in range(2000)) + _lines("large", 2000) + _lines("z", 1)
+    scanned = []
+    file_id_of = merge_text_segments.file_id_of
+    monkeypatch.setattr(merge_text_segments, "file_id_of", lambda line: scanned.append(line) or file_id_of(line))
+    chunks = list(merge_text_segments.chunks_at_file_boundaries(io.StringIO(text), chunk_chars=65536))
+    assert "".join(chunks) == text
+    # The lines are bisected, about log2(2400) + 2 lines of each of the 6 blocks are read
+    assert len(scanned) <= 6 * 16
+
+
+def test_merging_chunks_gives_the_sequential_output():
+    rng = random.Random(0)
+    text = "".join(
+        f"f{file}.{par}.{sent}\t{'x' * rng.randint(1, 150)}\n"
+        for file in range(300)
+        for par in range(rng.randint(1, 4))
+        for sent in range(rng.randint(1, 8))
+    )
+    expected = "".join(line + "\n" for line in merge_text_segments.line_merger(io.StringIO(text)))
+    for chunk_chars in (1, 100, 5000, len(text)):
+        chunks = merge_text_segments.chunks_at_file_boundaries(io.StringIO(text), chunk_chars=chunk_chars)
+        assert "".join(merge_text_segments.merge_chunk(chunk) for chunk in chunks) == expected
@@ -0,0 +1,59 @@
+import random
+import zipfile
+
+import rmhdedup
+import synthetic_rmh
+
+
+def test_documents_without_words_have_no_signature():
+    assert rmhdedup.signature([]) is None
+    assert rmhdedup.signature(["", "  \n"]) is None
+    assert rmhdedup.signature(["...", " – "]) is None
+    assert rmhdedup.signature(["Hestur."]) == rmhdedup.signature(["  hestur "])
+
+
+def test_empty_documents_are_not_dropped_as_duplicates(tmp_path, run_script):
+    zip_path = tmp_path / "news.zip"
+    synthetic_rmh.write_archive(zip_path, "news", 3)
+    rng = random.Random(1)
+    with zipfile.ZipFile(zip_path, "a") as archive:
+        # Empty paragraphs and a paragraph of punctuation only
+        for index, paragraphs in enumerate([[[]], [[], []], [[[("...", "...", "pl")]]]], start=3):
+            doc = synthetic_rmh.make_document(rng, "news", index)._replace(paragraphs=paragraphs)
+            archive.writestr(
+                synthetic_rmh.member_path("news", doc), synthetic_rmh.document_to_xml("news", doc).encode("utf-8")
+            )
+
+    out_dir = tmp_path / "out"
+    run_script("extract_rmh.py", "-i", zip_path, "-o", out_dir, "--processes", 1, "--dedup")
+
+    assert (out_dir / "dedup_report.tsv").read_text(encoding="utf-8") == ""
+
+
+def test_dedup_keeps_the_same_copies_in_every_run(tmp_path, run_script, read_outputs):
+    # Copies of documents in other output files (years) than the original, which are extracted at the same time
+    zip_path = tmp_path / "news.zip"
+    rng = random.Random(0)
+    originals = []
+    with zipfile.ZipFile(zip_path, "w") as archive:
+        for index in range(120):
+            if originals and rng.random() < 0.4:
+                date = f"{rng.randint(2000, 2009)}-01-01"
+                doc = rng.choice(originals)._replace(id=f"IGC-News1-copy_{index}", date=date)
+            else:
+                doc = synthetic_rmh.make_document(rng, "news", index, paragraphs=2)
+                originals.append(doc)
+            archive.writestr(synthetic_rmh.member_path("news", doc), synthetic_rmh.document_to_xml("news", doc))
+
+    outputs = []
+    for run in range(3):
+        out_dir = tmp_path / f"out{run}"
+        run_script(
+            "extract_rmh.py", "-i", zip_path, "-o", out_dir, "--dedup", "--flatten_depth", 2, "--chunksize", 1,
+            "--processes", 3,
+        )
+        outputs.append(read_outputs(out_dir))
+
+    assert outputs[0]["dedup_report.tsv"]
+    assert outputs[1] == outputs[0]
+    assert outputs[2] == outputs[0]
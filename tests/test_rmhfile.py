@@ -0,0 +1,90 @@
+import io
+import random
+import zipfile
+from pathlib import Path
+
+import pytest
+
+import rmhfile
+import rmhstats
+import synthetic_rmh
+
+TEXT_BEFORE_HEADER = (
+    b'<TEI xmlns="http://www.tei-c.org/ns/1.0"><text><body><div><p>a</p><p>b</p></div></body></text>'
+    b"<teiHeader><idno>x</idno></teiHeader></TEI>"
+)
+
+
+@pytest.mark.parametrize("engine", list(rmhfile.ENGINES))
+def test_paragraph_before_header_is_an_error(engine):
+    rmhf = rmhfile.RMHFile.from_stream(io.BytesIO(TEXT_BEFORE_HEADER), Path("x.xml"), engine)
+    with pytest.raises(ValueError):
+        rmhf.header
+    # The paragraphs can still be read when the header is not asked for
+    rmhf = rmhfile.RMHFile.from_stream(io.BytesIO(TEXT_BEFORE_HEADER), Path("x.xml"), engine)
+    assert list(rmhf.paragraphs()) == ["a", "b"]
+
+
+def test_parsing_is_only_timed_when_asked():
+    rmhstats.take_stats()
+    assert list(rmhfile.RMHFile.from_stream(io.BytesIO(TEXT_BEFORE_HEADER), Path("x.xml")).paragraphs()) == ["a", "b"]
+    assert rmhstats.take_stats() == {}
+    rmhf = rmhfile.RMHFile.from_stream(
+        io.BytesIO(TEXT_BEFORE_HEADER), Path("x.xml"), wrap_events=lambda events: rmhstats.timed("parse", events)
+    )
+    assert list(rmhf.paragraphs()) == ["a", "b"]
+    assert rmhstats.take_stats()["parse_calls"] > 0
+
+
+@pytest.mark.parametrize("annotated", [False, True])
+def test_paragraphs_do_not_build_tokens(tmp_path, monkeypatch, annotated):
+    zip_path = tmp_path / "parla.zip"
+    synthetic_rmh.write_archive(zip_path, "parla", 3, annotated=annotated)
+    with zipfile.ZipFile(zip_path) as archive:
+        members = [(Path(name), archive.read(name)) for name in archive.namelist()]
+    expected = [list(rmhfile.RMHFile.from_stream(io.BytesIO(data), path).paragraphs()) for path, data in members]
+
+    def fail(pg):
+        raise AssertionError("The tokens of a paragraph were built")
+
+    monkeypatch.setattr(rmhfile, "_paragraph_record", fail)
+    assert [rmhfile.RMHFile(data.decode("utf-8"), path).paragraphs() for path, data in members] == expected
+
+
+def _contents(rmhf):
+    """The header fields, paragraphs, sentences and tokens of a file."""
+    fields = []
+    for name in ("id", "idno", "title", "author", "date", "source", "ref"):
+        try:
+            value = getattr(rmhf, name)
+            fields.append(value() if callable(value) else value)
+        except ValueError as e:
+            fields.append(str(e))
+    return fields, [(pg.index, pg.text, pg.sentences) for pg in rmhf.paragraph_records()]
+
+
+def _with_markup(xml):
+    """Add comments, processing instructions, entities and tail text to a generated file."""
+    xml = xml.replace("?>\n", "?>\n<!-- before the root --><?pi before the root?>\n", 1)
+    xml = xml.replace("<teiHeader>", "<teiHeader><!-- in the header -->", 1)
+    xml = xml.replace("</title>", "<!-- c -->&#237;&amp;</title>", 1)
+    for tag in ("p", "seg"):
+        xml = xml.replace(f'<{tag} n="1">', f'<{tag} n="1">A &amp; &lt;b&gt;<!-- a comment -->c<?pi x?> &#237;d ', 1)
+    # A comment and an entity in a token, and text after a sentence
+    xml = xml.replace("</w>", "<!-- c -->&#237;</w>", 1)
+    xml = xml.replace("</s>", "</s> after the sentence", 1)
+    return xml
+
+
+@pytest.mark.parametrize("annotated", [False, True], ids=["plain", "annotated"])
+@pytest.mark.parametrize("subcorpus", synthetic_rmh.SUBCORPORA)
+@pytest.mark.parametrize("engine", list(rmhfile.ENGINES))
+def test_engines_give_the_same_contents(engine, subcorpus, annotated):
+    rng = random.Random(0)
+    for index in range(3):
+        doc = synthetic_rmh.make_document(rng, subcorpus, index, paragraphs=3)
+        xml = _with_markup(synthetic_rmh.document_to_xml(subcorpus, doc, annotated=annotated))
+        path = Path(synthetic_rmh.member_path(subcorpus, doc, annotated=annotated))
+        expected = _contents(rmhfile.RMHFile(xml, path))
+        assert expected[1][0][1].startswith("A & <b>c í")
+        assert _contents(rmhfile.RMHFile.from_stream(io.BytesIO(xml.encode("utf-8")), path, engine)) == expected
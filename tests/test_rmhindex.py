@@ -0,0 +1,47 @@
+import io
+import zipfile
+from pathlib import Path
+
+import pytest
+
+import extract_rmh
+import rmhfile
+import rmhindex
+import synthetic_rmh
+
+
+@pytest.mark.parametrize(
+    "args, parsing_function",
+    [([], extract_rmh.extract_rmh_to_txt), (["--to_segments"], extract_rmh.extract_rmh_to_segments)],
+)
+def test_documents_are_read_back_from_their_offsets(tmp_path, run_script, args, parsing_function):
+    zip_path = tmp_path / "adjud.zip"
+    synthetic_rmh.write_archive(zip_path, "adjud", 30, paragraphs=2)
+    out_dir = tmp_path / "out"
+    run_script(
+        "extract_rmh.py", "-i", zip_path, "-o", out_dir, "--flatten_depth", 2, "--processes", 2, "--doc_index", *args
+    )
+    with zipfile.ZipFile(zip_path) as archive:
+        members = {name: archive.read(name) for name in archive.namelist()}
+
+    reader = rmhindex.DocumentReader(out_dir / rmhindex.INDEX_FILE_NAME)
+    output_files = reader.output_files()
+    assert len(output_files) > 1
+    indexed = 0
+    for output_file in output_files:
+        documents = reader.documents(output_file)
+        # The documents follow each other and cover the whole output file
+        assert [document.position for document in documents] == list(range(len(documents)))
+        assert [document.offset for document in documents] == [0] + [
+            document.offset + document.length for document in documents[:-1]
+        ]
+        assert reader.read(documents) == (out_dir / output_file).read_bytes()
+        texts = dict(reader.iter_texts(output_file))
+        for document in documents:
+            member = members[document.member]
+            expected = parsing_function(rmhfile.RMHFile.from_stream(io.BytesIO(member), Path(document.member)))
+            assert reader.read([document]).decode("utf-8") == texts[document] == expected
+            assert reader.find(document.idno) == [document]
+            indexed += 1
+    reader.close()
+    assert indexed == len(members)
@@ -0,0 +1,19 @@
+import rmhsearch
+
+
+def _add_chunks(postings):
+    # Many terms with a single posting each, so the number of postings alone stays small
+    for chunk in range(10):
+        postings.add({f"form:term{chunk}.{i}": [i] for i in range(50)}, chunk * 50)
+    return list(postings.items())
+
+
+def test_segments_are_flushed_on_the_byte_budget(tmp_path):
+    (tmp_path / "default").mkdir()
+    (tmp_path / "small").mkdir()
+    default = rmhsearch.SegmentedPostings(tmp_path / "default", rmhsearch.DEFAULT_MAX_POSTINGS)
+    small = rmhsearch.SegmentedPostings(tmp_path / "small", rmhsearch.DEFAULT_MAX_POSTINGS, max_bytes=10_000)
+    expected = _add_chunks(default)
+    assert _add_chunks(small) == expected
+    assert len(default.segment_files) == 1
+    assert len(small.segment_files) > 1
@@ -0,0 +1,47 @@
+import io
+import zipfile
+from pathlib import Path
+
+import pytest
+
+import rmhfile
+import rmhshard
+import synthetic_rmh
+
+
+def _members(zip_path):
+    with zipfile.ZipFile(zip_path) as archive:
+        return [(Path(name), archive.read(name)) for name in archive.namelist()]
+
+
+@pytest.mark.parametrize("subcorpus", synthetic_rmh.SUBCORPORA)
+def test_saved_shard_gives_the_sentences_of_the_files(tmp_path, subcorpus):
+    zip_path = tmp_path / f"{subcorpus}.ana.zip"
+    synthetic_rmh.write_archive(zip_path, subcorpus, 5, annotated=True)
+    members = _members(zip_path)
+    # Paragraph and sentence numbers which are not plain integers, or are missing
+    members[0] = (members[0][0], members[0][1].replace(b'<s n="1">', b"<s>").replace(b' n="2">', b' n="2a">'))
+    expected = [
+        sentence for path, data in members for sentence in rmhfile.RMHFile(data.decode("utf-8"), path).sentences()
+    ]
+    assert any(".None" in sentence.index for sentence in expected)
+    assert any(".2a." in sentence.index for sentence in expected)
+
+    path = tmp_path / f"{subcorpus}{rmhshard.SHARD_FILE_SUFFIX}"
+    writer = rmhshard.TokenShardWriter(path)
+    writer.writelines(
+        rmhshard.extract_rmh_to_shard(rmhfile.RMHFile.from_stream(io.BytesIO(data), path))
+        for path, data in members
+    )
+    writer.close()
+
+    shard = rmhshard.TokenShard.load(path)
+    assert list(shard.sentences()) == expected
+    assert shard.n_tokens == sum(len(sentence.tokens) for sentence in expected)
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "x.rmhshard"
+    path.write_bytes(b"not a shard")
+    with pytest.raises(ValueError):
+        rmhshard.TokenShard.load(path)
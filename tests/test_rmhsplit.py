@@ -0,0 +1,27 @@
+import rmhsplit
+
+PARAGRAPHS = [
+    "Fyrsta setningin. Önnur setningin.",
+    "  Bil á undan. Og á eftir.  ",
+    "Hann sagði: „Já.“ Svo fór hann.",
+    "Ein setning",
+]
+
+
+def test_split_batch_is_the_same_as_splitting_each_paragraph():
+    assert rmhsplit.split_batch(PARAGRAPHS) == [rmhsplit.split_paragraph(x) for x in PARAGRAPHS]
+
+
+def test_split_batch_falls_back_when_the_text_is_not_recovered(monkeypatch):
+    # A tokenizer which loses the last sentence of the text, so the paragraph count of a batch still matches
+    split = rmhsplit.split_into_sentences
+    calls = []
+
+    def lossy_split(text, original):
+        calls.append(text)
+        return list(split(text, original=original))[:-1]
+
+    monkeypatch.setattr(rmhsplit, "split_into_sentences", lossy_split)
+    rmhsplit.split_batch(PARAGRAPHS)
+    # The batch and then each paragraph on its own
+    assert calls[1:] == PARAGRAPHS
@@ -0,0 +1,28 @@
+import threading
+
+import rmhwriter
+
+
+def test_close_raises_when_completing_the_last_shard_fails(tmp_path, monkeypatch):
+    def fail(self, index):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(rmhwriter.ShardedOutputFile, "_complete_shard", fail)
+    output = rmhwriter.ShardedOutputFile(tmp_path / f"out{rmhwriter.SHARD_INDEX_SUFFIX}", compression="none")
+    output.writelines(["a document\n", "another document\n"])
+
+    errors = []
+
+    def close():
+        try:
+            output.close()
+        except BaseException as e:
+            errors.append(e)
+
+    closing = threading.Thread(target=close, daemon=True)
+    closing.start()
+    closing.join(timeout=10)
+    assert not closing.is_alive(), "close() did not return"
+    assert len(errors) == 1
+    assert isinstance(errors[0], RuntimeError)
+    assert isinstance(errors[0].__cause__, OSError)